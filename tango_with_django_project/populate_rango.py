@@ -4,7 +4,8 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'tango_with_django_project.settings'
 import django
 django.setup()
 
-from rango.models import Category, Page
+from rango.importer import import_rows
+from rango.models import Page
 
 
 def populate():
@@ -122,32 +123,22 @@ def populate():
         }
     }
 
+    rows = []
     for cat, cat_data in cats.items():
-        c = add_cat(cat, cat_data["views"], cat_data["likes"])
         for p in cat_data["pages"]:
-            add_page(c, p["title"], p["url"], p["views"])
-
-    for c in Category.objects.all():
-        for p in Page.objects.filter(category=c):
-            print("- {0} - {1}".format(str(c), str(p)))
-
-
-def add_page(cat, title, url, views):
-
-    p = Page.objects.get_or_create(category=cat, title=title)[0]
-
-    p.url = url
-    p.views = views
-    p.save()
-    return p
-
-
-def add_cat(name, views, likes):
-    c = Category.objects.get_or_create(name=name)[0]
-    c.views = views
-    c.likes = likes
-    c.save()
-    return c
+            rows.append({
+                "category": cat,
+                "category_views": cat_data["views"],
+                "category_likes": cat_data["likes"],
+                "title": p["title"],
+                "url": p["url"],
+                "views": p["views"],
+            })
+
+    print(import_rows(rows))
+
+    for p in Page.objects.select_related('category').order_by('category__name'):
+        print("- {0} - {1}".format(str(p.category), str(p)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,115 @@
+"""
+Denormalized page counts and views of categories.
+
+Category.page_count and Category.total_page_views hold the COUNT and SUM
+of the category's pages, so categories can be shown with them and
+ranked by them (see RANKINGS) without reading any page. They're updated
+incrementally:
+
+- page_created() and page_deleted(), from Page's post_save and
+  post_delete signals
+- views_flushed(), after rango.counters wrote buffered page views
+- by rango.importer, whose bulk statements send no signals
+
+each with UPDATE ... SET field = field + n statements, like counter
+flushes, so concurrent writers don't undo each other's changes.
+
+Pages whose views are saved or which move to another category through
+save(), and raw SQL, aren't followed. reconcile(), run by the
+reconcile_categories management command, recomputes every category
+with one grouped query and adds the difference to those that drifted.
+"""
+import collections
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import Category, Page
+
+
+# category orderings, the sidebar and index page use one of them
+RANKINGS = {
+    'likes': ('-likes', 'name'),
+    'views': ('-total_page_views', 'name'),
+    'pages': ('-page_count', 'name'),
+}
+
+RANKING_TITLES = {
+    'likes': 'Most Liked Categories',
+    'views': 'Most Viewed Categories',
+    'pages': 'Largest Categories',
+}
+
+
+def ranked_categories(ranking):
+    """
+    Categories ordered by [ranking], a key of RANKINGS
+    """
+    return Category.objects.order_by(*RANKINGS[ranking])
+
+
+def add_to_categories(deltas, using=DEFAULT_DB_ALIAS):
+    """
+    Adds {category id: (pages, views)} [deltas] to the aggregates.
+    Categories changed by the same amounts share one UPDATE.
+    """
+    by_amount = collections.defaultdict(list)
+    for pk, amounts in deltas.items():
+        if any(amounts):
+            by_amount[amounts].append(pk)
+
+    # update() skips auto_now
+    now = timezone.now()
+    for (pages, views), pks in by_amount.items():
+        Category.objects.using(using).filter(pk__in=pks).update(
+            page_count=F('page_count') + pages,
+            total_page_views=F('total_page_views') + views,
+            modified=now)
+
+
+def page_created(page, using=DEFAULT_DB_ALIAS):
+    add_to_categories({page.category_id: (1, page.views)}, using)
+
+
+def page_deleted(page, using=DEFAULT_DB_ALIAS):
+    add_to_categories({page.category_id: (-1, -page.views)}, using)
+
+
+def views_flushed(deltas):
+    """
+    Adds the {page id: views} [deltas] of a counter flush to the
+    categories of the pages. Returns their {category id: views}.
+    """
+    categories = collections.Counter()
+    for pk, category_id in Page.objects.filter(
+            pk__in=list(deltas)).values_list('pk', 'category_id'):
+        categories[category_id] += deltas[pk]
+    add_to_categories({pk: (0, views) for pk, views in categories.items()})
+    return categories
+
+
+def reconcile(fix=True):
+    """
+    Recomputes the aggregates of every category and, if [fix], adds the
+    differences to those that drifted. Returns how many drifted.
+
+    The differences are added like any other change, so flushes and page
+    writes landing between the read and the UPDATE are kept rather than
+    overwritten with the values read.
+    """
+    with transaction.atomic():
+        actual = {
+            pk: (pages, views or 0) for pk, pages, views in
+            Page.objects.order_by().values_list('category')
+            .annotate(Count('pk'), Sum('views'))}
+
+        drifted = {}
+        for pk, pages, views in Category.objects.values_list(
+                'pk', *Category.AGGREGATE_FIELDS).iterator():
+            expected_pages, expected_views = actual.get(pk, (0, 0))
+            if (pages, views) != (expected_pages, expected_views):
+                drifted[pk] = (expected_pages - pages, expected_views - views)
+        if fix:
+            add_to_categories(drifted)
+    return len(drifted)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RangoConfig(AppConfig):
     name = 'rango'
+
+    def ready(self):
+        # connect signal receivers
+        from . import database, signals
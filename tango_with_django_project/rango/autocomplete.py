@@ -0,0 +1,280 @@
+"""
+In-memory prefix index answering suggest_category autocomplete requests.
+
+Category names are kept lowercased in a sorted list, so the categories
+starting with a prefix form one contiguous slice found with two binary
+searches. Matches are ranked by likes, then views, then name. Results are
+memoized per prefix until the index changes, which keeps the short, busy
+prefixes ('p', 'py'...) as cheap as the long ones.
+
+Each process builds its index from the database on first use. Signal
+receivers in rango.signals keep it in sync with Category saves, deletes
+and flushed likes. Saves and deletes in other processes are noticed
+through a generation number stored in Django's cache, which must be
+shared between processes (see CACHES in settings.py). Likes flushed by
+other processes, e.g. the task worker running flush_counters, are picked
+up by rebuilding the index every REFRESH_SECONDS. That rebuild runs in a
+background thread while searches keep using the old index, and the new
+one replaces it when it's ready. Only the first build, and rebuilds after
+another process added or removed categories, make a search wait.
+"""
+import bisect
+import heapq
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Category
+
+
+GENERATION_KEY = 'rango:autocomplete:generation'
+
+# likes flushed by other processes show up within this long
+REFRESH_SECONDS = 60
+
+
+class Suggestion(object):
+    """
+    A category as stored in the index
+    """
+    __slots__ = ('id', 'name', 'slug', 'likes', 'views')
+
+    def __init__(self, id, name, slug, likes, views):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.likes = likes
+        self.views = views
+
+    @property
+    def key(self):
+        return (self.name.lower(), self.id)
+
+    @property
+    def rank(self):
+        return (-self.likes, -self.views, self.name)
+
+
+class PrefixIndex(object):
+    """
+    Case-insensitive prefix search over Suggestion objects
+    """
+
+    def __init__(self, suggestions=(), memo_size=4096):
+        self.memo_size = memo_size
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._keys = []
+        self._memo = {}
+        with self._lock:
+            for suggestion in suggestions:
+                self._by_id[suggestion.id] = suggestion
+            self._keys = sorted(s.key for s in self._by_id.values())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, suggestion):
+        """
+        Adds [suggestion], replacing any entry with the same id
+        """
+        with self._lock:
+            self._remove(suggestion.id)
+            self._by_id[suggestion.id] = suggestion
+            bisect.insort(self._keys, suggestion.key)
+            self._memo.clear()
+
+    def remove(self, category_id):
+        with self._lock:
+            self._remove(category_id)
+            self._memo.clear()
+
+    def _remove(self, category_id):
+        old = self._by_id.pop(category_id, None)
+        if old is not None:
+            position = bisect.bisect_left(self._keys, old.key)
+            del self._keys[position]
+
+    def add_likes(self, deltas):
+        """
+        Applies flushed like counts, {category id: increment}
+        """
+        with self._lock:
+            for category_id, amount in deltas.items():
+                suggestion = self._by_id.get(category_id)
+                if suggestion is not None:
+                    suggestion.likes += amount
+            self._memo.clear()
+
+    def search(self, prefix, limit=8):
+        """
+        Returns up to [limit] Suggestions whose name starts with [prefix],
+        ignoring case, best ranked first. A [limit] of None returns all.
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+
+        with self._lock:
+            results = self._memo.get((prefix, limit))
+            if results is None:
+                start = bisect.bisect_left(self._keys, (prefix,))
+                end = bisect.bisect_left(self._keys, (prefix + '\uffff',))
+                matches = (self._by_id[key[1]] for key in self._keys[start:end])
+                if limit is None:
+                    results = sorted(matches, key=lambda s: s.rank)
+                else:
+                    results = heapq.nsmallest(limit, matches,
+                                              key=lambda s: s.rank)
+
+                if len(self._memo) >= self.memo_size:
+                    self._memo.clear()
+                self._memo[prefix, limit] = results
+            return list(results)
+
+
+def suggestion_from_category(category):
+    return Suggestion(category.id, category.name, category.slug,
+                      category.likes, category.views)
+
+
+def load_prefix_index():
+    """
+    Builds a PrefixIndex of every Category in one query
+    """
+    rows = (Category.objects
+            .values_list('id', 'name', 'slug', 'likes', 'views')
+            .iterator())
+    return PrefixIndex(Suggestion(*row) for row in rows)
+
+
+_index = None
+_generation = None
+_loaded_at = None
+_index_lock = threading.Lock()
+
+# a background rebuild is running, and the category saves and deletes
+# made meanwhile, replayed on the new index before it's swapped in.
+# Likes aren't replayed, the new index may already have read them; one
+# flushed while the rebuild reads is left to the next rebuild.
+_refreshing = False
+_missed = []
+
+
+def current_generation():
+    return cache.get(GENERATION_KEY, 0)
+
+
+def get_prefix_index():
+    """
+    Returns this process's PrefixIndex, building it when it doesn't exist
+    yet or categories were added or removed by another process. An index
+    older than REFRESH_SECONDS is returned as is while a new one is built
+    in the background.
+    """
+    global _index, _generation, _loaded_at
+    generation = current_generation()
+    if _index is None or generation != _generation:
+        with _index_lock:
+            if _index is None or generation != _generation:
+                _index = load_prefix_index()
+                _generation = generation
+                _loaded_at = time.monotonic()
+    index = _index
+    if time.monotonic() - _loaded_at >= REFRESH_SECONDS:
+        _refresh_later()
+    return index
+
+
+def _refresh_later():
+    global _refreshing
+    with _index_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+        old = _index
+    threading.Thread(target=_refresh, args=(old,), daemon=True).start()
+
+
+def _refresh(old):
+    """
+    Builds a new index and swaps it in for [old], unless [old] was
+    replaced meanwhile
+    """
+    global _index, _loaded_at, _refreshing
+    try:
+        loaded_at = time.monotonic()
+        index = load_prefix_index()
+        with _index_lock:
+            if _index is old:
+                for change in _missed:
+                    change(index)
+                _index = index
+                _loaded_at = loaded_at
+    finally:
+        with _index_lock:
+            _refreshing = False
+            del _missed[:]
+        # the thread's own connection, requests close theirs
+        connection.close()
+
+
+def suggest(prefix, limit=8):
+    return get_prefix_index().search(prefix, limit)
+
+
+def _bump_generation():
+    global _generation
+    cache.add(GENERATION_KEY, 0, None)
+    try:
+        generation = cache.incr(GENERATION_KEY)
+    except ValueError:
+        return
+    # our own index is already up to date with this change
+    if _generation is not None and generation == _generation + 1:
+        _generation = generation
+
+
+def _change(change):
+    """
+    Applies [change] to the index, and to the one being built if any
+    """
+    with _index_lock:
+        if _index is not None:
+            change(_index)
+        if _refreshing:
+            _missed.append(change)
+
+
+def category_saved(category):
+    suggestion = suggestion_from_category(category)
+    _change(lambda index: index.add(suggestion))
+    _bump_generation()
+
+
+def category_deleted(category):
+    _change(lambda index: index.remove(category.id))
+    _bump_generation()
+
+
+def likes_flushed(deltas):
+    if _index is not None:
+        _index.add_likes(deltas)
+
+
+def invalidate():
+    """
+    Rebuilds the index of every process on its next search
+    """
+    reset_prefix_index()
+    _bump_generation()
+
+
+def reset_prefix_index():
+    global _index, _generation, _loaded_at
+    with _index_lock:
+        _index = None
+        _generation = None
+        _loaded_at = None
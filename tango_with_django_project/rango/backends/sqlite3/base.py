@@ -0,0 +1,13 @@
+"""
+Django's SQLite backend, beginning transactions as configured by
+RANGO_SQLITE['TRANSACTION_MODE'], see rango/database.py
+"""
+from django.db.backends.sqlite3 import base
+
+from rango.database import begin_statement
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(begin_statement())
@@ -0,0 +1,321 @@
+"""
+Query count and latency benchmark for every URL in rango.urls, run by
+the benchmark_rango management command.
+
+seed_dataset() fills the database through rango.importer with a number
+of pages spread over categories (one per hundred pages), plus users
+and profiles. run_benchmark() then requests every route in ROUTES
+through the test client and records, per route:
+
+    status = HTTP status of the last response
+    queries = most SQL queries a single request issued
+    mean_ms, p50_ms, p95_ms, max_ms = wall time per request
+    alloc_peak_kb = peak Python memory allocated during one request
+
+Searches go to StubSearchBackend instead of Webhose, so results don't
+depend on the network, and counters aren't flushed while measuring.
+By default every route is measured warm, as it would be served in
+steady state; cold=True clears the cache before each request. The
+commands seed and measure with BENCHMARK_CACHES, so the running site's
+cache is neither cleared nor filled with pages of the seeded data.
+
+compare_reports() lists the routes that issue more queries than a stored
+baseline report, or whose p95 grew past a tolerance.
+"""
+import gc
+import math
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .category_pages import category_pages
+from .counters import flush_counters
+from .importer import import_rows
+from .models import Category, Page, Task, UserProfile
+from .ratelimit import get_ratelimit_settings
+from .search_backends import BaseSearchBackend
+
+
+DATASETS = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rango-benchmark',
+    },
+}
+
+
+class BenchmarkError(Exception):
+    """
+    Raised when a report can't be compared with a baseline.
+    """
+
+
+class StubSearchBackend(BaseSearchBackend):
+    """
+    Answers every query locally with [size] made up results
+    """
+
+    def search(self, search_terms, size=10):
+        return [{'title': '{0} {1}'.format(search_terms, i),
+                 'link': 'http://example.com/{0}'.format(i),
+                 'summary': 'summary ' * 25}
+                for i in range(size)]
+
+
+class Route(object):
+    """
+    How to request the URL named [name]. [args] and [data] are callables
+    taking the Dataset, so they can point at seeded rows.
+    """
+
+    def __init__(self, name, args=None, data=None, method='get', login=False):
+        self.name = name
+        self.args = args
+        self.data = data
+        self.method = method
+        self.login = login
+
+    def request(self, client, dataset):
+        path = reverse('rango:' + self.name,
+                       args=self.args(dataset) if self.args else None)
+        data = self.data(dataset) if self.data else None
+        response = getattr(client, self.method)(path, data)
+        if response.streaming:
+            # streamed responses do their work while being read
+            for chunk in response.streaming_content:
+                pass
+        return path, response
+
+
+ROUTES = [
+    Route('index'),
+    Route('about'),
+    Route('category_list'),
+    Route('show_category', args=lambda d: [d.slug]),
+    Route('category_page_rows', args=lambda d: [d.slug],
+          data=lambda d: {'after': d.pages_cursor}),
+    Route('category_search_results', args=lambda d: [d.slug], login=True),
+    Route('add_category', login=True),
+    Route('add_page', data=lambda d: {'cat_id': d.category_id,
+                                      'url': 'http://example.com/benchmark',
+                                      'name': 'Benchmark'}, login=True),
+    Route('export', login=True),
+    Route('logout', login=True),
+    Route('metrics', login=True),
+    Route('metrics_profiles', login=True),
+    Route('restricted', login=True),
+    Route('task_queue', login=True),
+    Route('task_status', args=lambda d: [d.task_id], login=True),
+    Route('search', data=lambda d: {'query': 'python'}, method='post'),
+    Route('search_results', data=lambda d: {'query': 'python'}),
+    Route('goto', data=lambda d: {'page_id': d.page_id}),
+    Route('edit_profile', login=True),
+    Route('list_users', login=True),
+    Route('profile', args=lambda d: [d.profile_id], login=True),
+    Route('like_category', data=lambda d: {'cat_id': d.category_id},
+          login=True),
+    Route('suggest_category', data=lambda d: {'suggestion': 'cat'}),
+]
+
+
+class Dataset(object):
+    """
+    Rows of a seeded database the routes point at
+    """
+
+    def __init__(self, pages, user):
+        self.pages = pages
+        self.user = user
+        category = Category.objects.order_by('pk').first()
+        self.slug = category.slug
+        self.category_id = category.pk
+        self.page_id = Page.objects.filter(category=category).values_list(
+            'pk', flat=True).first()
+        self.pages_cursor = category_pages(category).next_cursor
+        self.profile_id = user.user_profile.pk
+        self.task_id = Task.objects.values_list('pk', flat=True).first()
+
+
+def seed_dataset(pages, users=100, chunk_size=5000):
+    """
+    Imports [pages] pages over one category per hundred pages, and
+    creates [users] users with profiles. Returns the Dataset.
+    """
+    categories = max(pages // 100, 1)
+    import_rows(({'category': 'Category {0}'.format(i % categories),
+                  'category_likes': (i * 7) % 101,
+                  'category_views': (i * 13) % 1009,
+                  'title': 'Page {0}'.format(i),
+                  'url': 'http://example.com/pages/{0}'.format(i),
+                  'views': (i * 31) % 997}
+                 for i in range(pages)), chunk_size=chunk_size)
+
+    User.objects.bulk_create(User(username='user{0}'.format(i))
+                             for i in range(users))
+    UserProfile.objects.bulk_create(UserProfile(user=user)
+                                    for user in User.objects.all())
+
+    user = User.objects.create_user('benchmark', password='benchmark')
+    UserProfile.objects.create(user=user)
+    # a finished task for task_status to show
+    Task.objects.create(name=flush_counters.task_name, status=Task.DONE)
+    return Dataset(pages, user)
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(fraction * len(ordered))) - 1, 0)]
+
+
+def measure(route, client, dataset, iterations=50, warmup=2, cold=False):
+    """
+    Requests [route] [warmup] + [iterations] times and returns its
+    dictionary of the report.
+    """
+    times = []
+    queries = 0
+    for iteration in range(warmup + iterations):
+        if route.login:
+            client.force_login(dataset.user)
+        else:
+            client.logout()
+        if cold:
+            cache.clear()
+
+        # collection pauses would land on random requests, keep them out
+        gc.collect()
+        gc.disable()
+        try:
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                path, response = route.request(client, dataset)
+                elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+
+        if iteration >= warmup:
+            times.append(elapsed * 1000)
+            queries = max(queries, len(captured))
+
+    # allocations are traced in a separate request, tracing slows it down
+    tracemalloc.start()
+    try:
+        route.request(client, dataset)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'path': path,
+        'status': response.status_code,
+        'queries': queries,
+        'mean_ms': round(sum(times) / len(times), 3),
+        'p50_ms': round(percentile(times, 0.5), 3),
+        'p95_ms': round(percentile(times, 0.95), 3),
+        'max_ms': round(max(times), 3),
+        'alloc_peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmark(dataset, routes=ROUTES, iterations=50, warmup=2,
+                  cold=False):
+    """
+    Measures each of [routes] and returns the report as a dictionary
+    """
+    report = {
+        'dataset': {'pages': dataset.pages,
+                    'categories': Category.objects.count()},
+        'iterations': iterations,
+        'cold': cold,
+        'routes': {},
+    }
+
+    search_settings = {
+        'BACKEND': 'rango.benchmark.StubSearchBackend',
+        'CACHE': None,
+    }
+    # limited routes are still checked, but never refused
+    limits = {name: (10 ** 9, 1)
+              for name in get_ratelimit_settings()['LIMITS']}
+    with override_settings(RANGO_SEARCH=search_settings,
+                           RANGO_COUNTERS={'FLUSH_INTERVAL': 60 * 60},
+                           RANGO_RATELIMIT={'LIMITS': limits}):
+        client = Client()
+        for route in routes:
+            report['routes'][route.name] = measure(
+                route, client, dataset, iterations, warmup, cold)
+    return report
+
+
+def compare_reports(report, baseline, tolerance=0.5, slack_ms=2.0):
+    """
+    Returns a (route name, kind, message) tuple for every route of
+    [report] that issues more queries than in [baseline] (kind 'queries'),
+    or whose p95 is over the baseline's by more than [tolerance], a
+    fraction, plus [slack_ms] (kind 'p95').
+    Routes missing from the baseline are skipped.
+    """
+    for key in ('dataset', 'cold'):
+        if report[key] != baseline[key]:
+            raise BenchmarkError(
+                'Baseline was recorded with {0} {1!r}, not {2!r}'.format(
+                    key, baseline[key], report[key]))
+
+    regressions = []
+    for name, result in sorted(report['routes'].items()):
+        expected = baseline['routes'].get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append((name, 'queries',
+                                '{0}: {1} queries, baseline {2}'.format(
+                                    name, result['queries'],
+                                    expected['queries'])))
+        limit = expected['p95_ms'] * (1 + tolerance) + slack_ms
+        if result['p95_ms'] > limit:
+            regressions.append((name, 'p95',
+                                '{0}: p95 {1:.1f}ms, baseline {2:.1f}ms'.format(
+                                    name, result['p95_ms'],
+                                    expected['p95_ms'])))
+    return regressions
+
+
+def benchmark_against(baseline, dataset, routes=ROUTES, tolerance=0.5,
+                      retries=2, **options):
+    """
+    Runs the benchmark and compares it with [baseline].
+    Query counts are deterministic, but a single noisy run can push a
+    p95 past the baseline, so routes that are only slower are measured
+    up to [retries] more times and their best run is kept.
+    Returns (report, regressions).
+    """
+    report = run_benchmark(dataset, routes, **options)
+    regressions = compare_reports(report, baseline, tolerance)
+
+    for attempt in range(retries):
+        slow = {name for name, kind, message in regressions if kind == 'p95'}
+        if not slow:
+            break
+        again = run_benchmark(dataset, [r for r in routes if r.name in slow],
+                              **options)
+        for name, result in again['routes'].items():
+            if result['p95_ms'] < report['routes'][name]['p95_ms']:
+                report['routes'][name] = result
+        regressions = compare_reports(report, baseline, tolerance)
+
+    return report, regressions
@@ -0,0 +1,40 @@
+"""
+Bulk write helpers for Django 1.11, which has bulk_create but no
+bulk_update.
+"""
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+
+def bulk_update(model, objs, fields, batch_size=200):
+    """
+    Writes [fields] of every object in [objs] with one UPDATE per batch:
+
+        UPDATE table SET field = CASE WHEN id = 1 THEN ... END
+        WHERE id IN (...)
+
+    Each object costs two parameters per field plus its primary key, so
+    the default batch size stays under SQLite's limit of 999 parameters
+    for a few fields. auto_now fields are set to the current time.
+    Returns the number of rows updated.
+    """
+    objs = list(objs)
+    updated = 0
+
+    now = timezone.now()
+    touched = {f.name: now for f in model._meta.concrete_fields
+               if getattr(f, 'auto_now', False) and f.name not in fields}
+
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        values = dict(touched)
+        for name in fields:
+            field = model._meta.get_field(name)
+            values[name] = Case(
+                *[When(pk=obj.pk, then=Value(getattr(obj, name)))
+                  for obj in batch],
+                output_field=field)
+        updated += model.objects.filter(
+            pk__in=[obj.pk for obj in batch]).update(**values)
+
+    return updated
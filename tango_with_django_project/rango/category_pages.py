@@ -0,0 +1,47 @@
+"""
+Paginated page lists of a category, shown by show_category and extended
+by the category_pages fragment as the user scrolls.
+
+Pages are listed most viewed first and read with keyset pagination on
+(views, id) (see rango.keyset), which the (category, -views, -id) index
+on Page answers directly, so a category with 50k pages costs no more to
+show than one with 50.
+
+    RANGO_CATEGORY_PAGES = {
+        'PAGE_SIZE': 25,    # pages per chunk of the list
+    }
+"""
+from django.conf import settings
+
+from . import keyset
+from .models import Page
+
+
+CATEGORY_PAGES_DEFAULTS = {
+    'PAGE_SIZE': 25,
+}
+
+# id breaks ties between pages with as many views
+ORDERING = ['-views', '-id']
+
+
+def get_category_pages_settings():
+    """
+    Returns CATEGORY_PAGES_DEFAULTS updated with RANGO_CATEGORY_PAGES
+    """
+    options = dict(CATEGORY_PAGES_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_CATEGORY_PAGES', {}))
+    return options
+
+
+def category_pages(category, after=None):
+    """
+    Returns the KeysetPage of [category]'s pages following cursor [after].
+    Rows are dictionaries with the id, title and views of each page.
+    Raises keyset.InvalidCursorError for a malformed cursor.
+    """
+    pages = Page.objects.filter(category=category).values('id', 'title',
+                                                          'views')
+    return keyset.paginate(pages, ORDERING,
+                           get_category_pages_settings()['PAGE_SIZE'],
+                           after=after)
@@ -0,0 +1,52 @@
+"""
+Search results suggested on a category page.
+
+A category is searched for its name and the titles of its most viewed
+pages (RANGO_SEARCH['RELATED_QUERIES'] of them), all at once through
+run_queries(), so it takes as long as the slowest query. The results
+are merged without repeated links, and links the category already has
+as pages are left out, since there is nothing left to add. Links are
+compared after normalize_link() in both cases.
+"""
+from .models import Page
+from .search_backends import get_search_settings
+from .webhose_search import normalize_link, run_queries
+
+
+def category_queries(category):
+    """
+    The category's name followed by the titles of its top pages
+    """
+    related = get_search_settings()['RELATED_QUERIES']
+    titles = []
+    if related:
+        titles = list(category.pages.order_by('-views', '-id')
+                      .values_list('title', flat=True)[:related])
+    return [category.name] + titles
+
+
+def exclude_known(category, results):
+    """
+    [results] without the links already saved as pages of [category],
+    compared with normalize_link() like merge_results() does
+    """
+    if not results:
+        return results
+    known = {normalize_link(url) for url in
+             Page.objects.filter(category=category)
+             .values_list('url', flat=True).iterator()}
+    return [result for result in results
+            if normalize_link(result['link']) not in known]
+
+
+def category_search(category, query=None, size=10):
+    """
+    Results for [query], or the category's queries when it's None, minus
+    the category's pages. Returns None if the search provider didn't
+    answer before the deadline.
+    """
+    queries = [query] if query else category_queries(category)
+    results = run_queries(queries, size)
+    if results is None:
+        return None
+    return exclude_known(category, results)
@@ -0,0 +1,349 @@
+"""
+Write-coalescing counters for Page.views and Category.likes.
+
+Views and likes used to be counted with a read-modify-write on the model
+(page.views += 1; page.save()), which loses increments under concurrent
+clicks and rewrites every column. Increments now go into a store and are
+flushed in batches of UPDATE ... SET field = field + n statements.
+
+Configured through the RANGO_COUNTERS setting:
+
+    RANGO_COUNTERS = {
+        'STORE': 'memory',       # 'memory' (per process) or 'cache'
+        'CACHE_ALIAS': 'default',
+        'FLUSH_INTERVAL': 5,     # seconds, 0 writes every increment through
+    }
+
+The 'memory' store is flushed by the process holding it, on the first
+increment after FLUSH_INTERVAL and when the process exits. The 'cache'
+store is shared by every process using the cache, so the flush_counters
+management command or task can flush it from outside the web workers.
+With FLUSH_INTERVAL None requests never flush, leaving it to the task
+worker running flush_counters periodically (see rango.tasks).
+"""
+import atexit
+import collections
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .replicas import writes_for_others
+from .tasks import task
+
+
+COUNTER_DEFAULTS = {
+    'STORE': 'memory',
+    'CACHE_ALIAS': 'default',
+    'FLUSH_INTERVAL': 5,
+}
+
+# Sent once per model and field after a flush has been written.
+# deltas maps primary keys to the amount they were incremented by.
+counters_flushed = Signal(providing_args=['model', 'field', 'deltas'])
+
+
+def get_counter_settings():
+    """
+    Returns COUNTER_DEFAULTS updated with the project's RANGO_COUNTERS setting
+    """
+    options = dict(COUNTER_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_COUNTERS', {}))
+    return options
+
+
+class MemoryCounterStore(object):
+    """
+    Keeps pending increments in a dictionary guarded by a lock.
+    Keys are (model label, field name, primary key) tuples.
+    """
+
+    def __init__(self):
+        self._deltas = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._deltas[key] += amount
+
+    def pending(self, key):
+        with self._lock:
+            return self._deltas.get(key, 0)
+
+    def drain(self):
+        """
+        Returns every pending increment and forgets them.
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, collections.Counter()
+        return deltas
+
+    def restore(self, deltas):
+        """
+        Puts back increments returned by drain() that could not be written.
+        """
+        with self._lock:
+            self._deltas.update(deltas)
+
+
+class CacheCounterStore(object):
+    """
+    Keeps pending increments in Django's cache, shared between processes.
+
+    Each counter is a cache key updated with the atomic incr/decr.
+    The first increment after a flush also appends the counter to a
+    journal, numbered by an atomic sequence, so drain() knows which
+    counters to read without scanning the cache.
+
+    The mark saying a counter is journalled expires after
+    [dirty_timeout] seconds, so a counter whose journal entry was lost
+    (its writer died between taking a number and storing the entry) is
+    journalled again by a later increment. A counter journalled twice is
+    only drained once, the second entry finds nothing to read.
+    """
+
+    prefix = 'rango:counter'
+
+    def __init__(self, alias='default', dirty_timeout=60):
+        self.cache = caches[alias]
+        self.dirty_timeout = dirty_timeout
+
+    def _key(self, key):
+        return '{0}:{1}:{2}:{3}'.format(self.prefix, *key)
+
+    def add(self, key, amount):
+        counter_key = self._key(key)
+        self.cache.add(counter_key, 0, None)
+        self.cache.incr(counter_key, amount)
+
+        # journal the counter once until it's next drained
+        if self.cache.add(counter_key + ':dirty', 1, self.dirty_timeout):
+            self.cache.add(self.prefix + ':seq', 0, None)
+            number = self.cache.incr(self.prefix + ':seq')
+            self.cache.set('{0}:journal:{1}'.format(self.prefix, number),
+                           key, None)
+
+    def pending(self, key):
+        return self.cache.get(self._key(key)) or 0
+
+    def drain(self):
+        deltas = collections.Counter()
+
+        # only one process may walk the journal at a time
+        lock_key = self.prefix + ':lock'
+        if not self.cache.add(lock_key, 1, 60):
+            return deltas
+
+        try:
+            last = self.cache.get(self.prefix + ':seq') or 0
+            drained = self.cache.get(self.prefix + ':drained') or 0
+            if last < drained:
+                # the sequence was evicted and started again, the entries
+                # drained before it were deleted
+                drained = 0
+            stalled = self.cache.get(self.prefix + ':stalled')
+
+            for number in range(drained + 1, last + 1):
+                journal_key = '{0}:journal:{1}'.format(self.prefix, number)
+                key = self.cache.get(journal_key)
+                if key is None:
+                    if number != stalled:
+                        # the writer may not have stored its entry yet,
+                        # retry next time before giving up on it
+                        self.cache.set(self.prefix + ':stalled', number, None)
+                        break
+                    drained = number
+                    continue
+                counter_key = self._key(key)
+
+                # clear the mark before reading, an increment landing in
+                # between journals the counter again instead of being lost
+                self.cache.delete(counter_key + ':dirty')
+                amount = self.cache.get(counter_key) or 0
+                if amount:
+                    self.cache.decr(counter_key, amount)
+                    deltas[key] += amount
+                self.cache.delete(journal_key)
+                drained = number
+
+            self.cache.set(self.prefix + ':drained', drained, None)
+        finally:
+            self.cache.delete(lock_key)
+
+        return deltas
+
+    def restore(self, deltas):
+        for key, amount in deltas.items():
+            self.add(key, amount)
+
+
+class CounterBuffer(object):
+    """
+    Buffers counter increments in [store] and writes them to the database
+    at most once every [flush_interval] seconds, or only when flush() is
+    called if it's None.
+    """
+
+    def __init__(self, store, flush_interval=5):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._flush_lock = threading.Lock()
+
+    def incr(self, model, pk, field, amount=1):
+        """
+        Adds [amount] to [field] of the [model] row with primary key [pk]
+        """
+        self.store.add((model._meta.label, field, int(pk)), amount)
+        self.maybe_flush()
+
+    def pending(self, model, pk, field):
+        """
+        Returns the increments not yet written to the database
+        """
+        return self.store.pending((model._meta.label, field, int(pk)))
+
+    def maybe_flush(self):
+        if self.flush_interval is None:
+            return
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush(blocking=False)
+
+    def flush(self, blocking=True):
+        """
+        Writes every pending increment to the database.
+        Rows incremented by the same amount share one UPDATE statement.
+        Returns the number of rows updated.
+        """
+        if not self._flush_lock.acquire(blocking):
+            # another thread is already flushing
+            return 0
+
+        try:
+            self._last_flush = time.monotonic()
+            deltas = self.store.drain()
+            if not deltas:
+                return 0
+
+            grouped = collections.defaultdict(dict)
+            for (label, field, pk), amount in deltas.items():
+                grouped[label, field][pk] = amount
+
+            # the increments of every visitor, not the flushing one's, so
+            # its later reads needn't go to the primary
+            with writes_for_others():
+                updated = 0
+                try:
+                    with transaction.atomic():
+                        for (label, field), pk_deltas in grouped.items():
+                            model = apps.get_model(label)
+                            updated += self._write(model, field, pk_deltas)
+                except Exception:
+                    self.store.restore(deltas)
+                    raise
+
+                for (label, field), pk_deltas in grouped.items():
+                    counters_flushed.send(sender=CounterBuffer,
+                                          model=apps.get_model(label),
+                                          field=field,
+                                          deltas=pk_deltas)
+                return updated
+        finally:
+            self._flush_lock.release()
+
+    def _write(self, model, field, pk_deltas):
+        by_amount = collections.defaultdict(list)
+        for pk, amount in pk_deltas.items():
+            by_amount[amount].append(pk)
+
+        # update() skips auto_now, so set those fields ourselves
+        now = timezone.now()
+        touched = {f.name: now for f in model._meta.concrete_fields
+                   if getattr(f, 'auto_now', False)}
+
+        updated = 0
+        for amount, pks in by_amount.items():
+            values = dict(touched)
+            values[field] = F(field) + amount
+            updated += model.objects.filter(pk__in=pks).update(**values)
+        return updated
+
+
+def build_counter_buffer(options=None):
+    """
+    Creates a CounterBuffer from RANGO_COUNTERS (or the given options)
+    """
+    if options is None:
+        options = get_counter_settings()
+
+    if options['STORE'] == 'cache':
+        store = CacheCounterStore(options['CACHE_ALIAS'])
+    else:
+        store = MemoryCounterStore()
+
+    return CounterBuffer(store, options['FLUSH_INTERVAL'])
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_counter_buffer():
+    """
+    Returns the process-wide CounterBuffer
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = build_counter_buffer()
+    return _buffer
+
+
+def incr(model, pk, field, amount=1):
+    """
+    Shortcut for get_counter_buffer().incr()
+    """
+    get_counter_buffer().incr(model, pk, field, amount)
+
+
+@task()
+def flush_counters():
+    """
+    Writes this process's buffered increments, every process's with the
+    'cache' store. Returns the number of rows updated.
+    """
+    return get_counter_buffer().flush()
+
+
+def current_value(model, pk, field):
+    """
+    Returns the value of [field] in the database plus pending increments
+    """
+    value = model.objects.values_list(field, flat=True).get(pk=pk)
+    return value + get_counter_buffer().pending(model, pk, field)
+
+
+@atexit.register
+def _flush_on_exit():
+    if _buffer is not None:
+        try:
+            _buffer.flush()
+        except Exception:
+            # the database may already be gone at interpreter exit
+            pass
+
+
+@receiver(setting_changed)
+def _counter_settings_changed(sender, setting, **kwargs):
+    global _buffer
+    if setting in ('RANGO_COUNTERS', 'CACHES'):
+        with _buffer_lock:
+            _buffer = None
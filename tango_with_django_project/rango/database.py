@@ -0,0 +1,99 @@
+"""
+Tuning of the connections Django opens to SQLite.
+
+SQLite allows one writer at a time. With its default rollback journal a
+write also blocks every reader, so the page view, like and add page
+writes of a busy site queue behind each other and readers wait for
+them. Every new SQLite connection is therefore set up, when the
+connection_created signal is sent, with the pragmas in RANGO_SQLITE:
+
+    RANGO_SQLITE = {
+        'JOURNAL_MODE': 'wal',     # readers don't wait for the writer, see
+                                   # below
+        'SYNCHRONOUS': 'normal',   # no fsync per commit, safe with WAL
+        'BUSY_TIMEOUT': 5000,      # milliseconds to wait for a lock
+        'CACHE_SIZE': -16000,      # pages, or KiB when negative
+        'TEMP_STORE': 'memory',
+        'MMAP_SIZE': 64 * 1024 * 1024,
+        'TRANSACTION_MODE': 'immediate',
+    }
+
+None leaves a pragma at SQLite's default. The pragmas last as long as
+the connection, which is why persistent connections (CONN_MAX_AGE) pay
+for them only once. The journal mode is the exception: it's stored in
+the database file, so it isn't set on every connection, which would
+rewrite the file's header whenever a command such as check or test
+opened it. The set_journal_mode management command sets it to
+JOURNAL_MODE once, when deploying.
+
+Django begins every transaction, including the one around each save(),
+with a plain BEGIN, which only takes the write lock at the first write.
+A transaction that can't get it then fails at once with 'database is
+locked', the busy timeout doesn't apply. The rango.backends.sqlite3
+database backend begins them with BEGIN TRANSACTION_MODE instead, so
+'immediate' transactions wait for the lock from the start.
+
+Other databases are configured in settings.py from RANGO_DB_*
+environment variables. The benchmark_writes management command compares
+write throughput under each configuration.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+SQLITE_DEFAULTS = {
+    'JOURNAL_MODE': 'wal',
+    'SYNCHRONOUS': 'normal',
+    'BUSY_TIMEOUT': 5000,
+    'CACHE_SIZE': -16000,
+    'TEMP_STORE': 'memory',
+    'MMAP_SIZE': 64 * 1024 * 1024,
+    'TRANSACTION_MODE': 'immediate',
+}
+
+# settings set with PRAGMA on every connection, the busy timeout first,
+# as later statements may wait for locks
+PRAGMAS = ['BUSY_TIMEOUT', 'SYNCHRONOUS', 'CACHE_SIZE', 'TEMP_STORE',
+           'MMAP_SIZE']
+
+
+def get_sqlite_settings():
+    """
+    Returns SQLITE_DEFAULTS updated with the RANGO_SQLITE setting
+    """
+    options = dict(SQLITE_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_SQLITE', {}))
+    return options
+
+
+def pragma_statements(options):
+    """
+    The PRAGMA statements setting up a connection with [options]
+    """
+    return ['PRAGMA {0} = {1}'.format(key.lower(), options[key])
+            for key in PRAGMAS if options.get(key) is not None]
+
+
+def journal_mode_statement(mode):
+    """
+    The PRAGMA statement switching a database file to journal [mode]
+    """
+    return 'PRAGMA journal_mode = {0}'.format(mode)
+
+
+def begin_statement():
+    """
+    The statement starting a transaction
+    """
+    mode = get_sqlite_settings()['TRANSACTION_MODE']
+    return 'BEGIN {0}'.format(mode.upper()) if mode else 'BEGIN'
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(get_sqlite_settings()):
+            cursor.execute(statement)
@@ -0,0 +1,67 @@
+"""
+The user directory served by the ListUsers view.
+
+Profiles are listed by username with keyset pagination (see rango.keyset),
+joined to their user in the same query, so a page costs the same whether
+it's the first or the ten thousandth. The total shown above the list is
+counted once and cached until a profile is created or deleted.
+
+    RANGO_USERS = {
+        'PAGE_SIZE': 50,          # profiles per page
+        'COUNT_TIMEOUT': 60 * 60, # seconds the number of profiles is kept
+    }
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import keyset
+from .models import UserProfile
+
+
+USERS_DEFAULTS = {
+    'PAGE_SIZE': 50,
+    'COUNT_TIMEOUT': 60 * 60,
+}
+
+COUNT_KEY = 'rango:users:count'
+
+# usernames are unique, so they are a key on their own
+ORDERING = ['user__username']
+
+
+def get_users_settings():
+    """
+    Returns USERS_DEFAULTS updated with the project's RANGO_USERS setting
+    """
+    options = dict(USERS_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_USERS', {}))
+    return options
+
+
+def profiles():
+    """
+    Profiles with their user, as the directory and profile pages show them
+    """
+    return UserProfile.objects.select_related('user')
+
+
+def profile_count():
+    count = cache.get(COUNT_KEY)
+    if count is None:
+        count = UserProfile.objects.count()
+        cache.set(COUNT_KEY, count, get_users_settings()['COUNT_TIMEOUT'])
+    return count
+
+
+def invalidate_profile_count():
+    cache.delete(COUNT_KEY)
+
+
+def directory_page(after=None, before=None):
+    """
+    Returns the KeysetPage of profiles after or before a cursor.
+    Raises keyset.InvalidCursorError for a malformed cursor.
+    """
+    return keyset.paginate(profiles(), ORDERING,
+                           get_users_settings()['PAGE_SIZE'],
+                           after=after, before=before)
@@ -0,0 +1,137 @@
+"""
+Streaming export of categories and pages, used by the export_rango
+command and the export view.
+
+Rows use the format read by rango.importer, so an export can be imported
+into another Rango as is. Every category is written first, as a row
+without a url carrying its counters, followed by every page:
+
+    cursor = 'category:<pk>' or 'page:<pk>', where to resume after this row
+    category, category_views, category_likes
+    title, url, views
+
+Rows are read with keyset pagination, one query per chunk of primary keys
+(WHERE id > last ORDER BY id LIMIT n), so each chunk is as cheap as the
+first and memory stays the same whatever the size of the tables. Passing
+the cursor of the last row received as [after] continues an interrupted
+export from the next row.
+"""
+import csv
+import io
+import json
+import zlib
+
+from .importer import chunked
+from .models import Category, Page
+
+
+FIELDS = ['cursor', 'category', 'category_views', 'category_likes',
+          'title', 'url', 'views']
+
+FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# categories are exported before pages
+SECTIONS = ['category', 'page']
+
+
+class InvalidCursorError(Exception):
+    """
+    Raised when an export is resumed from a cursor that can't be parsed.
+    """
+
+
+def parse_cursor(cursor):
+    """
+    Returns the (section, primary key) of a cursor, or None for an empty one
+    """
+    if not cursor:
+        return None
+    section, _, pk = str(cursor).partition(':')
+    if section not in SECTIONS or not pk.isdigit():
+        raise InvalidCursorError('Invalid cursor {0!r}'.format(cursor))
+    return section, int(pk)
+
+
+def _keyset(queryset, fields, after, chunk_size):
+    """
+    Yields values_list tuples of [queryset] in primary key order, starting
+    after primary key [after], reading [chunk_size] rows per query.
+    The primary key must be the first of [fields].
+    """
+    while True:
+        rows = (queryset.filter(pk__gt=after).order_by('pk')
+                .values_list(*fields)[:chunk_size].iterator())
+        count = 0
+        for row in rows:
+            count += 1
+            after = row[0]
+            yield row
+        if count < chunk_size:
+            return
+
+
+def export_rows(after=None, chunk_size=1000):
+    """
+    Yields a dictionary per category, then per page, starting after the
+    row whose cursor is [after].
+    """
+    start = parse_cursor(after)
+
+    if start is None or start[0] == 'category':
+        for pk, name, views, likes in _keyset(
+                Category.objects.all(), ('id', 'name', 'views', 'likes'),
+                start[1] if start else 0, chunk_size):
+            yield {'cursor': 'category:{0}'.format(pk),
+                   'category': name,
+                   'category_views': views,
+                   'category_likes': likes}
+
+    for pk, category, title, url, views in _keyset(
+            Page.objects.all(),
+            ('id', 'category__name', 'title', 'url', 'views'),
+            start[1] if start and start[0] == 'page' else 0, chunk_size):
+        yield {'cursor': 'page:{0}'.format(pk),
+               'category': category,
+               'title': title,
+               'url': url,
+               'views': views}
+
+
+def encode_rows(rows, format='jsonl', chunk_size=1000):
+    """
+    Yields [rows] encoded as UTF-8 bytes, [chunk_size] rows at a time
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown format {0!r}'.format(format))
+
+    header = True
+    for chunk in chunked(rows, chunk_size):
+        buffer = io.StringIO()
+        if format == 'csv':
+            writer = csv.DictWriter(buffer, FIELDS, lineterminator='\n')
+            if header:
+                writer.writeheader()
+                header = False
+            writer.writerows(chunk)
+        else:
+            for row in chunk:
+                buffer.write(json.dumps(row))
+                buffer.write('\n')
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Compresses an iterable of bytes into a gzip stream on the fly.
+    Each chunk is flushed, so a client that is cut off can still
+    decompress every complete chunk it received.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,256 @@
+"""
+Bulk import of categories and pages, used by the import_rango command
+and populate_rango.py.
+
+Rows are dictionaries with these keys:
+    category = category name (required)
+    title, url, views = the page; rows without a url only touch the category.
+        Titles are shortened to fit, rows with a longer url than fits are
+        refused
+    category_views, category_likes = optional category counters
+
+Rows are read lazily and handled in chunks. Each chunk is one transaction
+that resolves every category in the chunk with one query, looks up the
+existing pages with one more, then inserts and updates with bulk
+statements. Only one chunk is held in memory at a time, whatever the
+size of the input.
+
+Categories are matched by slug and pages by (category, url), so running
+the same import twice updates rows instead of duplicating them. The
+page counts and views of categories are updated with every chunk (see
+rango.aggregates).
+"""
+import csv
+import functools
+import itertools
+import json
+import time
+
+from django.db import transaction
+from django.template.defaultfilters import slugify
+
+from .aggregates import add_to_categories
+from .bulk import bulk_update
+from .models import Category, Page
+
+
+URL_LENGTH = Page._meta.get_field('url').max_length
+
+class InvalidRowError(Exception):
+    """
+    Raised when an input row can't be imported.
+    """
+
+
+class ImportStats(object):
+    """
+    Running totals of an import
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.categories_created = 0
+        self.categories_updated = 0
+        self.pages_created = 0
+        self.pages_updated = 0
+        self.started = time.monotonic()
+
+    @property
+    def seconds(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return ('{rows} rows in {seconds:.2f}s ({rate:.0f} rows/s): '
+                '{categories_created} categories created, '
+                '{categories_updated} updated, '
+                '{pages_created} pages created, '
+                '{pages_updated} updated').format(
+                    seconds=self.seconds, rate=self.rows_per_second,
+                    **self.__dict__)
+
+
+def read_rows(stream, format='jsonl'):
+    """
+    Yields row dictionaries from a text stream of CSV or JSON lines
+    """
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+    elif format == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise InvalidRowError('line {0}: {1}'.format(number, e))
+    else:
+        raise InvalidRowError('Unknown format {0!r}'.format(format))
+
+
+def guess_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of up to [size] items without reading ahead
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# category names repeat across rows, slugify each once
+_slugify = functools.lru_cache(maxsize=65536)(slugify)
+
+
+def _int(value, default=None):
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidRowError('{0!r} is not a number'.format(value))
+
+
+def import_rows(rows, chunk_size=1000, stats=None, progress=None):
+    """
+    Imports an iterable of row dictionaries, one transaction per chunk.
+    [progress] is called with the ImportStats after every chunk.
+    Returns the ImportStats.
+    """
+    stats = stats or ImportStats()
+
+    try:
+        for chunk in chunked(rows, chunk_size):
+            with transaction.atomic():
+                _import_chunk(chunk, stats)
+            stats.rows += len(chunk)
+            if progress is not None:
+                progress(stats)
+    finally:
+        # bulk statements don't send model signals. Chunks committed
+        # before a failure are written as well.
+        from .signals import invalidate_caches
+        invalidate_caches()
+
+    return stats
+
+
+def _import_chunk(chunk, stats):
+    # later rows win when a chunk repeats a category or page
+    categories = {}
+    pages = {}
+    for row in chunk:
+        name = (row.get('category') or '').strip()
+        if not name:
+            raise InvalidRowError('Row without a category: {0!r}'.format(row))
+        slug = _slugify(name)
+        category = categories.setdefault(slug, {'name': name})
+        for key in ('views', 'likes'):
+            value = _int(row.get('category_' + key))
+            if value is not None:
+                category[key] = max(value, 0)
+
+        url = (row.get('url') or '').strip()
+        if len(url) > URL_LENGTH:
+            # a shortened url would point somewhere else
+            raise InvalidRowError('Url longer than {0} characters: '
+                                  '{1!r}'.format(URL_LENGTH, url))
+        if url:
+            pages[slug, url] = {
+                'title': (row.get('title') or url).strip()[:128],
+                'views': _int(row.get('views')),
+            }
+
+    resolved = _resolve_categories(categories, stats)
+    add_to_categories(_upsert_pages(pages, resolved, stats))
+
+
+def _resolve_categories(categories, stats):
+    """
+    Returns {slug: category id} for every slug in [categories], creating
+    missing ones and updating counters given in the input.
+    """
+    existing = {row[0]: row[1:] for row in Category.objects.filter(
+        slug__in=list(categories)).values_list('slug', 'id', 'views', 'likes')}
+
+    missing = [Category(name=data['name'][:128], slug=slug,
+                        views=data.get('views', 0), likes=data.get('likes', 0))
+               for slug, data in categories.items() if slug not in existing]
+    if missing:
+        Category.objects.bulk_create(missing)
+        stats.categories_created += len(missing)
+        # SQLite doesn't return the new primary keys, read them back
+        existing.update((row[0], row[1:]) for row in Category.objects.filter(
+            slug__in=[c.slug for c in missing]).values_list(
+                'slug', 'id', 'views', 'likes'))
+
+    changed = []
+    for slug, data in categories.items():
+        pk, views, likes = existing[slug]
+        new_counts = (data.get('views', views), data.get('likes', likes))
+        if new_counts != (views, likes):
+            changed.append(Category(pk=pk, views=new_counts[0],
+                                    likes=new_counts[1]))
+    if changed:
+        bulk_update(Category, changed, ['views', 'likes'])
+        stats.categories_updated += len(changed)
+
+    return {slug: row[0] for slug, row in existing.items()}
+
+
+def _upsert_pages(pages, category_ids, stats):
+    """
+    Inserts and updates [pages]. Returns the changes of the categories'
+    aggregates, {category id: (pages, views)}.
+    """
+    deltas = {}
+    if not pages:
+        return deltas
+
+    wanted = {(category_ids[slug], url) for slug, url in pages}
+
+    # look up by url only, filtering on category as well makes the
+    # database probe every (url, category) pair of the two IN lists
+    existing = {}
+    for pk, category_id, url, title, views in Page.objects.filter(
+            url__in={url for slug, url in pages}).values_list(
+                'id', 'category_id', 'url', 'title', 'views'):
+        if (category_id, url) in wanted:
+            existing[category_id, url] = (pk, title, views)
+
+    new = []
+    changed = []
+    for (slug, url), data in pages.items():
+        key = (category_ids[slug], url)
+        count, total = deltas.get(key[0], (0, 0))
+        if key not in existing:
+            new.append(Page(category_id=key[0], url=url, title=data['title'],
+                            views=data['views'] or 0))
+            deltas[key[0]] = (count + 1, total + new[-1].views)
+            continue
+
+        pk, title, views = existing[key]
+        if data['views'] is not None:
+            views = data['views']
+        if (data['title'], views) != existing[key][1:]:
+            changed.append(Page(pk=pk, title=data['title'], views=views))
+            deltas[key[0]] = (count, total + views - existing[key][2])
+
+    if new:
+        Page.objects.bulk_create(new, batch_size=500)
+        stats.pages_created += len(new)
+    if changed:
+        bulk_update(Page, changed, ['title', 'views'])
+        stats.pages_updated += len(changed)
+    return deltas
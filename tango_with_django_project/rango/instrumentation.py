@@ -0,0 +1,325 @@
+"""
+Opt-in per-request instrumentation, exposed in the Prometheus text format.
+
+InstrumentationMiddleware is listed first in MIDDLEWARE, so it also times
+the session being saved on the way out. It removes itself unless enabled:
+
+    RANGO_INSTRUMENTATION = {
+        'ENABLED': False,
+        'PROFILE_SLOWEST': 0,      # keep profiles of the N slowest requests
+        'PROFILE_RATE': 0.01,      # fraction of requests run under a profiler
+        'PROFILER': 'cprofile',    # or 'pyinstrument', if it's installed
+    }
+
+For every request, totals are added up per view name:
+    requests, request seconds
+    database queries and seconds
+    template render seconds (top level templates only)
+    search calls and seconds, spent waiting on run_query
+    session load and save seconds
+
+The categories overlap: a query run while a template renders counts as
+both database and template time. Totals are kept per process, so each
+worker reports its own. The staff-only metrics view renders them, along
+with the search service's cache and circuit breaker counters, and
+metrics_profiles shows the profiles of the slowest sampled requests.
+"""
+import collections
+import contextlib
+import cProfile
+import functools
+import heapq
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+
+
+INSTRUMENTATION_DEFAULTS = {
+    'ENABLED': False,
+    'PROFILE_SLOWEST': 0,
+    'PROFILE_RATE': 0.01,
+    'PROFILER': 'cprofile',
+}
+
+# (name, type, help) of every metric, in the order they are rendered
+METRICS = [
+    ('requests_total', 'counter', 'Requests handled.'),
+    ('request_seconds_total', 'counter', 'Seconds spent handling requests.'),
+    ('db_queries_total', 'counter', 'SQL queries run.'),
+    ('db_seconds_total', 'counter', 'Seconds spent running SQL queries.'),
+    ('template_seconds_total', 'counter', 'Seconds spent rendering templates.'),
+    ('search_calls_total', 'counter', 'Searches run through run_query.'),
+    ('search_seconds_total', 'counter', 'Seconds spent waiting on searches.'),
+    ('session_seconds_total', 'counter',
+     'Seconds spent loading and saving sessions.'),
+]
+
+
+def get_instrumentation_settings():
+    """
+    Returns INSTRUMENTATION_DEFAULTS updated with RANGO_INSTRUMENTATION
+    """
+    options = dict(INSTRUMENTATION_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_INSTRUMENTATION', {}))
+    return options
+
+
+_local = threading.local()
+
+
+class RequestTimings(object):
+    """
+    Seconds and calls per category for the request on this thread
+    """
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.depth = collections.Counter()
+
+
+@contextlib.contextmanager
+def timed(category):
+    """
+    Adds the time spent in the block to [category] of the current request.
+    Nested blocks of the same category are only counted once.
+    Does nothing outside an instrumented request.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None or timings.depth[category]:
+        yield
+        return
+
+    timings.depth[category] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.seconds[category] += time.perf_counter() - started
+        timings.calls[category] += 1
+        timings.depth[category] -= 1
+
+
+def _time_method(cls, name, category):
+    original = getattr(cls, name)
+
+    @functools.wraps(original)
+    def _timed_method(*args, **kwargs):
+        with timed(category):
+            return original(*args, **kwargs)
+    setattr(cls, name, _timed_method)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    """
+    Wraps database cursors, template rendering and the session engine's
+    load() and save() with timed(). Done once, by the first
+    InstrumentationMiddleware.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        # the debug cursor used when DEBUG = True is a subclass
+        from django.db.backends.utils import CursorWrapper
+        _time_method(CursorWrapper, 'execute', 'db')
+        _time_method(CursorWrapper, 'executemany', 'db')
+        from django.template.backends.django import Template
+        _time_method(Template, 'render', 'template')
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        _time_method(store, 'load', 'session')
+        _time_method(store, 'save', 'session')
+        _installed = True
+
+
+class Metrics(object):
+    """
+    Per view totals and the slowest profiled requests of this process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = collections.defaultdict(collections.Counter)
+        self._profiles = []
+        self._sequence = itertools.count()
+
+    def record(self, view, values):
+        with self._lock:
+            self._views[view].update(values)
+
+    def add_profile(self, seconds, profile, keep):
+        """
+        Keeps [profile] if it's one of the [keep] slowest seen so far
+        """
+        entry = (seconds, next(self._sequence), profile)
+        with self._lock:
+            if len(self._profiles) < keep:
+                heapq.heappush(self._profiles, entry)
+            elif self._profiles and seconds > self._profiles[0][0]:
+                heapq.heapreplace(self._profiles, entry)
+
+    def profiles(self):
+        """
+        Returns the kept profiles, slowest first
+        """
+        with self._lock:
+            return [entry[2] for entry in sorted(self._profiles, reverse=True)]
+
+    def snapshot(self):
+        with self._lock:
+            return {view: dict(values) for view, values in self._views.items()}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+            self._profiles = []
+
+
+metrics = Metrics()
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def render_metrics(snapshot=None, definitions=METRICS):
+    """
+    Returns the totals, or the {view: {name: value}} [snapshot] of the
+    (name, type, help) [definitions], in the Prometheus text exposition
+    format
+    """
+    if snapshot is None:
+        snapshot = metrics.snapshot()
+
+    lines = []
+    for name, kind, description in definitions:
+        lines.append('# HELP rango_{0} {1}'.format(name, description))
+        lines.append('# TYPE rango_{0} {1}'.format(name, kind))
+        for view, values in sorted(snapshot.items()):
+            lines.append('rango_{0}{{view="{1}"}} {2!r}'.format(
+                name, _escape(view), values.get(name, 0)))
+    return '\n'.join(lines) + '\n'
+
+
+def render_samples(definitions, values):
+    """
+    Returns unlabelled [values] of the (name, type, help) [definitions]
+    in the Prometheus text exposition format
+    """
+    lines = []
+    for name, kind, description in definitions:
+        lines.append('# HELP rango_{0} {1}'.format(name, description))
+        lines.append('# TYPE rango_{0} {1}'.format(name, kind))
+        lines.append('rango_{0} {1!r}'.format(name, values.get(name, 0)))
+    return '\n'.join(lines) + '\n'
+
+
+class Profiler(object):
+    """
+    Runs a request under cProfile or pyinstrument and returns its report
+    """
+
+    def __init__(self, kind):
+        if kind == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler as PyinstrumentProfiler
+            except ImportError:
+                raise ImproperlyConfigured(
+                    "PROFILER 'pyinstrument' needs pyinstrument installed")
+            self._profiler = PyinstrumentProfiler()
+        elif kind == 'cprofile':
+            self._profiler = cProfile.Profile()
+        else:
+            raise ImproperlyConfigured('Unknown PROFILER {0!r}'.format(kind))
+        self.kind = kind
+
+    def __enter__(self):
+        if self.kind == 'pyinstrument':
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.kind == 'pyinstrument':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def report(self):
+        if self.kind == 'pyinstrument':
+            return self._profiler.output_text()
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(40)
+        return stream.getvalue()
+
+
+class InstrumentationMiddleware(object):
+    """
+    Times every request and adds it to the process's Metrics
+    """
+
+    def __init__(self, get_response):
+        self.options = get_instrumentation_settings()
+        if not self.options['ENABLED']:
+            raise MiddlewareNotUsed
+        if self.options['PROFILE_SLOWEST']:
+            # fail at startup, not on the first sampled request
+            Profiler(self.options['PROFILER'])
+        install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = _local.timings = RequestTimings()
+
+        profiler = None
+        if (self.options['PROFILE_SLOWEST']
+                and random.random() < self.options['PROFILE_RATE']):
+            profiler = Profiler(self.options['PROFILER'])
+
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                with profiler:
+                    response = self.get_response(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - started
+            _local.timings = None
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.record(view, {
+            'requests_total': 1,
+            'request_seconds_total': seconds,
+            'db_queries_total': timings.calls['db'],
+            'db_seconds_total': timings.seconds['db'],
+            'template_seconds_total': timings.seconds['template'],
+            'search_calls_total': timings.calls['search'],
+            'search_seconds_total': timings.seconds['search'],
+            'session_seconds_total': timings.seconds['session'],
+        })
+
+        if profiler is not None:
+            metrics.add_profile(seconds, {
+                'view': view,
+                'path': request.get_full_path(),
+                'seconds': seconds,
+                'report': profiler.report(),
+            }, self.options['PROFILE_SLOWEST'])
+
+        return response
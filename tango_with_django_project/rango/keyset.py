@@ -0,0 +1,151 @@
+"""
+Keyset (seek) pagination.
+
+Paginator reads page n with OFFSET, so the database walks past every row
+of the earlier pages and deep pages get slower as tables grow. A keyset
+page is read with
+
+    WHERE (key) > (key of the last row seen) ORDER BY key LIMIT n
+
+which an index on the key answers in the same time for every page. The
+key is the list of ordering fields, and must be unique, so end it with
+the primary key unless a field already is.
+
+Pages are addressed by cursors: opaque strings holding the key of the
+last row of the previous page (after) or the first row of the next page
+(before). Only next and previous links can be offered, there are no page
+numbers.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursorError(Exception):
+    """
+    Raised when a cursor can't be decoded.
+    """
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError, TypeError):
+        raise InvalidCursorError('Invalid cursor {0!r}'.format(cursor))
+    if not isinstance(values, list) or len(values) != length or not all(
+            isinstance(value, (str, int, float)) for value in values):
+        raise InvalidCursorError('Invalid cursor {0!r}'.format(cursor))
+    return values
+
+
+class KeysetPage(object):
+    """
+    The rows of one page, with cursors to its neighbours.
+    next_cursor and previous_cursor are None on the last and first page.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _value(row, field):
+    if isinstance(row, dict):
+        return row[field]
+    for name in field.split('__'):
+        row = getattr(row, name)
+    return row
+
+
+def _seek(ordering, values):
+    """
+    Q object selecting the rows after [values] in [ordering]:
+    a >= x AND ((a > x) OR (a = x AND b > y) OR ...)
+    The leading a >= x lets the database start reading the index at x
+    instead of filtering every row before it.
+    """
+    first = ordering[0]
+    bound = Q(**{first.lstrip('-') + ('__lte' if first.startswith('-')
+                                       else '__gte'): values[0]})
+    condition = Q()
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        step = Q(**{name + lookup: values[position]})
+        for previous, value in zip(ordering[:position], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return bound & condition
+
+
+def _reverse(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+def paginate(queryset, ordering, size, after=None, before=None):
+    """
+    Returns the KeysetPage of [size] rows of [queryset], in [ordering],
+    following cursor [after] or preceding cursor [before].
+    Rows may be model instances or values() dictionaries with every
+    ordering field. Reads size + 1 rows to know whether there is more.
+    Raises InvalidCursorError for a cursor that can't be decoded, or
+    whose values don't fit the ordering fields.
+    """
+    ordering = list(ordering)
+    backwards = bool(before) and not after
+    cursor = before if backwards else after
+
+    if backwards:
+        queryset = queryset.order_by(*[_reverse(f) for f in ordering])
+        seek = [_reverse(f) for f in ordering]
+    else:
+        queryset = queryset.order_by(*ordering)
+        seek = ordering
+
+    if cursor:
+        try:
+            queryset = queryset.filter(
+                _seek(seek, decode_cursor(cursor, len(ordering))))
+        except (ValueError, TypeError, ValidationError):
+            # values of the wrong type for their fields
+            raise InvalidCursorError('Invalid cursor {0!r}'.format(cursor))
+
+    rows = list(queryset[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    def key(row):
+        return encode_cursor(_value(row, f.lstrip('-')) for f in ordering)
+
+    if not rows:
+        return KeysetPage(rows, None, None)
+
+    if backwards:
+        return KeysetPage(rows, key(rows[-1]), key(rows[0]) if more else None)
+    return KeysetPage(rows, key(rows[-1]) if more else None,
+                      key(rows[0]) if cursor else None)
@@ -0,0 +1,172 @@
+"""
+Full-text search over Rango's own categories and pages.
+
+On SQLite, titles and urls of pages and names of categories are kept in
+the FTS5 table rango_search_index, created by migration 0009. Triggers
+on rango_page and rango_category update it with every write, including
+bulk_create() and update(), which send no model signals. A page is row
+2 * id of the index and a category row 2 * id + 1, so a row is replaced
+in place when its source changes. Adding or altering columns of either
+table on SQLite copies it to a new table without the triggers, such
+migrations must create them again, as 0010 does.
+
+Hits are ranked with BM25, a match in a title weighing TITLE_WEIGHT
+times one in a url. Every word of the query must match, after Porter
+stemming, so 'tutorials' finds 'Tutorial'. Scoring every match of a
+word found in most rows would take hundreds of milliseconds, so only
+the CANDIDATES most recently added matches in titles, and as many in
+titles or urls, are ranked, title matches first, and only the best
+LIMIT of those are read back.
+
+    RANGO_LOCAL_SEARCH = {
+        'LIMIT': 10,           # hits returned
+        'TITLE_WEIGHT': 10.0,  # BM25 weight of titles over urls
+        'CANDIDATES': 1000,    # matches ranked, newest first, of each
+    }
+
+Other databases have no FTS5, they fall back to case insensitive
+substring matches on titles and names, without ranking.
+
+The rebuild_search_index management command refills the index from
+the tables, e.g. after restoring a backup made without it.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Category, Page
+
+
+LOCAL_SEARCH_DEFAULTS = {
+    'LIMIT': 10,
+    'TITLE_WEIGHT': 10.0,
+    'CANDIDATES': 1000,
+}
+
+INDEX_TABLE = 'rango_search_index'
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def get_local_search_settings():
+    """
+    Returns LOCAL_SEARCH_DEFAULTS updated with RANGO_LOCAL_SEARCH
+    """
+    options = dict(LOCAL_SEARCH_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_LOCAL_SEARCH', {}))
+    return options
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+class Hit(object):
+    """
+    A page or category matching a search.
+    kind = 'page' or 'category'
+    id = primary key of the page or category
+    title = page title or category name
+    url = page url, empty for categories
+    slug = category slug, empty for pages
+    """
+
+    def __init__(self, kind, id, title, url='', slug=''):
+        self.kind = kind
+        self.id = id
+        self.title = title
+        self.url = url
+        self.slug = slug
+
+    def __repr__(self):
+        return '<Hit {0} {1}: {2}>'.format(self.kind, self.id, self.title)
+
+
+def match_expression(query):
+    """
+    FTS5 query matching every word of [query].
+    Words are quoted, so operators and punctuation typed by users can't
+    make the expression invalid. Returns '' if there are no words.
+    Prefix queries (word*) are avoided, FTS5 merges the rows of every
+    word sharing the prefix before it can return any.
+    """
+    return ' '.join('"{0}"'.format(word)
+                    for word in WORD.findall(query.lower()))
+
+
+def search(query, limit=None):
+    """
+    Returns the Hits for [query], best first
+    """
+    if limit is None:
+        limit = get_local_search_settings()['LIMIT']
+    expression = match_expression(query)
+    if not expression:
+        return []
+    if not uses_fts():
+        return _search_without_fts(query, limit)
+
+    options = get_local_search_settings()
+    # FTS5 reads matches in rowid order and stops after CANDIDATES, only
+    # those are scored, and the columns only read for the best [limit];
+    # bm25() takes a weight for every column. Matches in titles are
+    # taken first, so the many urls sharing a word, e.g. python.org,
+    # can't crowd out older titles, and urls fill in behind them. A row
+    # in both keeps the score of its title match, SQLite reading the
+    # bare columns of the row giving MIN(pool).
+    candidates = ('SELECT rowid AS id, {1} AS pool, '
+                  'bm25({0}, 0, 0, 0, %s, 1.0) AS score '
+                  'FROM {0} WHERE {0} MATCH %s '
+                  'ORDER BY rowid DESC LIMIT %s')
+    sql = ('SELECT hit.kind, hit.object_id, hit.slug, hit.title, hit.url '
+           'FROM (SELECT id, MIN(pool) AS pool, score FROM ('
+           'SELECT * FROM ({1}) UNION ALL SELECT * FROM ({2})'
+           ') GROUP BY id ORDER BY pool, score LIMIT %s) AS top '
+           'JOIN {0} AS hit ON hit.rowid = top.id '
+           'ORDER BY top.pool, top.score').format(
+               INDEX_TABLE, candidates.format(INDEX_TABLE, 0),
+               candidates.format(INDEX_TABLE, 1))
+    weight, count = options['TITLE_WEIGHT'], options['CANDIDATES']
+    in_titles = '{title} : (' + expression + ')'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [weight, in_titles, count,
+                             weight, expression, count, limit])
+        rows = cursor.fetchall()
+    return [Hit(kind, object_id, title, url, slug)
+            for kind, object_id, slug, title, url in rows]
+
+
+def _search_without_fts(query, limit):
+    query = query.strip()
+    categories = Category.objects.filter(name__icontains=query)
+    hits = [Hit('category', pk, name, slug=slug) for pk, name, slug
+            in categories.values_list('pk', 'name', 'slug')[:limit]]
+    pages = Page.objects.filter(title__icontains=query)
+    hits += [Hit('page', pk, title, url) for pk, title, url
+             in pages.values_list('pk', 'title', 'url')[:limit - len(hits)]]
+    return hits
+
+
+def rebuild():
+    """
+    Refills the index from the page and category tables.
+    Returns the number of rows indexed. Does nothing without FTS5.
+    """
+    if not uses_fts():
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0}'.format(INDEX_TABLE))
+        cursor.execute(
+            "INSERT INTO {0} (rowid, kind, object_id, slug, title, url) "
+            "SELECT id * 2, 'page', id, '', title, url "
+            "FROM {1}".format(INDEX_TABLE, Page._meta.db_table))
+        cursor.execute(
+            "INSERT INTO {0} (rowid, kind, object_id, slug, title, url) "
+            "SELECT id * 2 + 1, 'category', id, slug, name, '' "
+            "FROM {1}".format(INDEX_TABLE, Category._meta.db_table))
+        # merge the index b-trees, so queries read fewer of them
+        cursor.execute("INSERT INTO {0} ({0}) VALUES ('optimize')".format(
+            INDEX_TABLE))
+        cursor.execute('SELECT COUNT(*) FROM {0}'.format(INDEX_TABLE))
+        return cursor.fetchone()[0]
@@ -0,0 +1,65 @@
+import concurrent.futures
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from rango.models import UserProfile
+from rango.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    """
+    Creates the thumbnails of profile pictures that have none, or whose
+    thumbnails were made from an older picture. See rango/thumbnails.py.
+    Safe to run while the site is up, and to run again after a failure.
+    """
+    help = 'Create missing thumbnails of profile pictures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Recreate every thumbnail, e.g. after '
+                                 'changing the size')
+        parser.add_argument('--workers', type=int,
+                            default=2,
+                            help='Pictures resized in parallel')
+
+    def handle(self, *args, **options):
+        profiles = UserProfile.objects.exclude(picture='')
+        if not options['force']:
+            profiles = profiles.exclude(thumbnail_source=F('picture'))
+        ids = list(profiles.order_by('pk').values_list('pk', flat=True))
+
+        def generate(profile_id):
+            return generate_thumbnails(profile_id, force=options['force'])
+
+        created = failed = 0
+        for profile_id, result in self.run(generate, ids, options['workers']):
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write('Profile {0}: {1}'.format(profile_id, result))
+            else:
+                created += result
+
+        self.stdout.write('Created thumbnails for {0} of {1} profiles, '
+                          '{2} failed'.format(created, len(ids), failed))
+
+    def run(self, function, ids, workers):
+        """
+        Yields (id, result or exception) of [function] on every one of [ids],
+        called by [workers] threads
+        """
+        if workers <= 1:
+            for profile_id in ids:
+                try:
+                    yield profile_id, function(profile_id)
+                except Exception as e:
+                    yield profile_id, e
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(function, pk): pk for pk in ids}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
@@ -0,0 +1,107 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from rango.benchmark import (BENCHMARK_CACHES, DATASETS, ROUTES,
+                             BenchmarkError, benchmark_against, run_benchmark,
+                             seed_dataset)
+
+
+class Command(BaseCommand):
+    """
+    Seeds a throwaway test database and measures every Rango URL.
+    See rango/benchmark.py for what is measured.
+    Exits with an error when --baseline is given and a route regressed,
+    so it can gate CI.
+    """
+    help = 'Benchmark query counts and latency of every rango URL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(DATASETS), default='1k',
+                            help='Number of pages to seed')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Measured requests per route')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Unmeasured requests per route')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the cache before every request')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only benchmark this URL name, repeatable')
+        parser.add_argument('--output',
+                            help='Write the JSON report to this file')
+        parser.add_argument('--baseline',
+                            help='Fail if the report regressed against '
+                                 'this JSON report')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed p95 growth over the baseline, '
+                                 'as a fraction')
+        parser.add_argument('--retries', type=int, default=2,
+                            help='Times a route slower than the baseline '
+                                 'is measured again')
+
+    def handle(self, *args, **options):
+        routes = ROUTES
+        if options['routes']:
+            routes = [r for r in ROUTES if r.name in options['routes']]
+            unknown = set(options['routes']) - {r.name for r in routes}
+            if unknown:
+                raise CommandError('Unknown routes: {0}'.format(
+                    ', '.join(sorted(unknown))))
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (IOError, ValueError) as e:
+                raise CommandError(e)
+
+        setup_test_environment()
+        caches = override_settings(CACHES=BENCHMARK_CACHES)
+        caches.enable()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write('Seeding {0} pages...'.format(
+                DATASETS[options['size']]))
+            dataset = seed_dataset(DATASETS[options['size']])
+            measure_options = {'iterations': options['iterations'],
+                               'warmup': options['warmup'],
+                               'cold': options['cold']}
+            regressions = []
+            if baseline is None:
+                report = run_benchmark(dataset, routes, **measure_options)
+            else:
+                report, regressions = benchmark_against(
+                    baseline, dataset, routes, options['tolerance'],
+                    options['retries'], **measure_options)
+        except BenchmarkError as e:
+            raise CommandError(e)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            caches.disable()
+            teardown_test_environment()
+
+        self.stdout.write('{0:<26}{1:>7}{2:>9}{3:>10}{4:>10}{5:>12}'.format(
+            'route', 'status', 'queries', 'p50 ms', 'p95 ms', 'alloc KB'))
+        for name, result in report['routes'].items():
+            self.stdout.write(
+                '{0:<26}{status:>7}{queries:>9}{p50_ms:>10.2f}{p95_ms:>10.2f}'
+                '{alloc_peak_kb:>12.1f}'.format(name, **result))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write('\n')
+
+        if regressions:
+            raise CommandError('Regressed against {0}:\n  {1}'.format(
+                options['baseline'],
+                '\n  '.join(message for name, kind, message in regressions)))
+        if baseline is not None:
+            self.stdout.write('No regressions against {0}'.format(
+                options['baseline']))
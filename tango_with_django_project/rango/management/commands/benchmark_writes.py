@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from rango.benchmark import DATASETS, seed_dataset
+from rango.write_benchmark import CONFIGURATIONS, run_write_benchmark
+
+
+class Command(BaseCommand):
+    """
+    Seeds a throwaway test database and measures the throughput of
+    concurrent writes under each database configuration.
+    See rango/write_benchmark.py for what is measured.
+    """
+    help = 'Benchmark concurrent write throughput of the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(DATASETS), default='1k',
+                            help='Number of pages to seed')
+        parser.add_argument('--threads', type=int, action='append',
+                            help='Concurrent writers, repeatable '
+                                 '(default 1, 4 and 8)')
+        parser.add_argument('--seconds', type=float, default=5.0,
+                            help='Seconds each run writes for')
+        parser.add_argument('--configuration', action='append',
+                            dest='configurations',
+                            help='Only measure this configuration, '
+                                 'repeatable')
+        parser.add_argument('--output',
+                            help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        configurations = CONFIGURATIONS.get(connection.vendor)
+        if options['configurations']:
+            if configurations is None:
+                raise CommandError('No configurations for {0}'.format(
+                    connection.vendor))
+            configurations = [c for c in configurations
+                              if c.name in options['configurations']]
+            unknown = (set(options['configurations']) -
+                       {c.name for c in configurations})
+            if unknown:
+                raise CommandError('Unknown configurations: {0}'.format(
+                    ', '.join(sorted(unknown))))
+
+        test_settings = connection.settings_dict['TEST']
+        test_name = test_settings['NAME']
+        if connection.vendor == 'sqlite':
+            # an in-memory database has no journal and shares one cache
+            # between threads, writers need a file
+            directory = tempfile.mkdtemp()
+            test_settings['NAME'] = os.path.join(directory, 'writes.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write('Seeding {0} pages...'.format(
+                DATASETS[options['size']]))
+            seed_dataset(DATASETS[options['size']])
+            report = run_write_benchmark(options['threads'] or (1, 4, 8),
+                                         options['seconds'], configurations)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            test_settings['NAME'] = test_name
+            if connection.vendor == 'sqlite':
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+                os.rmdir(directory)
+
+        self.stdout.write('{0:<20}{1:>8}{2:>9}{3:>10}{4:>10}{5:>10}'.format(
+            'configuration', 'threads', 'writes/s', 'p50 ms', 'p95 ms',
+            'errors'))
+        for name, runs in report['configurations'].items():
+            for run in runs:
+                self.stdout.write(
+                    '{0:<20}{threads:>8}{per_second:>9.1f}{p50:>10}{p95:>10}'
+                    '{errors:>10}'.format(
+                        name, p50=_ms(run['p50_ms']), p95=_ms(run['p95_ms']),
+                        **run))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write('\n')
+
+
+def _ms(value):
+    return '-' if value is None else '{0:.2f}'.format(value)
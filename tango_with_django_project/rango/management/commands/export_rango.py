@@ -0,0 +1,61 @@
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rango.exporter import (FORMATS, InvalidCursorError, encode_rows,
+                            export_rows, gzip_stream)
+
+
+class Command(BaseCommand):
+    """
+    Streams every category and page to a CSV or JSON lines file that
+    import_rango can read back. See rango/exporter.py for the row format.
+    """
+    help = 'Export categories and pages as CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help="File to write, or '-' for standard output")
+        parser.add_argument('--format', choices=sorted(FORMATS),
+                            help='Output format, guessed from the file name '
+                                 'by default')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress the output, implied by a .gz '
+                                 'file name')
+        parser.add_argument('--after', default=None,
+                            help='Resume after the row with this cursor')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows read per query')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        name = path[:-3] if path.endswith('.gz') else path
+        format = options['format'] or (
+            'csv' if name.lower().endswith('.csv') else 'jsonl')
+        compress = options['gzip'] or path.endswith('.gz')
+
+        chunks = encode_rows(export_rows(options['after'],
+                                         options['chunk_size']),
+                             format, options['chunk_size'])
+        if compress:
+            chunks = gzip_stream(chunks)
+
+        if path == '-':
+            stream = sys.stdout.buffer
+        else:
+            try:
+                stream = io.open(path, 'wb')
+            except IOError as e:
+                raise CommandError(e)
+
+        try:
+            for chunk in chunks:
+                stream.write(chunk)
+        except InvalidCursorError as e:
+            raise CommandError(e)
+        finally:
+            if path == '-':
+                stream.flush()
+            else:
+                stream.close()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from rango.counters import get_counter_buffer, get_counter_settings
+
+
+class Command(BaseCommand):
+    """
+    Writes buffered Page.views and Category.likes increments to the database.
+    Only increments held in the 'cache' counter store are visible to this
+    command, the 'memory' store belongs to each web process.
+    """
+    help = 'Flush buffered view and like counters to the database'
+
+    def handle(self, *args, **options):
+        if get_counter_settings()['STORE'] != 'cache':
+            self.stderr.write(
+                "RANGO_COUNTERS['STORE'] is not 'cache', only this process's "
+                "counters can be flushed.")
+
+        updated = get_counter_buffer().flush()
+        self.stdout.write('Flushed counters for {0} rows'.format(updated))
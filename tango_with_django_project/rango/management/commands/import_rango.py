@@ -0,0 +1,55 @@
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rango.importer import (InvalidRowError, guess_format, import_rows,
+                            read_rows)
+
+
+class Command(BaseCommand):
+    """
+    Streams categories and pages from a CSV or JSON lines file into Rango.
+    See rango/importer.py for the row format.
+    """
+    help = 'Bulk import categories and pages from CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help="File to import, or '-' for standard input")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format, guessed from the file name '
+                                 'by default')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows written per transaction')
+        parser.add_argument('--progress-every', type=int, default=10,
+                            help='Report progress every N chunks')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        chunks = [0]
+
+        def progress(stats):
+            chunks[0] += 1
+            if chunks[0] % options['progress_every'] == 0:
+                self.stdout.write('{0} rows, {1:.0f} rows/s'.format(
+                    stats.rows, stats.rows_per_second))
+
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        else:
+            try:
+                stream = io.open(path, 'r', encoding='utf-8', newline='')
+            except IOError as e:
+                raise CommandError(e)
+
+        try:
+            with stream:
+                stats = import_rows(read_rows(stream, format),
+                                    chunk_size=options['chunk_size'],
+                                    progress=progress)
+        except InvalidRowError as e:
+            raise CommandError(e)
+
+        self.stdout.write(str(stats))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from rango.page_cache import page_cache_stats, reset_page_cache_stats
+
+
+class Command(BaseCommand):
+    """
+    Prints how often anonymous page requests were served from cache.
+    """
+    help = 'Show the hit rate of the public page cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = page_cache_stats()
+        self.stdout.write('hits: {hits}\n'
+                          'not modified: {not_modified}\n'
+                          'misses: {misses}\n'
+                          'hit rate: {hit_rate:.1%}'.format(**stats))
+        if options['reset']:
+            reset_page_cache_stats()
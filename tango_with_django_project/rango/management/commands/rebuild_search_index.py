@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from rango.local_search import rebuild, uses_fts
+
+
+class Command(BaseCommand):
+    """
+    Refills the full-text index of pages and categories from their tables.
+    Triggers keep it current, this is only needed if it was lost or
+    damaged, e.g. after a restore. See rango/local_search.py.
+    """
+    help = 'Rebuild the full-text search index of pages and categories'
+
+    def handle(self, *args, **options):
+        if not uses_fts():
+            self.stderr.write('Only SQLite has a search index, other '
+                              'databases are searched without one.')
+            return
+        self.stdout.write('Indexed {0} pages and categories'.format(rebuild()))
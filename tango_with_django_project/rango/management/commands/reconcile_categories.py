@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rango.aggregates import reconcile
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the page count and total page views of every category
+    and fixes those that drifted from their pages, e.g. after pages were
+    edited through the admin. See rango/aggregates.py.
+    """
+    help = 'Fix the page counts and views stored on categories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report drift, exit with an error '
+                                 'if there is any')
+
+    def handle(self, *args, **options):
+        drifted = reconcile(fix=not options['check'])
+        if options['check']:
+            if drifted:
+                raise CommandError('{0} categories drifted'.format(drifted))
+            self.stdout.write('No categories drifted')
+        else:
+            self.stdout.write('Fixed {0} categories'.format(drifted))
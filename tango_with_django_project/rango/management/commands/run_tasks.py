@@ -0,0 +1,102 @@
+import concurrent.futures
+import logging
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from rango.tasks import (claim, enqueue_periodic, execute, get_task_settings,
+                         purge_done, run_pending)
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    The task worker: runs queued tasks on a pool of processes until
+    interrupted. See rango/tasks.py. Any number of workers may run at
+    once, on any machine sharing the database.
+    """
+    help = 'Run queued rango tasks'
+
+    # seconds between deleting old finished tasks
+    purge_interval = 60
+
+    def add_arguments(self, parser):
+        options = get_task_settings()
+        parser.add_argument('--workers', type=int, default=options['WORKERS'],
+                            help='Processes running tasks, 0 runs them in '
+                                 'this process')
+        parser.add_argument('--poll', type=float,
+                            default=options['POLL_INTERVAL'],
+                            help='Seconds between looks at an empty queue')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no task is due')
+
+    def handle(self, *args, **options):
+        self.last_runs = {}
+        self.last_purge = 0
+        try:
+            if options['workers'] < 1:
+                self.run_inline(options)
+            else:
+                self.run_pool(options)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
+
+    def housekeeping(self):
+        enqueue_periodic(self.last_runs)
+        if time.monotonic() - self.last_purge >= self.purge_interval:
+            self.last_purge = time.monotonic()
+            purge_done()
+
+    def run_inline(self, options):
+        while True:
+            self.housekeeping()
+            if not run_pending():
+                if options['burst']:
+                    return
+                time.sleep(options['poll'])
+
+    def run_pool(self, options):
+        while True:
+            try:
+                return self.run_on_pool(options)
+            except BrokenProcessPool as e:
+                # a process died (killed, out of memory, crashed in C code)
+                # and took the pool with it. Its tasks are retried once
+                # their lease expires.
+                logger.error('Task pool broken, starting a new one: %s', e)
+                self.stderr.write('Task pool broken, starting a new one')
+
+    def run_on_pool(self, options):
+        workers = options['workers']
+        # forked processes mustn't share the parent's connections
+        connections.close_all()
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            running = set()
+            try:
+                while True:
+                    self.housekeeping()
+                    claimed = claim(workers - len(running))
+                    running.update(pool.submit(execute, pk) for pk in claimed)
+                    if not running:
+                        if options['burst']:
+                            return
+                        time.sleep(options['poll'])
+                        continue
+                    done, running = concurrent.futures.wait(
+                        running, timeout=0 if claimed else options['poll'],
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        error = future.exception()
+                        if isinstance(error, BrokenProcessPool):
+                            raise error
+                        if error is not None:
+                            self.stderr.write(str(error))
+            except KeyboardInterrupt:
+                self.stdout.write('Waiting for {0} running tasks'.format(
+                    len(running)))
+                raise
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from rango.database import get_sqlite_settings, journal_mode_statement
+
+
+class Command(BaseCommand):
+    """
+    Switches the SQLite database to RANGO_SQLITE's JOURNAL_MODE, or the
+    mode given. The mode is stored in the database file, so this is run
+    once, when deploying, instead of on every connection. See
+    rango/database.py.
+    """
+    help = 'Set the journal mode of the SQLite database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', nargs='?',
+                            help='Journal mode, JOURNAL_MODE by default')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases have a journal mode')
+        mode = options['mode'] or get_sqlite_settings()['JOURNAL_MODE']
+        if not mode:
+            raise CommandError('No JOURNAL_MODE in RANGO_SQLITE')
+        with connection.cursor() as cursor:
+            cursor.execute(journal_mode_statement(mode))
+            self.stdout.write('Journal mode: {0}'.format(
+                cursor.fetchone()[0]))
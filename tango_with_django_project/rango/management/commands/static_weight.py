@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from rango.benchmark import BENCHMARK_CACHES, ROUTES, seed_dataset
+from rango.static_assets import StaticFilesMiddleware, page_weight
+
+
+# pages anyone can visit, where visitors first land
+DEFAULT_ROUTES = ['index', 'about', 'category_list', 'show_category']
+
+
+class Command(BaseCommand):
+    """
+    Seeds a throwaway test database, collects the static files into a
+    temporary directory, requests Rango pages and compares what their
+    static files cost a visitor before and after hashed names and
+    precompression. See page_weight() in rango/static_assets.py.
+    """
+    help = 'Compare the static file weight and requests of rango pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only weigh this URL name, repeatable')
+
+    def not_found(self, environ, start_response):
+        start_response('404 Not Found', [])
+        return []
+
+    def handle(self, *args, **options):
+        names = options['routes'] or DEFAULT_ROUTES
+        routes = [r for r in ROUTES if r.name in names and not r.login]
+        unknown = set(names) - {r.name for r in routes}
+        if unknown:
+            raise CommandError('Unknown or login only routes: {0}'.format(
+                ', '.join(sorted(unknown))))
+
+        setup_test_environment()
+        static_root = tempfile.mkdtemp(prefix='rango-static-weight-')
+        # pages only link hashed names with DEBUG off
+        environment = override_settings(CACHES=BENCHMARK_CACHES,
+                                        STATIC_ROOT=static_root, DEBUG=False)
+        environment.enable()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command('collectstatic', interactive=False, verbosity=0)
+            application = StaticFilesMiddleware(self.not_found)
+            dataset = seed_dataset(100, users=1)
+            client = Client()
+            weights = []
+            for route in routes:
+                path, response = route.request(client, dataset)
+                weights.append((route.name, page_weight(
+                    response.content.decode(response.charset), application)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            environment.disable()
+            teardown_test_environment()
+            shutil.rmtree(static_root, ignore_errors=True)
+
+        self.stdout.write('{0:<16}{1:>7}{2:>9}{3:>12}{4:>12}{5:>16}'.format(
+            'route', 'assets', 'external', 'before KB', 'after KB',
+            'repeat requests'))
+        for name, weight in weights:
+            self.stdout.write(
+                '{0:<16}{assets:>7}{external:>9}{1:>12.1f}{2:>12.1f}'
+                '{3:>16}'.format(
+                    name, weight['before_bytes'] / 1024.0,
+                    weight['after_bytes'] / 1024.0,
+                    '{before_repeat_requests} -> '
+                    '{after_repeat_requests}'.format(**weight),
+                    **weight))
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 03:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='page',
+            name='rango_page_categor_09a57a_idx',
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['category', '-views', '-id'], name='rango_page_categor_1246d8_idx'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# FTS5 table and triggers of rango.local_search. Pages are row 2 * id,
+# categories row 2 * id + 1.
+CREATE = [
+    "CREATE VIRTUAL TABLE rango_search_index USING fts5("
+    "kind UNINDEXED, object_id UNINDEXED, slug UNINDEXED, title, url, "
+    "tokenize = 'porter unicode61')",
+
+    "CREATE TRIGGER rango_page_search_insert AFTER INSERT ON rango_page "
+    "BEGIN "
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "VALUES (new.id * 2, 'page', new.id, '', new.title, new.url); "
+    "END",
+
+    "CREATE TRIGGER rango_page_search_update "
+    "AFTER UPDATE OF title, url ON rango_page "
+    "BEGIN "
+    "DELETE FROM rango_search_index WHERE rowid = old.id * 2; "
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "VALUES (new.id * 2, 'page', new.id, '', new.title, new.url); "
+    "END",
+
+    "CREATE TRIGGER rango_page_search_delete AFTER DELETE ON rango_page "
+    "BEGIN "
+    "DELETE FROM rango_search_index WHERE rowid = old.id * 2; "
+    "END",
+
+    "CREATE TRIGGER rango_category_search_insert AFTER INSERT ON rango_category "
+    "BEGIN "
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "VALUES (new.id * 2 + 1, 'category', new.id, new.slug, new.name, ''); "
+    "END",
+
+    "CREATE TRIGGER rango_category_search_update "
+    "AFTER UPDATE OF name, slug ON rango_category "
+    "BEGIN "
+    "DELETE FROM rango_search_index WHERE rowid = old.id * 2 + 1; "
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "VALUES (new.id * 2 + 1, 'category', new.id, new.slug, new.name, ''); "
+    "END",
+
+    "CREATE TRIGGER rango_category_search_delete AFTER DELETE ON rango_category "
+    "BEGIN "
+    "DELETE FROM rango_search_index WHERE rowid = old.id * 2 + 1; "
+    "END",
+
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "SELECT id * 2, 'page', id, '', title, url FROM rango_page",
+
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "SELECT id * 2 + 1, 'category', id, slug, name, '' FROM rango_category",
+]
+
+DROP = [
+    'DROP TRIGGER rango_page_search_insert',
+    'DROP TRIGGER rango_page_search_update',
+    'DROP TRIGGER rango_page_search_delete',
+    'DROP TRIGGER rango_category_search_insert',
+    'DROP TRIGGER rango_category_search_update',
+    'DROP TRIGGER rango_category_search_delete',
+    'DROP TABLE rango_search_index',
+]
+
+
+def run(statements):
+    def run_on_sqlite(apps, schema_editor):
+        # other databases search without an index, see rango.local_search
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run_on_sqlite
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0008_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 04:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+# SQLite adds the columns by copying rango_category to a new table, which
+# loses the triggers of migration 0009 keeping the search index current
+CATEGORY_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS rango_category_search_insert "
+    "AFTER INSERT ON rango_category "
+    "BEGIN "
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "VALUES (new.id * 2 + 1, 'category', new.id, new.slug, new.name, ''); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS rango_category_search_update "
+    "AFTER UPDATE OF name, slug ON rango_category "
+    "BEGIN "
+    "DELETE FROM rango_search_index WHERE rowid = old.id * 2 + 1; "
+    "INSERT INTO rango_search_index (rowid, kind, object_id, slug, title, url) "
+    "VALUES (new.id * 2 + 1, 'category', new.id, new.slug, new.name, ''); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS rango_category_search_delete "
+    "AFTER DELETE ON rango_category "
+    "BEGIN "
+    "DELETE FROM rango_search_index WHERE rowid = old.id * 2 + 1; "
+    "END",
+]
+
+
+def restore_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CATEGORY_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+def fill_aggregates(apps, schema_editor):
+    Category = apps.get_model('rango', 'Category')
+    Page = apps.get_model('rango', 'Page')
+    rows = (Page.objects.order_by().values_list('category')
+            .annotate(Count('pk'), Sum('views')))
+    for category_id, pages, views in rows:
+        Category.objects.filter(pk=category_id).update(
+            page_count=pages, total_page_views=views or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0009_search_index'),
+    ]
+
+    operations = [
+        # removing the columns copies the table again
+        migrations.RunPython(migrations.RunPython.noop, restore_triggers),
+        migrations.AddField(
+            model_name='category',
+            name='page_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='total_page_views',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-total_page_views', 'name'], name='rango_categ_total_p_242489_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-page_count', 'name'], name='rango_categ_page_co_1e763d_idx'),
+        ),
+        migrations.RunPython(restore_triggers, restore_triggers),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 04:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0010_category_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('page', 'page'), ('category', 'category')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('bucket', models.IntegerField()),
+                ('views', models.IntegerField(default=0)),
+                ('likes', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Trending',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=10)),
+                ('kind', models.CharField(choices=[('page', 'page'), ('category', 'category')], max_length=10)),
+                ('rank', models.PositiveIntegerField()),
+                ('object_id', models.IntegerField()),
+                ('title', models.CharField(max_length=128)),
+                ('url', models.URLField(blank=True)),
+                ('slug', models.SlugField(blank=True, max_length=128)),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='trending',
+            unique_together=set([('window', 'kind', 'rank')]),
+        ),
+        migrations.AddIndex(
+            model_name='activitybucket',
+            index=models.Index(fields=['kind', 'bucket'], name='rango_activ_kind_efa5e3_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='activitybucket',
+            unique_together=set([('kind', 'object_id', 'bucket')]),
+        ),
+    ]
@@ -10,21 +10,46 @@ class Category(models.Model):
     name = name of the category
     slug = name slugified for URL purposes
     pub_date = date the category was published
+    modified = last time the category was changed
+    page_count = number of pages in the category
+    total_page_views = sum of the views of its pages
     pages = reverse lookup for pages related to a category
+
+    page_count and total_page_views are kept up to date by
+    rango.aggregates, saving a category never writes them.
     """
 
     class Meta:
         verbose_name_plural='Categories'
+        indexes = [
+            # top categories on the index page, sidebar and category list
+            models.Index(fields=['-likes', 'name']),
+            # the same, ranked by activity
+            models.Index(fields=['-total_page_views', 'name']),
+            models.Index(fields=['-page_count', 'name']),
+        ]
 
     name = models.CharField(max_length=128, unique=True)
     slug = models.SlugField(max_length=128, unique=True)
     views = models.IntegerField(default=0)
     likes = models.IntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    page_count = models.IntegerField(default=0, editable=False)
+    total_page_views = models.BigIntegerField(default=0, editable=False)
+
+    AGGREGATE_FIELDS = ('page_count', 'total_page_views')
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
         if self.views < 0:
             self.views = 0
+        if not self._state.adding and not args and not (
+                kwargs.get('force_insert') or kwargs.get('update_fields')):
+            # the aggregates are only changed by increments, writing back
+            # the values read with the category would undo those since
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.AGGREGATE_FIELDS]
         super(Category, self).save(*args, **kwargs)
 
     def __str__(self):
@@ -38,12 +63,24 @@ class Page(models.Model):
     title = page title
     url = page url
     views = number of times users have viewed the page
+    modified = last time the page was changed
     """
     
+    class Meta:
+        indexes = [
+            # pages are looked up by url by rango.importer
+            models.Index(fields=['url', 'category']),
+            # a category's pages, most viewed first, paginated on (views, id)
+            models.Index(fields=['category', '-views', '-id']),
+            # most viewed pages on the index page
+            models.Index(fields=['-views']),
+        ]
+
     category = models.ForeignKey(Category, related_name='pages')
     title = models.CharField(max_length=128)
     url = models.URLField()
     views = models.IntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.title
@@ -57,13 +94,129 @@ class UserProfile(models.Model):
         (https://docs.djangoproject.com/en/1.11/ref/contrib/auth/#django.contrib.auth.models.User)
     website - allows url of user's personal website
     picture - user's profile picture
+    thumbnail - small square copy of the picture, made by rango.thumbnails
+    thumbnail_webp - the same thumbnail in WebP
+    thumbnail_source - name of the picture the thumbnails were made from
     """
 
     # https://docs.djangoproject.com/en/1.11/ref/contrib/auth/#django.contrib.auth.models.User
     user = models.OneToOneField(User, related_name='user_profile')
     website = models.URLField(blank=True)
     picture = models.ImageField(upload_to='profile_images', blank=True)
+    thumbnail = models.ImageField(blank=True, editable=False)
+    thumbnail_webp = models.FileField(blank=True, editable=False)
+    thumbnail_source = models.CharField(max_length=100, blank=True,
+                                        editable=False)
 
     def __str__(self):
         # returns username from User model
         return self.user.username
+
+
+class Task(models.Model):
+    """
+    A function call queued for the task worker, see rango.tasks
+    name = dotted path of the function
+    arguments = JSON list of its positional arguments
+    status = queued, running, done or failed
+    attempts = number of times a worker started it
+    max_attempts = attempts before it is marked failed
+    run_at = when it may run next; while running, when its lease expires
+    result = JSON return value, once done
+    error = traceback of the last failure
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(s, s) for s in (QUEUED, RUNNING, DONE, FAILED)]
+
+    class Meta:
+        indexes = [
+            # workers look for due tasks by status and time
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    name = models.CharField(max_length=200)
+    arguments = models.TextField(default='[]')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{0} #{1} ({2})'.format(self.name, self.pk, self.status)
+
+
+class ActivityBucket(models.Model):
+    """
+    Views and likes of a page or category during one bucket of time,
+    written by rango.trending after every counter flush
+    kind = 'page' or 'category'
+    object_id = primary key of the page or category
+    bucket = start of the bucket, in seconds since the epoch divided by
+        the bucket length
+    views = views of the page, or of the category's pages
+    likes = likes of the category
+    """
+
+    PAGE = 'page'
+    CATEGORY = 'category'
+    KINDS = [(k, k) for k in (PAGE, CATEGORY)]
+
+    class Meta:
+        unique_together = [('kind', 'object_id', 'bucket')]
+        indexes = [
+            # scores are summed over the buckets of a window
+            models.Index(fields=['kind', 'bucket']),
+        ]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.IntegerField()
+    bucket = models.IntegerField()
+    views = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '{0} {1} @{2}'.format(self.kind, self.object_id, self.bucket)
+
+
+class Trending(models.Model):
+    """
+    A hot page or category, ranked by rango.trending for a window of time.
+    Titles and links are copied, so a ranking is shown without reading
+    the pages or categories.
+    window = name of the window, a key of RANGO_TRENDING['WINDOWS']
+    kind = 'page' or 'category'
+    rank = position in the ranking, from 1
+    object_id = primary key of the page or category
+    title = page title or category name
+    url = page url, empty for categories
+    slug = category slug, empty for pages
+    score = time-decayed views and likes
+    """
+
+    class Meta:
+        unique_together = [('window', 'kind', 'rank')]
+
+    window = models.CharField(max_length=10)
+    kind = models.CharField(max_length=10, choices=ActivityBucket.KINDS)
+    rank = models.PositiveIntegerField()
+    object_id = models.IntegerField()
+    title = models.CharField(max_length=128)
+    url = models.URLField(blank=True)
+    slug = models.SlugField(max_length=128, blank=True)
+    score = models.FloatField()
+
+    @property
+    def name(self):
+        return self.title
+
+    def __str__(self):
+        return '{0} {1} #{2}: {3}'.format(self.window, self.kind, self.rank,
+                                          self.title)
@@ -0,0 +1,219 @@
+"""
+Response caching and conditional GET for Rango's public pages.
+
+Anonymous GET requests to views decorated with cache_public_page are
+answered from Django's cache, and carry ETag and Last-Modified headers
+so browsers can revalidate with a 304 Not Modified.
+
+Both are derived from a single "content stamp": the latest modification
+of any Category or Page. The stamp is kept in the cache and moved forward
+by the signal receivers in rango.signals whenever a Category or Page is
+written, which makes every cached response stale at once. Writes are
+made by every web process and the task worker, so the cache must be
+shared between them (see CACHES in settings.py): with a per-process
+cache, the others would keep serving, and answering 304 for, pages
+cached before the write. Pages rendered within the replicas' PIN_SECONDS
+of the stamp moving read the primary, a replica might not have the
+change yet and the page would be cached under the new stamp without it.
+
+Views and likes are flushed by rango.counters every few seconds, which
+would leave no time for a page to be served from the cache if each
+flush moved the stamp. Pages use the later of the stamp and the start of
+the current COUNTERS_MAX_AGE period instead, so they're rendered again,
+showing the counters, once a period at most.
+
+    RANGO_PAGE_CACHE = {
+        'ENABLED': True,
+        'TIMEOUT': 60 * 5,         # seconds a cached response is kept
+        'COUNTERS_MAX_AGE': 60,    # seconds counters shown may lag behind
+    }
+
+Pages varying on the session have no Last-Modified, which would be the
+same for every variant; they're revalidated by ETag only.
+
+Hits, misses and 304s are counted in the cache, see page_cache_stats().
+"""
+import datetime
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .models import Category, Page
+from .replicas import get_replica_settings, primary_reads
+
+
+PAGE_CACHE_DEFAULTS = {
+    'ENABLED': True,
+    'TIMEOUT': 60 * 5,
+    'COUNTERS_MAX_AGE': 60,
+}
+
+STAMP_KEY = 'rango:page_cache:stamp'
+STATS_KEYS = ('hits', 'misses', 'not_modified')
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def get_page_cache_settings():
+    """
+    Returns PAGE_CACHE_DEFAULTS updated with the RANGO_PAGE_CACHE setting
+    """
+    options = dict(PAGE_CACHE_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_PAGE_CACHE', {}))
+    return options
+
+
+def content_stamp():
+    """
+    Returns the time Rango's categories or pages last changed
+    """
+    stamp = cache.get(STAMP_KEY)
+    if stamp is None:
+        stamps = [
+            Category.objects.aggregate(latest=Max('modified'))['latest'],
+            Page.objects.aggregate(latest=Max('modified'))['latest'],
+        ]
+        stamp = max([s for s in stamps if s is not None] or [EPOCH])
+        cache.add(STAMP_KEY, stamp, None)
+    return stamp
+
+
+def page_stamp(stamp, options):
+    """
+    Returns the content [stamp], or the start of the current
+    COUNTERS_MAX_AGE period if that's later
+    """
+    period = options['COUNTERS_MAX_AGE']
+    if period:
+        now = time.time()
+        stamp = max(stamp, datetime.datetime.fromtimestamp(
+            now - now % period, timezone.utc))
+    return stamp
+
+
+def content_changed():
+    """
+    Moves the content stamp forward, invalidating every cached page.
+    Called by signal receivers when a Category or Page is written, except
+    for flushed counters.
+    """
+    stamp = timezone.now()
+    previous = cache.get(STAMP_KEY)
+    if previous is not None and stamp <= previous:
+        stamp = previous + datetime.timedelta(microseconds=1)
+    cache.set(STAMP_KEY, stamp, None)
+
+
+def _count(name):
+    key = 'rango:page_cache:' + name
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def page_cache_stats():
+    """
+    Returns a dictionary of hits, misses, not_modified and hit_rate.
+    304 responses count as hits.
+    """
+    stats = {name: cache.get('rango:page_cache:' + name, 0)
+             for name in STATS_KEYS}
+    served = stats['hits'] + stats['not_modified']
+    total = served + stats['misses']
+    stats['hit_rate'] = served / total if total else 0.0
+    return stats
+
+
+def reset_page_cache_stats():
+    cache.delete_many(['rango:page_cache:' + name for name in STATS_KEYS])
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')]
+    if modified is None:
+        return False
+
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is not None:
+        return int(modified.timestamp()) <= if_modified_since
+    return False
+
+
+def _finish(response, etag, modified, status):
+    response['ETag'] = etag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified.timestamp())
+    response['Cache-Control'] = 'max-age=0, must-revalidate'
+    response['X-Cache'] = status
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def cache_public_page(vary_on_session=()):
+    """
+    Caches responses to anonymous GET requests and answers conditional
+    requests with 304 Not Modified.
+    Responses are cached per full path and per value of each session key
+    in [vary_on_session].
+    Authenticated users and other methods always get the view itself.
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            options = get_page_cache_settings()
+            if (not options['ENABLED']
+                    or request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view_func(request, *args, **kwargs)
+
+            changed = content_stamp()
+            stamp = page_stamp(changed, options)
+            # the same for every variant, so it can't tell them apart
+            modified = None if vary_on_session else stamp
+            variant = '|'.join(
+                [request.get_full_path(), stamp.isoformat()] +
+                [str(request.session.get(key)) for key in vary_on_session])
+            digest = hashlib.md5(variant.encode('utf-8')).hexdigest()
+            etag = quote_etag(digest)
+
+            if _not_modified(request, etag, modified):
+                _count('not_modified')
+                return _finish(HttpResponseNotModified(), etag, modified,
+                               'HIT')
+
+            key = 'rango:page_cache:response:' + digest
+            cached = cache.get(key)
+            if cached is not None:
+                _count('hits')
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                return _finish(response, etag, modified, 'HIT')
+
+            _count('misses')
+            lagging = timezone.now() - changed < datetime.timedelta(
+                seconds=get_replica_settings()['PIN_SECONDS'])
+            with primary_reads(lagging):
+                response = view_func(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming:
+                    if hasattr(response, 'render'):
+                        response.render()
+                    cache.set(key, (response.content,
+                                    response['Content-Type']),
+                              options['TIMEOUT'])
+                    _finish(response, etag, modified, 'MISS')
+            return response
+        return _wrapped_view
+    return decorator
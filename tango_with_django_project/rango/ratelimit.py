@@ -0,0 +1,311 @@
+"""
+Token bucket rate limiting of the AJAX endpoints.
+
+like_category, add_page, suggest_category and goto are requested by
+scripts on every click or pause in typing, and each writes to or reads
+the database. RateLimitMiddleware gives every client a bucket per
+endpoint holding up to REQUESTS tokens, refilled at REQUESTS per
+SECONDS. A request takes a token, and is answered with 429 Too Many
+Requests and a Retry-After header when there's none left, with
+RANGO_RATELIMIT:
+
+    RANGO_RATELIMIT = {
+        'ENABLED': True,
+        'STORE': 'cache',          # 'cache' (shared) or 'memory' (per process)
+        'CACHE_ALIAS': 'default',
+        'LIMITS': {                # URL name: (REQUESTS, SECONDS)
+            'like_category': (10, 60),
+            'add_page': (20, 60),
+            'suggest_category': (20, 10),
+            'goto': (30, 60),
+        },
+        'IP_MULTIPLIER': 5,        # see below
+        'IP_HEADER': 'REMOTE_ADDR',   # e.g. 'HTTP_X_REAL_IP' behind a proxy
+    }
+
+The middleware comes before SessionMiddleware, so over-limit requests
+are refused before the session or user is loaded, without a query.
+Clients are told apart by their session cookie, and by their IP address
+if they have none. Requests with a session cookie also take a token
+from their IP address's bucket, IP_MULTIPLIER times larger, so users
+sharing an address aren't limited as one, and made up cookies don't get
+a script around the limit.
+
+Buckets are kept as the time they'll be full again (GCRA), a single
+number the 'cache' store changes with the cache's atomic incr, so every
+process sharing the cache shares the buckets. If the cache fails, the
+process falls back to buckets of its own. Allowed and limited requests
+are counted per endpoint and shown by the metrics view.
+"""
+import collections
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.core.urlresolvers import Resolver404, resolve
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+
+RATELIMIT_DEFAULTS = {
+    'ENABLED': True,
+    'STORE': 'cache',
+    'CACHE_ALIAS': 'default',
+    'LIMITS': {
+        'like_category': (10, 60),
+        'add_page': (20, 60),
+        'suggest_category': (20, 10),
+        'goto': (30, 60),
+    },
+    'IP_MULTIPLIER': 5,
+    'IP_HEADER': 'REMOTE_ADDR',
+}
+
+# (name, type, help) of the per endpoint metrics
+RATELIMIT_METRICS = [
+    ('ratelimit_allowed_total', 'counter',
+     'Rate limited endpoint requests let through.'),
+    ('ratelimit_limited_total', 'counter',
+     'Rate limited endpoint requests refused with 429.'),
+]
+
+# and of the unlabelled ones
+RATELIMIT_STORE_METRICS = [
+    ('ratelimit_store_fallbacks_total', 'counter',
+     'Rate limit checks made in process memory as the cache failed.'),
+]
+
+
+def get_ratelimit_settings():
+    """
+    Returns RATELIMIT_DEFAULTS updated with the RANGO_RATELIMIT setting
+    """
+    options = dict(RATELIMIT_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_RATELIMIT', {}))
+    return options
+
+
+class MemoryBucketStore(object):
+    """
+    Keeps the buckets of this process in a dictionary guarded by a lock
+    """
+
+    # full buckets are forgotten once there are more than this many
+    max_buckets = 10000
+
+    def __init__(self):
+        self._full_at = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, interval, capacity, now):
+        """
+        Takes a token from the bucket [key], refilled with one token
+        every [interval] seconds up to [capacity]. Returns 0, or the
+        seconds until a token is available if there's none.
+        """
+        with self._lock:
+            full_at = max(self._full_at.get(key, now), now) + interval
+            wait = full_at - now - capacity * interval
+            if wait > 0:
+                return wait
+            self._full_at[key] = full_at
+            if len(self._full_at) > self.max_buckets:
+                self._forget_full(now)
+        return 0
+
+    def _forget_full(self, now):
+        for key in [k for k, full_at in self._full_at.items()
+                    if full_at <= now]:
+            del self._full_at[key]
+
+
+class CacheBucketStore(object):
+    """
+    Keeps buckets in Django's cache, shared between processes, as whole
+    milliseconds changed with the atomic incr and decr
+    """
+
+    prefix = 'rango:ratelimit'
+
+    # seconds a bucket is kept after it was created. incr and decr keep
+    # the expiry add() gave it, so it must outlast sustained traffic: a
+    # bucket emptied by the expiry would let a whole burst through again.
+    # Staying longer than it takes to fill is harmless, a stale "full at"
+    # time is started again from now.
+    key_timeout = 60 * 60 * 24
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+        self.fallback = MemoryBucketStore()
+        self.fallbacks = 0
+
+    def take(self, key, interval, capacity, now):
+        try:
+            return self._take(key, interval, capacity, now)
+        except Exception:
+            # the cache is down, limit this process on its own
+            self.fallbacks += 1
+            return self.fallback.take(key, interval, capacity, now)
+
+    def _take(self, key, interval, capacity, now):
+        cache_key = '{0}:{1}'.format(self.prefix, key)
+        now_ms = int(now * 1000)
+        step = max(int(interval * 1000), 1)
+        timeout = max(self.key_timeout,
+                      int(math.ceil(interval * capacity)) + 1)
+
+        self.cache.add(cache_key, now_ms, timeout)
+        try:
+            full_at = self.cache.incr(cache_key, step)
+        except ValueError:
+            # expired since it was added
+            self.cache.set(cache_key, now_ms + step, timeout)
+            return 0
+        if full_at < now_ms + step:
+            # it was full: start again from now. Racing requests may each
+            # do so, letting a few more through once.
+            full_at = now_ms + step
+            self.cache.set(cache_key, full_at, timeout)
+
+        wait = full_at - now_ms - capacity * step
+        if wait > 0:
+            # give the token back
+            self.cache.decr(cache_key, step)
+            return wait / 1000.0
+        return 0
+
+
+class RateLimiter(object):
+    """
+    Checks requests against the LIMITS of their endpoints and counts the
+    outcomes
+    """
+
+    def __init__(self, store, options):
+        self.store = store
+        self.options = options
+        self._lock = threading.Lock()
+        self._counts = collections.defaultdict(collections.Counter)
+
+    def client_keys(self, request):
+        """
+        The (bucket key, capacity multiplier) of the client of [request]
+        """
+        ip = request.META.get(self.options['IP_HEADER'], '')
+        ip = ip.split(',')[0].strip() or 'unknown'
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if session_key:
+            return [('session:' + session_key, 1),
+                    ('ip:' + ip, self.options['IP_MULTIPLIER'])]
+        return [('ip:' + ip, 1)]
+
+    def check(self, name, request, now=None):
+        """
+        Takes a token for a request of the endpoint [name] from its
+        client's buckets. Returns 0 or the seconds to wait.
+        """
+        requests, seconds = self.options['LIMITS'][name]
+        interval = float(seconds) / requests
+        if now is None:
+            now = time.time()
+
+        wait = 0
+        for key, multiplier in self.client_keys(request):
+            wait = self.store.take('{0}:{1}'.format(name, key), interval,
+                                   requests * multiplier, now)
+            if wait:
+                break
+
+        with self._lock:
+            self._counts[name][
+                'ratelimit_limited_total' if wait else
+                'ratelimit_allowed_total'] += 1
+        return wait
+
+    def snapshot(self):
+        """
+        {endpoint: {metric: value}} of RATELIMIT_METRICS
+        """
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+    def store_metrics(self):
+        """
+        Values of RATELIMIT_STORE_METRICS
+        """
+        return {'ratelimit_store_fallbacks_total':
+                getattr(self.store, 'fallbacks', 0)}
+
+
+def build_rate_limiter(options=None):
+    """
+    Returns a RateLimiter configured from [options] or RANGO_RATELIMIT
+    """
+    options = options or get_ratelimit_settings()
+    if options['STORE'] == 'cache':
+        store = CacheBucketStore(options['CACHE_ALIAS'])
+    elif options['STORE'] == 'memory':
+        store = MemoryBucketStore()
+    else:
+        raise ValueError('Unknown rate limit store {0!r}'.format(
+            options['STORE']))
+    return RateLimiter(store, options)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide RateLimiter
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = build_rate_limiter()
+    return _limiter
+
+
+@receiver(setting_changed)
+def _ratelimit_settings_changed(sender, setting, **kwargs):
+    global _limiter
+    if setting in ('RANGO_RATELIMIT', 'CACHES'):
+        with _limiter_lock:
+            _limiter = None
+
+
+def too_many_requests(wait):
+    response = HttpResponse('Too many requests, slow down.\n', status=429,
+                            content_type='text/plain')
+    response['Retry-After'] = str(int(math.ceil(wait)))
+    return response
+
+
+class RateLimitMiddleware(object):
+    """
+    Refuses requests to the endpoints in LIMITS over their client's
+    limit. Must come before SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        if not get_ratelimit_settings()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        limiter = get_rate_limiter()
+        try:
+            name = resolve(request.path_info).url_name
+        except Resolver404:
+            name = None
+        if name in limiter.options['LIMITS']:
+            wait = limiter.check(name, request)
+            if wait:
+                return too_many_requests(wait)
+        return self.get_response(request)
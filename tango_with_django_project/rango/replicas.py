@@ -0,0 +1,167 @@
+"""
+Read replicas.
+
+Most requests only read: the index, category pages, category
+suggestions and the sidebar. ReplicaRouter sends reads to a database
+picked at random from the REPLICAS, and writes to the primary
+('default'), with RANGO_REPLICAS:
+
+    RANGO_REPLICAS = {
+        'DATABASES': ['replica1'],   # aliases of DATABASES to read from
+        'PIN_SECONDS': 10,           # reads stay on the primary after a write
+        'PRIMARY_MODELS': ['sessions.session', 'rango.task'],
+    }
+
+Replicas lag behind the primary, so a user who just liked a category or
+added a page could be shown the page without it. Reads go to the
+primary instead:
+
+- for the rest of a request or task, once it has written
+- for PIN_SECONDS after a user's write, through a timestamp kept in
+  their session by ReplicaPinMiddleware, if they have one or are
+  logged in
+- always for the PRIMARY_MODELS, which are read back right after being
+  written: sessions, and tasks claimed by a worker
+- for pages rendered into the page cache within PIN_SECONDS of a
+  change of Rango's content, see rango.page_cache
+
+Without REPLICAS everything goes to the primary, and the middleware
+removes itself.
+"""
+import contextlib
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+
+REPLICA_DEFAULTS = {
+    'DATABASES': [],
+    'PIN_SECONDS': 10,
+    'PRIMARY_MODELS': ['sessions.session', 'rango.task'],
+}
+
+# session key of the time reads are pinned to the primary until
+PIN_KEY = 'rango_primary_until'
+
+# whether the current request or task has written, or is pinned
+_local = threading.local()
+
+
+def get_replica_settings():
+    """
+    Returns REPLICA_DEFAULTS updated with the RANGO_REPLICAS setting
+    """
+    options = dict(REPLICA_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_REPLICAS', {}))
+    return options
+
+
+def start_request(pinned=False):
+    """
+    Forgets the writes of the previous request of this thread.
+    [pinned] sends every read of the new one to the primary.
+    """
+    _local.wrote = False
+    _local.pinned = pinned
+
+
+def has_written():
+    return getattr(_local, 'wrote', False)
+
+
+def reads_primary():
+    return has_written() or getattr(_local, 'pinned', False)
+
+
+@contextlib.contextmanager
+def writes_for_others():
+    """
+    Writes made within don't send the later reads of the current request
+    or task to the primary, e.g. flushing counters buffered for other
+    visitors
+    """
+    wrote = has_written()
+    try:
+        yield
+    finally:
+        _local.wrote = wrote
+
+
+@contextlib.contextmanager
+def primary_reads(pinned=True):
+    """
+    Sends the reads made within to the primary, if [pinned]
+    """
+    previous = getattr(_local, 'pinned', False)
+    _local.pinned = previous or pinned
+    try:
+        yield
+    finally:
+        _local.pinned = previous
+
+
+class ReplicaRouter(object):
+    """
+    Routes reads to the REPLICAS and writes to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        options = get_replica_settings()
+        if not options['DATABASES'] or reads_primary():
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower in options['PRIMARY_MODELS']:
+            return DEFAULT_DB_ALIAS
+        return random.choice(options['DATABASES'])
+
+    def db_for_write(self, model, **hints):
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS}
+        databases.update(get_replica_settings()['DATABASES'])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # replicas get the primary's schema through replication
+        if db in get_replica_settings()['DATABASES']:
+            return False
+        return None
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Pins the reads of a user to the primary for PIN_SECONDS after a
+    request of theirs has written. Must come after SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.options = get_replica_settings()
+        if not self.options['DATABASES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # only users with a session can have written, others' sessions
+        # aren't touched
+        pinned_until = 0
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            pinned_until = request.session.get(PIN_KEY, 0)
+        start_request(pinned=pinned_until > time.time())
+
+        response = self.get_response(request)
+
+        # pinning anonymous visitors without a session would start one
+        user = getattr(request, 'user', None)
+        if has_written() and hasattr(request, 'session') and (
+                settings.SESSION_COOKIE_NAME in request.COOKIES or
+                (user is not None and user.is_authenticated)):
+            request.session[PIN_KEY] = time.time() + self.options['PIN_SECONDS']
+        return response
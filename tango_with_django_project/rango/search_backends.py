@@ -0,0 +1,628 @@
+"""
+Pluggable search backends for Rango.
+
+run_query (see rango.webhose_search) no longer talks to Webhose directly.
+It asks a SearchService for results. The service wraps a backend with a
+result cache, so a query that was answered recently does not leave the
+process at all.
+
+Results older than CACHE_TTL are stale: for STALE_TTL more seconds they
+are still answered at once, while a background thread fetches fresh
+ones. Calls to the backend go through a CircuitBreaker: after
+BREAKER_THRESHOLD failures in a row it refuses calls for BREAKER_RESET
+seconds, then lets BREAKER_PROBES calls through to see whether the
+backend recovered. While it's open, cache misses fail at once and stale
+results are served without trying to refresh them.
+
+Everything is configured through the RANGO_SEARCH setting. Any key left
+out falls back to SEARCH_DEFAULTS:
+
+    RANGO_SEARCH = {
+        'BACKEND': 'rango.search_backends.WebhoseBackend',
+        'ROOT_URL': 'http://webhose.io/search',
+        'TIMEOUT': 3.0,        # total seconds allowed for one query
+        'POOL_SIZE': 4,        # idle keep-alive connections kept around
+        'CACHE': 'local',      # 'local', 'django' or None
+        'CACHE_ALIAS': 'default',
+        'CACHE_TTL': 900,      # seconds results are fresh
+        'STALE_TTL': 3600,     # seconds more stale results may be served
+        'CACHE_SIZE': 256,     # only used by the 'local' cache
+        'BREAKER_THRESHOLD': 5,    # failures in a row opening the breaker
+        'BREAKER_RESET': 30,       # seconds it stays open
+        'BREAKER_PROBES': 1,       # calls let through to test the backend
+        'WORKERS': 8,          # threads running queries for page requests
+        'DEADLINE': 2.0,       # seconds a page request waits for results
+        'RELATED_QUERIES': 3,  # top page titles searched with a category
+    }
+"""
+import collections
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import queue
+import socket
+import threading
+import time
+import urllib.parse
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+SEARCH_DEFAULTS = {
+    'BACKEND': 'rango.search_backends.WebhoseBackend',
+    'ROOT_URL': 'http://webhose.io/search',
+    'API_KEY': None,
+    'TIMEOUT': 3.0,
+    'POOL_SIZE': 4,
+    'CACHE': 'local',
+    'CACHE_ALIAS': 'default',
+    'CACHE_TTL': 60 * 15,
+    'STALE_TTL': 60 * 60,
+    'CACHE_SIZE': 256,
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RESET': 30,
+    'BREAKER_PROBES': 1,
+    'WORKERS': 8,
+    'DEADLINE': 2.0,
+    'RELATED_QUERIES': 3,
+}
+
+
+class SearchError(Exception):
+    """
+    Raised by a backend when the upstream search could not be completed.
+    """
+
+
+class SearchTimeout(SearchError):
+    """
+    Raised when a query used up its whole timeout budget.
+    """
+
+
+class CircuitOpenError(SearchError):
+    """
+    Raised instead of calling a backend that has been failing.
+    """
+
+
+# (name, type, help) of the search metrics, see search_metrics()
+SEARCH_METRICS = [
+    ('search_fresh_hits_total', 'counter', 'Searches answered from cache.'),
+    ('search_stale_hits_total', 'counter',
+     'Searches answered with stale results while they were refreshed.'),
+    ('search_misses_total', 'counter', 'Searches sent to the backend.'),
+    ('search_failures_total', 'counter', 'Backend calls that failed.'),
+    ('search_rejected_total', 'counter',
+     'Backend calls refused by the open circuit breaker.'),
+    ('search_breaker_opened_total', 'counter',
+     'Times the circuit breaker opened.'),
+    ('search_breaker_open', 'gauge',
+     '1 while the circuit breaker refuses calls, 0.5 while probing.'),
+]
+
+
+def get_search_settings():
+    """
+    Returns SEARCH_DEFAULTS updated with the project's RANGO_SEARCH setting
+    """
+    options = dict(SEARCH_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_SEARCH', {}))
+    return options
+
+
+def normalize_query(search_terms):
+    """
+    Lowercases a query and collapses whitespace, so that 'Python ' and
+    'python' share a cache entry.
+    """
+    return ' '.join(str(search_terms).lower().split())
+
+
+def make_cache_key(search_terms, size):
+    """
+    Builds a cache key from the normalized query and the result size.
+    The query is hashed so the key is safe for memcached.
+    """
+    raw = '{0}|{1}'.format(normalize_query(search_terms), int(size))
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return 'rango:search:{0}'.format(digest)
+
+
+class LocalResultCache(object):
+    """
+    Thread-safe cache held in process memory.
+    Entries expire after [ttl] seconds and the least recently used entry
+    is evicted once [max_size] entries are stored.
+    """
+
+    def __init__(self, max_size=256, ttl=900):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            # mark entry as most recently used
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoResultCache(object):
+    """
+    Stores results through Django's cache framework, so every process
+    sharing the cache (memcached, redis, database...) shares results.
+    Eviction is left to the cache backend.
+    """
+
+    def __init__(self, alias='default', ttl=900):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to [size] idle keep-alive connections to a single host.
+    Connections are handed out most recently used first, so idle ones
+    age out on the server side instead of in our pool.
+    """
+
+    def __init__(self, scheme, host, port=None, size=4):
+        if scheme == 'https':
+            self.connection_class = http.client.HTTPSConnection
+        else:
+            self.connection_class = http.client.HTTPConnection
+        self.host = host
+        self.port = port
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self, timeout):
+        """
+        Returns (connection, reused). [reused] is True when the connection
+        came from the pool and may have been closed by the server since.
+        """
+        try:
+            conn = self._idle.get_nowait()
+            conn.timeout = timeout
+            return conn, True
+        except queue.Empty:
+            conn = self.connection_class(self.host, self.port, timeout=timeout)
+            return conn, False
+
+    def release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def discard(self, conn):
+        conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class BaseSearchBackend(object):
+    """
+    Backends take the options dictionary from get_search_settings()
+    and implement search(), returning a list of dictionaries with
+    'title', 'link' and 'summary' keys.
+    Backends raise SearchError when the search can't be completed.
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def search(self, search_terms, size=10):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class WebhoseBackend(BaseSearchBackend):
+    """
+    Queries the Webhose search API over a pool of keep-alive connections.
+    TIMEOUT is a budget for the whole query: connecting, sending and
+    reading all share it. The body is read in chunks of chunk_size bytes,
+    checking the budget before each; the status line and headers are
+    only bounded by the socket timeout of each recv.
+    """
+
+    chunk_size = 16 * 1024
+
+    def __init__(self, options):
+        super(WebhoseBackend, self).__init__(options)
+        url = urllib.parse.urlsplit(options['ROOT_URL'])
+        self.path = url.path or '/'
+        self.timeout = float(options['TIMEOUT'])
+        self.pool = ConnectionPool(url.scheme, url.hostname, url.port,
+                                   size=options['POOL_SIZE'])
+        self._api_key = options['API_KEY']
+
+    @property
+    def api_key(self):
+        if not self._api_key:
+            # imported here, webhose_search imports this module
+            from .webhose_search import read_webhose_key
+            self._api_key = read_webhose_key()
+        if not self._api_key:
+            raise KeyError('Webhose API key not found')
+        return self._api_key
+
+    def search(self, search_terms, size=10):
+        query_string = urllib.parse.urlencode([
+            ('token', self.api_key),
+            ('format', 'json'),
+            ('q', search_terms),
+            ('sort', 'relevancy'),
+            ('size', size),
+        ])
+        body = self._get('{0}?{1}'.format(self.path, query_string))
+
+        try:
+            json_response = json.loads(body.decode('utf-8'))
+            return [{'title': post['title'],
+                     'link': post['url'],
+                     'summary': post['text'][:200]}
+                    for post in json_response['posts']]
+        except (ValueError, KeyError, TypeError) as e:
+            raise SearchError('Malformed Webhose response: {0!r}'.format(e))
+
+    def _get(self, path):
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SearchTimeout('Webhose query timed out')
+
+            conn, reused = self.pool.acquire(remaining)
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                # getresponse() drops conn.sock when the server closes
+                sock = conn.sock
+                sock.settimeout(remaining)
+                conn.request('GET', path, headers={'Accept': 'application/json'})
+                response = conn.getresponse()
+                body = self._read(sock, response, deadline)
+            except socket.timeout:
+                self.pool.discard(conn)
+                raise SearchTimeout('Webhose query timed out')
+            except (http.client.HTTPException, OSError) as e:
+                self.pool.discard(conn)
+                if reused:
+                    # the server closed an idle connection, try a fresh one
+                    continue
+                raise SearchError('Error when querying Webhose API: {0!r}'.format(e))
+
+            if response.will_close:
+                self.pool.discard(conn)
+            else:
+                self.pool.release(conn)
+
+            if response.status != 200:
+                raise SearchError(
+                    'Webhose API returned HTTP {0}'.format(response.status))
+            return body
+
+    def _read(self, sock, response, deadline):
+        """
+        The body of [response], read in chunks so that a server sending it
+        slowly can't hold the query past [deadline]: the socket timeout
+        only bounds each recv, so it is lowered to what is left before
+        every chunk.
+        """
+        chunks = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('Webhose response too slow')
+            sock.settimeout(remaining)
+            chunk = response.read1(self.chunk_size)
+            if not chunk:
+                # read1 doesn't mark a response read to its Content-Length
+                # as done, read() does so the connection can be reused
+                response.read()
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def close(self):
+        self.pool.close()
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a backend that keeps failing.
+
+    closed: calls go through; [threshold] failures in a row open it.
+    open: calls raise CircuitOpenError for [reset_timeout] seconds.
+    half open: [probes] calls go through at a time, others are refused.
+        A success closes the breaker, a failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half open'
+
+    def __init__(self, threshold=5, reset_timeout=30, probes=1,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = 0
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allows(self):
+        """
+        False while calls would be refused
+        """
+        with self._lock:
+            state = self._state()
+            return (state == self.CLOSED or
+                    (state == self.HALF_OPEN and self.probing < self.probes))
+
+    def call(self, function, *args, **kwargs):
+        """
+        Returns function(*args, **kwargs), counting SearchErrors it raises
+        as failures. Raises CircuitOpenError when the breaker is open.
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.HALF_OPEN and self.probing < self.probes:
+                self.probing += 1
+            elif state != self.CLOSED:
+                self.stats['rejected'] += 1
+                raise CircuitOpenError('Search backend is failing, '
+                                       'not calling it')
+            probe = state == self.HALF_OPEN
+
+        try:
+            result = function(*args, **kwargs)
+        except SearchError:
+            with self._lock:
+                self.stats['failures'] += 1
+                self.failures += 1
+                if probe or (self.opened_at is None and
+                             self.failures >= self.threshold):
+                    self.opened_at = self.clock()
+                    self.stats['opened'] += 1
+            raise
+        finally:
+            if probe:
+                # released whatever the probe raised, or the breaker
+                # would refuse every call from now on
+                with self._lock:
+                    self.probing -= 1
+
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+        return result
+
+
+class SearchService(object):
+    """
+    Answers queries from [cache] when possible, asking [backend] through
+    [breaker] otherwise. Cached results are fresh for [fresh_ttl] seconds,
+    after that they are answered while a background thread refreshes
+    them, until the cache drops them. Failed searches are never cached.
+    """
+
+    def __init__(self, backend, cache=None, breaker=None, fresh_ttl=900):
+        self.backend = backend
+        self.cache = cache
+        self.breaker = breaker or CircuitBreaker()
+        self.fresh_ttl = fresh_ttl
+        self.stats = collections.Counter()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def search(self, search_terms, size=10):
+        key = make_cache_key(search_terms, size)
+
+        # entries are (time fetched, results)
+        entry = self.cache.get(key) if self.cache is not None else None
+        if isinstance(entry, tuple):
+            fetched, results = entry
+            if time.time() - fetched < self.fresh_ttl:
+                self._count('fresh_hits')
+            else:
+                self._count('stale_hits')
+                self._refresh_later(key, search_terms, size)
+            return list(results)
+
+        self._count('misses')
+        return self._fetch(key, search_terms, size)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _fetch(self, key, search_terms, size):
+        results = self.breaker.call(self.backend.search, search_terms, size)
+        if self.cache is not None:
+            self.cache.set(key, (time.time(), results))
+        return list(results)
+
+    def _refresh_later(self, key, search_terms, size):
+        # one refresh per query at a time, and none while the breaker
+        # would refuse it anyway
+        with self._lock:
+            if key in self._refreshing or not self.breaker.allows():
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._fetch(key, search_terms, size)
+            except SearchError:
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        get_search_executor().submit(refresh)
+
+    def metrics(self):
+        """
+        Values of SEARCH_METRICS for this service
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        state = self.breaker.state
+        return {
+            'search_fresh_hits_total': stats.get('fresh_hits', 0),
+            'search_stale_hits_total': stats.get('stale_hits', 0),
+            'search_misses_total': stats.get('misses', 0),
+            'search_failures_total': self.breaker.stats['failures'],
+            'search_rejected_total': self.breaker.stats['rejected'],
+            'search_breaker_opened_total': self.breaker.stats['opened'],
+            'search_breaker_open': {CircuitBreaker.CLOSED: 0,
+                                    CircuitBreaker.HALF_OPEN: 0.5,
+                                    CircuitBreaker.OPEN: 1}[state],
+        }
+
+    def close(self):
+        self.backend.close()
+
+
+def build_search_service(options=None):
+    """
+    Creates a SearchService from RANGO_SEARCH (or the given options)
+    """
+    if options is None:
+        options = get_search_settings()
+
+    backend = import_string(options['BACKEND'])(options)
+
+    # the caches keep results until they are too stale to serve
+    ttl = options['CACHE_TTL'] + options['STALE_TTL']
+    if options['CACHE'] == 'local':
+        cache = LocalResultCache(options['CACHE_SIZE'], ttl)
+    elif options['CACHE'] == 'django':
+        cache = DjangoResultCache(options['CACHE_ALIAS'], ttl)
+    else:
+        cache = None
+
+    breaker = CircuitBreaker(options['BREAKER_THRESHOLD'],
+                             options['BREAKER_RESET'],
+                             options['BREAKER_PROBES'])
+    return SearchService(backend, cache, breaker, options['CACHE_TTL'])
+
+
+_service = None
+_executor = None
+_service_lock = threading.Lock()
+
+
+def get_search_service():
+    """
+    Returns the process-wide SearchService, creating it on first use so the
+    connection pool and local cache are shared between requests.
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = build_search_service()
+    return _service
+
+
+def search_metrics():
+    """
+    Values of SEARCH_METRICS for this process's SearchService
+    """
+    return get_search_service().metrics()
+
+
+def get_search_executor():
+    """
+    Returns the process-wide thread pool that runs searches on behalf of
+    requests, so a slow upstream ties up these threads and not the worker.
+    """
+    global _executor
+    if _executor is None:
+        with _service_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=get_search_settings()['WORKERS'])
+    return _executor
+
+
+def reset_search_service():
+    """
+    Drops the process-wide SearchService and executor, closing connections.
+    Searches already running on the old executor are left to finish.
+    """
+    global _service, _executor
+    with _service_lock:
+        if _service is not None:
+            _service.close()
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _service = None
+        _executor = None
+
+
+@receiver(setting_changed)
+def _search_settings_changed(sender, setting, **kwargs):
+    if setting == 'RANGO_SEARCH':
+        reset_search_service()
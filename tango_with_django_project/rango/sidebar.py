@@ -0,0 +1,101 @@
+"""
+Cached category sidebar rendered by the get_category_list template tag.
+
+The sidebar shows the RANGO_SIDEBAR['TOP'] most liked categories, or
+those with the most page views or pages (see rango.aggregates), as does
+the index page. The rendered HTML is cached under a version number that
+is bumped whenever a category is saved, deleted or liked, or its pages
+change if they rank it, so rendering the sidebar costs two cache reads
+no matter how many categories exist. The full list is available,
+paginated, from the category_list view.
+
+    RANGO_SIDEBAR = {
+        'TOP': 20,            # categories shown in the sidebar
+        'ORDER': 'likes',     # or 'views' or 'pages'
+        'PAGE_SIZE': 50,      # categories per page of the full list
+        'TIMEOUT': 60 * 60,   # seconds a rendered sidebar is kept
+    }
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .aggregates import ranked_categories
+
+
+SIDEBAR_DEFAULTS = {
+    'TOP': 20,
+    'ORDER': 'likes',
+    'PAGE_SIZE': 50,
+    'TIMEOUT': 60 * 60,
+}
+
+VERSION_KEY = 'rango:sidebar:version'
+
+
+def get_sidebar_settings():
+    """
+    Returns SIDEBAR_DEFAULTS updated with the project's RANGO_SIDEBAR setting
+    """
+    options = dict(SIDEBAR_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_SIDEBAR', {}))
+    return options
+
+
+def sidebar_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def invalidate_sidebar():
+    """
+    Makes every cached sidebar stale by moving to a new version
+    """
+    cache.add(VERSION_KEY, 1, None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # the key was evicted between add and incr
+        cache.add(VERSION_KEY, 1, None)
+
+
+def top_categories(version, options):
+    """
+    Returns (categories, has_more) for the sidebar, cached per version.
+    One extra row is read to know whether a link to the full list is needed.
+    """
+    key = 'rango:sidebar:v{0}:top'.format(version)
+    top = cache.get(key)
+    if top is None:
+        rows = list(ranked_categories(options['ORDER'])
+                    .values('id', 'name', 'slug')[:options['TOP'] + 1])
+        top = (rows[:options['TOP']], len(rows) > options['TOP'])
+        cache.set(key, top, options['TIMEOUT'])
+    return top
+
+
+def render_sidebar(act_cat=None):
+    """
+    Returns the sidebar HTML, highlighting [act_cat] if it's listed
+    """
+    options = get_sidebar_settings()
+    version = sidebar_version()
+    cats, has_more = top_categories(version, options)
+
+    active = getattr(act_cat, 'pk', None)
+    if active not in [cat['id'] for cat in cats]:
+        active = None
+
+    key = 'rango:sidebar:v{0}:html:{1}'.format(version, active or 0)
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('rango/cats.html', {
+            'cats': cats,
+            'act_cat_id': active,
+            'has_more': has_more,
+        })
+        cache.set(key, html, options['TIMEOUT'])
+    return html
@@ -0,0 +1,99 @@
+"""
+Signal receivers keeping Rango's caches in sync with the database.
+Connected when the app is ready (see rango.apps.RangoConfig).
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import aggregates, autocomplete, trending
+from .counters import counters_flushed
+from .directory import invalidate_profile_count
+from .models import ActivityBucket, Category, Page, UserProfile
+from .page_cache import content_changed
+from .search_backends import get_search_settings
+from .sidebar import get_sidebar_settings, invalidate_sidebar
+from .thumbnails import schedule_thumbnails
+from .webhose_search import warm_search
+
+
+def invalidate_caches():
+    """
+    Marks every cache derived from categories and pages as stale.
+    Used after bulk writes, which don't send model signals.
+    """
+    content_changed()
+    invalidate_sidebar()
+    autocomplete.invalidate()
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created=False, **kwargs):
+    content_changed()
+    invalidate_sidebar()
+    autocomplete.category_saved(instance)
+    # its page searches for its name first, other processes only see
+    # results warmed by the worker through a shared cache
+    if created and get_search_settings()['CACHE'] == 'django':
+        warm_search.delay(instance.name)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    content_changed()
+    invalidate_sidebar()
+    autocomplete.category_deleted(instance)
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def page_changed(sender, **kwargs):
+    content_changed()
+
+
+@receiver(post_save, sender=Page)
+def page_saved(sender, instance, created=False, raw=False, using=None,
+               **kwargs):
+    # fixtures load categories with their aggregates
+    if created and not raw:
+        aggregates.page_created(instance, using)
+        aggregates_changed()
+
+
+@receiver(post_delete, sender=Page)
+def page_deleted(sender, instance, using=None, **kwargs):
+    aggregates.page_deleted(instance, using)
+    aggregates_changed()
+
+
+def aggregates_changed():
+    # the sidebar only needs redrawing if it's ranked by them
+    if get_sidebar_settings()['ORDER'] != 'likes':
+        invalidate_sidebar()
+
+
+@receiver(counters_flushed)
+def counters_written(sender, model, field, deltas, **kwargs):
+    # cached pages show them within COUNTERS_MAX_AGE, see page_cache
+    if model is Category and field == 'likes':
+        invalidate_sidebar()
+        autocomplete.likes_flushed(deltas)
+        trending.record(ActivityBucket.CATEGORY, 'likes', deltas)
+    elif model is Page and field == 'views':
+        category_views = aggregates.views_flushed(deltas)
+        aggregates_changed()
+        trending.record(ActivityBucket.PAGE, 'views', deltas)
+        trending.record(ActivityBucket.CATEGORY, 'views', category_views)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, **kwargs):
+    # only the number of profiles is cached, edits don't change it
+    if kwargs.get('created', True):
+        invalidate_profile_count()
+
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_saved(sender, instance, **kwargs):
+    schedule_thumbnails(instance)
@@ -15,7 +15,40 @@ $(document).ready(function() {
         });
     });
 
-    $('.add_page').click(function(){
+    // search results are loaded after the category page is rendered,
+    // so the page never waits on the search provider
+    var search_results = $('#search_results')
+
+    function load_search_results(query) {
+        search_results.html('<p>Loading search results...</p>');
+        $.get(search_results.attr("data-url"), {query: query}, function(data) {
+            search_results.html(data);
+        });
+    }
+
+    if (search_results.length && !search_results.attr("data-loaded")) {
+        load_search_results('');
+    }
+
+    $('#search').submit(function(event){
+        if (search_results.length) {
+            event.preventDefault();
+            load_search_results($(this).find('input[name="query"]').val());
+        }
+    });
+
+    // likewise the web results of the search page come after its own
+    var web_results = $('#web_results')
+
+    if (web_results.length) {
+        web_results.html('<p>Searching the web...</p>');
+        $.get(web_results.attr("data-url"), {query: web_results.attr("data-query")}, function(data) {
+            web_results.html(data);
+        });
+    }
+
+    // results are added to the page after load, so listen on the document
+    $(document).on('click', '.add_page', function(){
         // adds page to category
         
         var url = $(this).attr("data-url")
@@ -24,18 +57,100 @@ $(document).ready(function() {
         var current_button = $(this)
 
         $.get('/rango/add_page', {url: url, name: name, cat_id: cat_id}, function(data) {
-            console.log($(this))
             current_button.next('.page_added').text('Page Added');
             current_button.hide();
-            $('#pages').html(data)
+
+            // only the new page's row comes back, put it on top
+            var row = $($.parseHTML($.trim(data)));
+            if (!$('#page_list').length) {
+                $('#pages').html('<ul id="page_list"></ul>');
+            }
+            if (!$('#' + row.attr('id')).length) {
+                $('#page_list').prepend(row);
+            }
         });
     });
 
-    $('#suggestion').keyup(function() {
-        var query = $(this).val();
-        console.log(query)
-        $.get('/rango/suggest/', {suggestion: query}, function(data){
-            $('#cats').html(data);
+    // infinite scroll: load the next chunk of pages when the end of the
+    // list comes into view
+    var loading_pages = false;
+
+    function load_more_pages() {
+        var more = $('#page_list .more_pages');
+        if (!more.length || loading_pages) {
+            return;
+        }
+
+        loading_pages = true;
+        $.get(more.attr("data-url"), function(data) {
+            // skip pages already shown, e.g. added since the page loaded
+            var rows = $($.parseHTML(data)).filter(function() {
+                return !this.id || !document.getElementById(this.id);
+            });
+            more.replaceWith(rows);
+            loading_pages = false;
+            pages_in_view();
+        }).fail(function() {
+            loading_pages = false;
         });
+    }
+
+    function pages_in_view() {
+        var more = $('#page_list .more_pages');
+        if (more.length && more.offset().top < $(window).scrollTop() + $(window).height() + 200) {
+            load_more_pages();
+        }
+    }
+
+    $(window).scroll(pages_in_view);
+    pages_in_view();
+
+    $(document).on('click', '.more_pages a', function(event) {
+        event.preventDefault();
+        load_more_pages();
+    });
+
+    // category autocomplete: wait for a pause in typing, and only
+    // show the answer to the latest request
+    var sidebar = $('#cats').html();
+    var suggest_timer = null;
+    var suggest_request = null;
+
+    function show_suggestions(data) {
+        var list = $('<ul></ul>');
+        $.each(data.categories, function(i, category) {
+            var link = $('<a></a>').attr('href', category.url).text(category.name);
+            list.append($('<li></li>').append(link));
+        });
+        if (!data.categories.length) {
+            list.append('<li><strong>No matching categories.</strong></li>');
+        }
+        $('#cats').empty().append(list);
+    }
+
+    $('#suggestion').keyup(function() {
+        var query = $.trim($(this).val());
+
+        clearTimeout(suggest_timer);
+        if (suggest_request) {
+            suggest_request.abort();
+            suggest_request = null;
+        }
+
+        if (!query) {
+            $('#cats').html(sidebar);
+            return;
+        }
+
+        suggest_timer = setTimeout(function() {
+            var request = $.getJSON('/rango/suggest/', {suggestion: query}, function(data) {
+                // drop answers to requests that were superseded
+                if (request === suggest_request) {
+                    show_suggestions(data);
+                    suggest_request = null;
+                }
+            });
+            suggest_request = request;
+        }, 150);
     });
 });
\ No newline at end of file
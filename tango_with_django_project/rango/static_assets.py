@@ -0,0 +1,386 @@
+"""
+Static files with hashed names, compressed ahead of time.
+
+STATICFILES_STORAGE is CompressedManifestStorage. collectstatic copies
+the static files to STATIC_ROOT under names including a hash of their
+contents, e.g. js/rango-ajax.3f2a1b9c0d4e.js, points the url()s of
+stylesheets at the hashed names, and lists them in staticfiles.json.
+{% static %} then links to the hashed names. A changed file gets a new
+name, so browsers can keep a file for a year without asking whether it
+changed. Text files are also written compressed next to the original,
+as .gz and, with the brotli package installed, .br, when that's
+smaller, so they're never compressed while serving.
+
+StaticFilesMiddleware serves STATIC_ROOT in front of the WSGI
+application (see wsgi.py), without going through Django, the way
+WhiteNoise does. It picks the smallest file the client accepts, and
+answers If-None-Match with 304 Not Modified, with RANGO_STATIC:
+
+    RANGO_STATIC = {
+        'SERVE': True,
+        'MAX_AGE': 60 * 60 * 24 * 365,   # seconds hashed files are cached
+        'UNHASHED_MAX_AGE': 60,          # other files
+        'COMPRESS': ['css', 'js', 'svg', 'ico', 'txt', 'json', 'map'],
+        'MIN_SIZE': 256,                 # bytes, smaller files aren't
+    }
+
+Until collectstatic has run, e.g. in development and tests, files are
+linked under their own names, and runserver serves them itself. Once
+it has, linking a file missing from the manifest is an error, unless
+DEBUG is on.
+
+page_weight() compares what a page's static files cost before and
+after, as served by runserver and by StaticFilesMiddleware, see the
+static_weight management command.
+"""
+import gzip
+import io
+import json
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.contrib.staticfiles.views import serve
+from django.http import Http404
+from django.test import RequestFactory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STATIC_DEFAULTS = {
+    'SERVE': True,
+    'MAX_AGE': 60 * 60 * 24 * 365,
+    'UNHASHED_MAX_AGE': 60,
+    'COMPRESS': ['css', 'js', 'svg', 'ico', 'txt', 'json', 'map'],
+    'MIN_SIZE': 256,
+}
+
+# Content-Encoding and suffix of compressed copies, preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# a visitor's next visit, for page_weight()
+REPEAT_VISIT_SECONDS = 60 * 60 * 24
+
+# URLs of the scripts, stylesheets, icons and images of a page
+ASSET_RE = re.compile(
+    r'''<(?:script|link|img)\b[^>]*?\b(?:src|href)=["']([^"'#?]+)''')
+
+
+def get_static_settings():
+    """
+    Returns STATIC_DEFAULTS updated with the RANGO_STATIC setting
+    """
+    options = dict(STATIC_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_STATIC', {}))
+    return options
+
+
+def available_encodings():
+    return [(encoding, suffix) for encoding, suffix in ENCODINGS
+            if encoding != 'br' or brotli is not None]
+
+
+def compress(data, encoding):
+    """
+    [data] compressed as [encoding], the same bytes for the same data
+    """
+    if encoding == 'br':
+        return brotli.compress(data)
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def compressible(name, options):
+    extension = os.path.splitext(name)[1].lstrip('.').lower()
+    return extension in options['COMPRESS']
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage which also writes compressed copies of
+    text files, and links files under their own names until
+    collectstatic has written a manifest, or with DEBUG on
+    """
+
+    def stored_name(self, name):
+        try:
+            return super(CompressedManifestStorage, self).stored_name(name)
+        except ValueError:
+            # a file missing from a manifest is a typo, or wasn't collected
+            if self.hashed_files and not settings.DEBUG:
+                raise
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        processed = super(CompressedManifestStorage, self).post_process(
+            paths, dry_run, **options)
+        for result in processed:
+            yield result
+        if dry_run:
+            return
+
+        static_options = get_static_settings()
+        names = set(paths)
+        names.update(self.hashed_files.values())
+        for name in sorted(names):
+            if compressible(name, static_options) and self.exists(name):
+                for compressed in self.compress_file(name, static_options):
+                    yield name, compressed, True
+
+    def compress_file(self, name, options):
+        """
+        Writes the compressed copies of [name] smaller than it, returns
+        their names
+        """
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < options['MIN_SIZE']:
+            return []
+
+        written = []
+        for encoding, suffix in available_encodings():
+            compressed = compress(data, encoding)
+            if len(compressed) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written.append(name + suffix)
+        return written
+
+
+class StaticFile(object):
+    """
+    A file of STATIC_ROOT and its compressed copies, {encoding: path}
+    """
+
+    def __init__(self, path, cache_control):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.content_type = (mimetypes.guess_type(path)[0] or
+                             'application/octet-stream')
+        self.etag = '"{0:x}-{1:x}"'.format(int(stat.st_mtime), stat.st_size)
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.cache_control = cache_control
+        self.encodings = {}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                self.encodings[encoding] = path + suffix
+
+    def variant(self, accept_encoding):
+        """
+        (encoding or None, path, ETag) of the smallest variant accepted
+        """
+        accepted = {value.split(';')[0].strip().lower()
+                    for value in accept_encoding.split(',')}
+        for encoding, suffix in ENCODINGS:
+            if encoding in self.encodings and encoding in accepted:
+                etag = self.etag[:-1] + suffix.replace('.', '-') + '"'
+                return encoding, self.encodings[encoding], etag
+        return None, self.path, self.etag
+
+
+def hashed_names(root):
+    """
+    The hashed names listed in the staticfiles.json manifest of [root]
+    """
+    try:
+        with open(os.path.join(root, 'staticfiles.json')) as f:
+            return set(json.load(f).get('paths', {}).values())
+    except (IOError, ValueError):
+        return set()
+
+
+def scan(root, options):
+    """
+    {name: StaticFile} of the files under [root], compressed copies
+    being variants of their originals
+    """
+    immutable = hashed_names(root)
+    suffixes = tuple(suffix for encoding, suffix in ENCODINGS)
+    files = {}
+    for directory, dirs, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename.endswith(suffixes) and os.path.exists(
+                    os.path.splitext(path)[0]):
+                continue
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if name in immutable:
+                # never changes, browsers needn't even revalidate it
+                cache_control = 'public, max-age={0}, immutable'.format(
+                    options['MAX_AGE'])
+            else:
+                cache_control = 'public, max-age={0}'.format(
+                    options['UNHASHED_MAX_AGE'])
+            files[name] = StaticFile(path, cache_control)
+    return files
+
+
+class StaticFilesMiddleware(object):
+    """
+    WSGI middleware serving the collected static files under STATIC_URL
+    and passing everything else to [application]. STATIC_ROOT is
+    scanned once, when it's created.
+    """
+
+    def __init__(self, application, root=None, prefix=None, options=None):
+        self.application = application
+        self.options = options or get_static_settings()
+        self.root = root or settings.STATIC_ROOT
+        self.prefix = prefix or settings.STATIC_URL
+        self.files = {}
+        if self.options['SERVE'] and self.root and os.path.isdir(self.root):
+            self.files = scan(self.root, self.options)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        static_file = None
+        if path.startswith(self.prefix):
+            static_file = self.files.get(path[len(self.prefix):])
+        if static_file is None:
+            return self.application(environ, start_response)
+
+        method = environ['REQUEST_METHOD']
+        if method not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed',
+                           [('Allow', 'GET, HEAD')])
+            return []
+        return self.serve(static_file, environ, start_response)
+
+    def serve(self, static_file, environ, start_response):
+        encoding, path, etag = static_file.variant(
+            environ.get('HTTP_ACCEPT_ENCODING', ''))
+        headers = [('Cache-Control', static_file.cache_control),
+                   ('ETag', etag),
+                   ('Last-Modified', static_file.last_modified)]
+        if static_file.encodings:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if not_modified(environ, etag, static_file.last_modified):
+            start_response('304 Not Modified', headers)
+            return []
+
+        headers += [('Content-Type', static_file.content_type),
+                    ('Content-Length', str(os.path.getsize(path)))]
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(path, 'rb'))
+
+
+def not_modified(environ, etag, last_modified):
+    if 'HTTP_IF_NONE_MATCH' in environ:
+        etags = [value.strip() for value in
+                 environ['HTTP_IF_NONE_MATCH'].split(',')]
+        return etag in etags or '*' in etags
+    since = parsedate(environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and since >= parsedate(last_modified)
+
+
+def page_assets(html, prefix=None):
+    """
+    The names of the static files linked from [html], in order, and the
+    number of other files it links from other hosts
+    """
+    prefix = prefix or settings.STATIC_URL
+    names, external = [], 0
+    for url in ASSET_RE.findall(html):
+        if url.startswith(prefix):
+            name = url[len(prefix):]
+            if name not in names:
+                names.append(name)
+        elif url.startswith(('http://', 'https://', '//')):
+            external += 1
+    return names, external
+
+
+def original_name(name):
+    # js/rango-ajax.3f2a1b9c0d4e.js -> js/rango-ajax.js
+    return re.sub(r'\.[0-9a-f]{12}(\.[^./]+)$', r'\1', name)
+
+
+def max_age(cache_control):
+    """
+    Seconds a response may be reused for, by its Cache-Control header
+    """
+    match = re.search(r'max-age=(\d+)', cache_control or '')
+    return int(match.group(1)) if match else 0
+
+
+def wsgi_get(application, path, **environ):
+    """
+    (status, headers, body) of a GET of [path] from a WSGI [application]
+    """
+    environ.update({'PATH_INFO': path, 'REQUEST_METHOD': 'GET'})
+    response = {}
+
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    body = application(environ, start_response)
+    try:
+        content = b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return response['status'], response['headers'], content
+
+
+def page_weight(html, application):
+    """
+    What the static files of a page cost a visitor, served by runserver
+    under their own names (before), and by [application], a
+    StaticFilesMiddleware over the collected files, under the names
+    linked from [html] (after):
+
+        assets = static files linked from the page
+        external = files linked from other hosts, not counted
+        before_bytes, after_bytes = bytes downloaded by a first visit
+        before_repeat_requests, after_repeat_requests = requests made by
+            a visit REPEAT_VISIT_SECONDS later, for the files whose
+            Cache-Control max-age is shorter
+    """
+    names, external = page_assets(html)
+    factory = RequestFactory()
+    before = after = before_repeat = after_repeat = 0
+    for name in names:
+        original = original_name(name)
+        try:
+            response = serve(factory.get(settings.STATIC_URL + original),
+                             original, insecure=True)
+        except Http404:
+            continue
+        try:
+            before += len(b''.join(response.streaming_content))
+        finally:
+            response.close()
+        if max_age(response.get('Cache-Control')) < REPEAT_VISIT_SECONDS:
+            before_repeat += 1
+
+        status, headers, body = wsgi_get(
+            application, settings.STATIC_URL + name,
+            HTTP_ACCEPT_ENCODING='br, gzip')
+        after += len(body)
+        if max_age(headers.get('Cache-Control')) < REPEAT_VISIT_SECONDS:
+            after_repeat += 1
+    return {
+        'assets': len(names),
+        'external': external,
+        'before_bytes': before,
+        'after_bytes': after,
+        'before_repeat_requests': before_repeat,
+        'after_repeat_requests': after_repeat,
+    }
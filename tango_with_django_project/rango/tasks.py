@@ -0,0 +1,254 @@
+"""
+A task queue kept in the database, for work that shouldn't hold up a
+request: resizing pictures, flushing counters, warming search results.
+
+Functions decorated with @task get a delay() method which stores the call
+as a Task row. Arguments must be JSON serializable, and the function
+importable by its dotted path, which is how the worker finds it. As the
+row is written in the caller's transaction, a task is only seen by the
+worker once that transaction commits.
+
+    @task(max_attempts=5)
+    def resize(profile_id):
+        ...
+
+    resize.delay(profile.pk)
+
+The run_tasks management command is the worker. It claims due tasks and
+runs them on a pool of processes. A failed task is retried after BACKOFF
+seconds, doubled after every attempt, until it has been tried
+max_attempts times. A task whose worker died is retried once its
+LEASE has expired. No broker is needed, only the database.
+
+    RANGO_TASKS = {
+        'EAGER': False,          # run tasks inside delay(), for tests
+        'WORKERS': 2,            # processes running tasks
+        'MAX_ATTEMPTS': 3,
+        'BACKOFF': 10,           # seconds before the first retry
+        'LEASE': 300,            # seconds a task may run before it's retried
+        'POLL_INTERVAL': 1.0,    # seconds between looks at an empty queue
+        'KEEP_DONE': 60 * 60 * 24,   # seconds finished tasks are kept
+        'PERIODIC': {},          # dotted task path: seconds between runs
+    }
+
+The staff-only task_status and task_queue views report on the queue.
+"""
+import datetime
+import json
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+
+logger = logging.getLogger(__name__)
+
+TASK_DEFAULTS = {
+    'EAGER': False,
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF': 10,
+    'LEASE': 300,
+    'POLL_INTERVAL': 1.0,
+    'KEEP_DONE': 60 * 60 * 24,
+    'PERIODIC': {},
+}
+
+
+def get_task_settings():
+    """
+    Returns TASK_DEFAULTS updated with the RANGO_TASKS setting
+    """
+    options = dict(TASK_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_TASKS', {}))
+    return options
+
+
+def task(max_attempts=None):
+    """
+    Decorator adding delay(*args), which queues a call of the function
+    and returns its Task. [max_attempts] defaults to MAX_ATTEMPTS.
+    """
+    def decorator(function):
+        name = '{0}.{1}'.format(function.__module__, function.__name__)
+
+        def delay(*args):
+            return enqueue(name, args, max_attempts)
+
+        function.task_name = name
+        function.delay = delay
+        return function
+    return decorator
+
+
+def enqueue(name, args=(), max_attempts=None, run_at=None):
+    """
+    Queues a call of the function at dotted path [name] with [args]
+    """
+    options = get_task_settings()
+    queued = Task.objects.create(
+        name=name, arguments=json.dumps(list(args)),
+        max_attempts=max_attempts or options['MAX_ATTEMPTS'],
+        run_at=run_at or timezone.now())
+
+    if options['EAGER'] and _claim(queued.pk, timezone.now(), options):
+        execute(queued.pk)
+        queued.refresh_from_db()
+    return queued
+
+
+def _claim(pk, now, options):
+    # the row only changes for one of the workers racing for it
+    return Task.objects.filter(
+        pk=pk, status__in=[Task.QUEUED, Task.RUNNING], run_at__lte=now,
+    ).update(status=Task.RUNNING, attempts=F('attempts') + 1, modified=now,
+             run_at=now + datetime.timedelta(seconds=options['LEASE']))
+
+
+def claim(limit):
+    """
+    Marks up to [limit] due tasks as running and returns their ids.
+    Running tasks whose lease expired are due again.
+    """
+    options = get_task_settings()
+    now = timezone.now()
+    due = (Task.objects.filter(status__in=[Task.QUEUED, Task.RUNNING],
+                               run_at__lte=now)
+           .order_by('run_at').values_list('pk', flat=True)[:limit * 2])
+
+    claimed = []
+    for pk in due:
+        if _claim(pk, now, options):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def execute(pk):
+    """
+    Runs the claimed task [pk] and records how it went.
+    Returns its new status.
+    """
+    close_old_connections()
+    current = Task.objects.get(pk=pk)
+    # another worker claims the task again if this one outlives its lease,
+    # only the latest attempt may record its outcome
+    attempt = Task.objects.filter(pk=pk, attempts=current.attempts)
+
+    if current.attempts > current.max_attempts:
+        _record(attempt, status=Task.FAILED,
+                error='Lease expired on the last attempt')
+        return Task.FAILED
+
+    try:
+        function = import_string(current.name)
+        result = function(*json.loads(current.arguments))
+    except Exception:
+        logger.exception('Task %s failed', current)
+        error = traceback.format_exc()
+        if current.attempts < current.max_attempts:
+            backoff = datetime.timedelta(seconds=get_task_settings()[
+                'BACKOFF'] * 2 ** (current.attempts - 1))
+            _record(attempt, status=Task.QUEUED, error=error,
+                    run_at=timezone.now() + backoff)
+            return Task.QUEUED
+        _record(attempt, status=Task.FAILED, error=error)
+        return Task.FAILED
+
+    _record(attempt, status=Task.DONE, result=json.dumps(result, default=str))
+    return Task.DONE
+
+
+def _record(attempt, **values):
+    # update() skips auto_now
+    attempt.update(modified=timezone.now(), **values)
+
+
+def run_pending(limit=100):
+    """
+    Runs due tasks in this process, up to [limit].
+    Returns the number of tasks run.
+    """
+    count = 0
+    while count < limit:
+        claimed = claim(min(10, limit - count))
+        if not claimed:
+            break
+        for pk in claimed:
+            execute(pk)
+        count += len(claimed)
+    return count
+
+
+def enqueue_periodic(last_runs, now=None):
+    """
+    Queues the PERIODIC tasks whose interval has passed since the time
+    recorded for them in [last_runs], unless one is already waiting.
+    Updates [last_runs].
+    """
+    if now is None:
+        now = timezone.now()
+    for name, seconds in get_task_settings()['PERIODIC'].items():
+        last = last_runs.get(name)
+        if last is not None and (now - last).total_seconds() < seconds:
+            continue
+        last_runs[name] = now
+        if not Task.objects.filter(
+                name=name, status__in=[Task.QUEUED, Task.RUNNING]).exists():
+            enqueue(name)
+
+
+def purge_done(now=None):
+    """
+    Deletes tasks that finished over KEEP_DONE seconds ago.
+    Failed tasks are kept for inspection.
+    """
+    if now is None:
+        now = timezone.now()
+    cutoff = now - datetime.timedelta(seconds=get_task_settings()['KEEP_DONE'])
+    deleted, _ = Task.objects.filter(status=Task.DONE,
+                                     modified__lt=cutoff).delete()
+    return deleted
+
+
+def describe(queued):
+    """
+    Dictionary of the Task [queued] for the status API
+    """
+    return {
+        'id': queued.pk,
+        'name': queued.name,
+        'status': queued.status,
+        'attempts': queued.attempts,
+        'max_attempts': queued.max_attempts,
+        'run_at': queued.run_at.isoformat(),
+        'result': json.loads(queued.result) if queued.result else None,
+        'error': queued.error or None,
+        'created': queued.created.isoformat(),
+        'modified': queued.modified.isoformat(),
+    }
+
+
+def queue_stats():
+    """
+    Number of tasks per status, and the age in seconds of the oldest
+    task waiting to run
+    """
+    counts = dict(Task.objects.order_by().values_list('status')
+                  .annotate(Count('pk')))
+    oldest = (Task.objects.filter(status=Task.QUEUED,
+                                  run_at__lte=timezone.now())
+              .aggregate(oldest=Min('run_at'))['oldest'])
+    return {
+        'counts': {status: counts.get(status, 0)
+                   for status, label in Task.STATUSES},
+        'oldest_due_seconds': ((timezone.now() - oldest).total_seconds()
+                               if oldest else 0),
+    }
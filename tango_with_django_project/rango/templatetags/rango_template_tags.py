@@ -1,11 +1,13 @@
 from django import template
-from rango.models import Category
+from django.utils.safestring import mark_safe
+
+from rango.sidebar import render_sidebar
 
 register = template.Library()
 
-@register.inclusion_tag('rango/cats.html')
+@register.simple_tag
 def get_category_list(cat=None):
-    return {
-        'cats': Category.objects.order_by('-likes'),
-        'act_cat': cat,
-    }
\ No newline at end of file
+    """
+    Renders the category sidebar, served from cache (see rango.sidebar)
+    """
+    return mark_safe(render_sidebar(cat))
\ No newline at end of file
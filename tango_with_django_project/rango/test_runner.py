@@ -0,0 +1,47 @@
+"""
+The test runner of Rango, see TEST_RUNNER in settings.py.
+
+Tests clear and fill the cache, which would otherwise be the running
+site's (CACHES is shared between processes). RangoTestRunner gives every
+run a file based cache of its own in a temporary directory, also used by
+the manage.py commands tests start, and removes it afterwards.
+"""
+import os
+import shutil
+import tempfile
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+TEST_CACHE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+
+
+class RangoTestRunner(DiscoverRunner):
+    """
+    DiscoverRunner running the tests against a cache of their own
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(RangoTestRunner, self).setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix='rango-test-cache-')
+        # read by the settings of the processes tests start
+        self.environ = {'RANGO_CACHE_BACKEND': TEST_CACHE_BACKEND,
+                        'RANGO_CACHE_LOCATION': self.cache_dir}
+        self.saved_environ = {name: os.environ.get(name)
+                              for name in self.environ}
+        os.environ.update(self.environ)
+        self.test_caches = override_settings(CACHES={
+            'default': {'BACKEND': TEST_CACHE_BACKEND,
+                        'LOCATION': self.cache_dir}})
+        self.test_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_caches.disable()
+        for name, value in self.saved_environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super(RangoTestRunner, self).teardown_test_environment(**kwargs)
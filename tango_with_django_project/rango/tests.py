@@ -1,7 +1,70 @@
-from django.test import TestCase
+import datetime
+import gzip
+import http.server
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socketserver
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import (Client, TestCase, SimpleTestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.core.urlresolvers import reverse
+from django.utils import timezone
+from PIL import Image
 
-from .models import Category
+from . import autocomplete, keyset, local_search
+from .aggregates import reconcile
+from .autocomplete import PrefixIndex, Suggestion
+from .counters import (CacheCounterStore, CounterBuffer, MemoryCounterStore,
+                       get_counter_buffer)
+from .database import (begin_statement, get_sqlite_settings,
+                       journal_mode_statement, pragma_statements)
+from .benchmark import (ROUTES, BenchmarkError, compare_reports,
+                        run_benchmark, seed_dataset)
+from .category_pages import category_pages
+from .category_search import exclude_known
+from .exporter import encode_rows, export_rows, gzip_stream
+from .importer import InvalidRowError, import_rows, read_rows
+from .instrumentation import metrics as request_metrics
+from .models import (ActivityBucket, Category, Page, Task, Trending,
+                     UserProfile)
+from .page_cache import content_changed, content_stamp, page_cache_stats
+from .ratelimit import (CacheBucketStore, MemoryBucketStore,
+                        get_rate_limiter)
+from .replicas import PIN_KEY, ReplicaRouter, start_request
+from .static_assets import StaticFilesMiddleware, page_weight
+from .trending import compute_trending, current_bucket, ranking
+from .tasks import (claim, enqueue_periodic, execute, purge_done, run_pending,
+                    task)
+from .visits import parse_visit_time
+from .search_backends import (BaseSearchBackend, CircuitBreaker,
+                              CircuitOpenError, LocalResultCache, SearchError,
+                              SearchService, SearchTimeout, get_search_service,
+                              reset_search_service)
+from .webhose_search import merge_results, run_queries, run_query
+from .write_benchmark import Targets, write_loop
 
 def add_cat(name, views, likes):
     c = Category.objects.get_or_create(name=name)[0]
@@ -39,6 +102,9 @@ class IndexViewTests(TestCase):
     """
     Tests for Index View
     """
+    def setUp(self):
+        cache.clear()
+
     def test_index_view_with_no_categories(self):
         """
         If no categories exxist, an appropriate
@@ -61,3 +127,2369 @@ class IndexViewTests(TestCase):
 
         num_cats = len(response.context['categories'])
         self.assertEqual(num_cats, 4)
+
+
+
+class StubWebhoseHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers every GET like the Webhose search API would.
+    Keeps connections alive so connection reuse can be observed.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(StubWebhoseHandler, self).setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        size = int(query['size'][0])
+        posts = [{'title': '{0} {1}'.format(query['q'][0], i),
+                  'url': 'http://example.com/{0}'.format(i),
+                  'text': 'summary ' * 50}
+                 for i in range(size)]
+        body = json.dumps({'posts': posts}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if not self.server.keep_alive:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if not self.server.dribble:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), 256):
+            self.wfile.write(body[start:start + 256])
+            self.wfile.flush()
+            time.sleep(self.server.dribble)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubWebhoseServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0, dribble=0, keep_alive=True):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                        StubWebhoseHandler)
+        self.delay = delay
+        # seconds between 256 byte pieces of the body, 0 sends it at once
+        self.dribble = dribble
+        self.keep_alive = keep_alive
+        self.requests = 0
+        self.connections = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/search'.format(self.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def stub_search_settings(server, **options):
+    """
+    RANGO_SEARCH pointing at a StubWebhoseServer
+    """
+    search_settings = {'ROOT_URL': server.url, 'API_KEY': 'test-key'}
+    search_settings.update(options)
+    return override_settings(RANGO_SEARCH=search_settings)
+
+
+class SearchBackendTests(SimpleTestCase):
+    """
+    Tests for the pooled, cached search backend behind run_query
+    """
+
+    def test_results_are_parsed(self):
+        with StubWebhoseServer() as server, stub_search_settings(server):
+            results = run_query('python', size=3)
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['title'], 'python 0')
+        self.assertEqual(results[0]['link'], 'http://example.com/0')
+        self.assertEqual(len(results[0]['summary']), 200)
+
+    def test_repeated_query_is_served_from_cache(self):
+        """
+        Queries that only differ in case and whitespace share a cache entry
+        """
+        with StubWebhoseServer() as server, stub_search_settings(server):
+            run_query('Python')
+            run_query('  python ')
+            self.assertEqual(server.requests, 1)
+
+            # a different size is a different query
+            run_query('python', size=5)
+            self.assertEqual(server.requests, 2)
+
+    def test_connections_are_kept_alive(self):
+        with StubWebhoseServer() as server, stub_search_settings(server):
+            for query in ('django', 'flask', 'bottle'):
+                run_query(query)
+
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(server.connections, 1)
+
+    def test_closed_connections_are_replaced(self):
+        with StubWebhoseServer(keep_alive=False) as server, \
+                stub_search_settings(server, CACHE=None):
+            for query in ('django', 'flask'):
+                self.assertEqual(len(run_query(query, size=3)), 3)
+
+        self.assertEqual(server.connections, 2)
+
+    def test_django_cache_mode(self):
+        with StubWebhoseServer() as server, \
+                stub_search_settings(server, CACHE='django'):
+            run_query('perl')
+            # a fresh service (e.g. another process) still hits the cache
+            reset_search_service()
+            run_query('PERL')
+            self.assertEqual(server.requests, 1)
+
+    def test_timeout_budget(self):
+        """
+        A slow upstream costs at most TIMEOUT and yields no results
+        """
+        with StubWebhoseServer(delay=1) as server, \
+                stub_search_settings(server, TIMEOUT=0.2):
+            start = time.monotonic()
+            self.assertEqual(run_query('slow'), [])
+            self.assertLess(time.monotonic() - start, 0.9)
+
+            with self.assertRaises(SearchTimeout):
+                get_search_service().backend.search('slow')
+
+    def test_timeout_budget_covers_a_slow_body(self):
+        """
+        A body sent a little at a time can't keep the query past TIMEOUT
+        """
+        with StubWebhoseServer(dribble=0.05) as server, \
+                stub_search_settings(server, TIMEOUT=0.3, CACHE=None):
+            backend = get_search_service().backend
+            start = time.monotonic()
+            with self.assertRaises(SearchTimeout):
+                backend.search('slow')
+            self.assertLess(time.monotonic() - start, 0.5)
+
+
+class SearchFanOutTests(SimpleTestCase):
+    """
+    Tests for running several queries at once with run_queries
+    """
+
+    def test_queries_run_concurrently(self):
+        with StubWebhoseServer(delay=0.3) as server, \
+                stub_search_settings(server, CACHE=None):
+            start = time.monotonic()
+            results = run_queries(['a', 'b', 'c', 'A ', 'd'], size=3)
+            elapsed = time.monotonic() - start
+            # 'A ' is the same query as 'a'
+            self.assertEqual(server.requests, 4)
+
+        self.assertLess(elapsed, 0.6)
+        # every query returns the same links
+        self.assertEqual([r['title'] for r in results], ['a 0', 'a 1', 'a 2'])
+
+    def test_slow_queries_are_left_out(self):
+        with StubWebhoseServer(delay=1) as server, \
+                stub_search_settings(server, CACHE=None):
+            self.assertIsNone(run_queries(['a', 'b'], timeout=0.1))
+
+    def test_merge_interleaves_and_dedupes(self):
+        first = [{'link': 'http://Example.com/a/'}, {'link': 'http://b.com'}]
+        second = [{'link': 'http://c.com'}, {'link': 'http://example.com/a'},
+                  {'link': 'http://d.com#top'}]
+        third = [{'link': 'http://d.com'}]
+        merged = merge_results([first, second, third])
+        self.assertEqual([r['link'] for r in merged], [
+            'http://Example.com/a/', 'http://c.com', 'http://d.com',
+            'http://b.com'])
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FlakyBackend(BaseSearchBackend):
+    """
+    Fails while [failing] is set, counts its calls
+    """
+
+    def __init__(self, options=None):
+        super(FlakyBackend, self).__init__(options)
+        self.calls = 0
+        self.failing = False
+
+    def search(self, search_terms, size=10):
+        self.calls += 1
+        if self.failing:
+            raise SearchError('down')
+        return [{'title': '{0} {1}'.format(search_terms, self.calls),
+                 'link': 'http://example.com/', 'summary': ''}]
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """
+    Tests for the circuit breaker and stale results of SearchService
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=30,
+                                      clock=self.clock)
+        self.backend = FlakyBackend()
+
+    def search(self):
+        return self.breaker.call(self.backend.search, 'python')
+
+    def test_opens_after_threshold_and_probes(self):
+        self.backend.failing = True
+        for attempt in range(2):
+            with self.assertRaises(SearchError):
+                self.search()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            self.search()
+        self.assertEqual(self.backend.calls, 2)
+
+        # a failed probe opens it again
+        self.clock.now = 31
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(SearchError):
+            self.search()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.clock.now = 62
+        self.backend.failing = False
+        self.search()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.stats['opened'], 2)
+        self.assertEqual(self.breaker.stats['rejected'], 1)
+
+    def test_probe_slot_is_released_on_any_error(self):
+        self.breaker.opened_at = 0
+        self.clock.now = 31
+
+        def missing_key(search_terms):
+            raise KeyError('Webhose API key not found')
+
+        with self.assertRaises(KeyError):
+            self.breaker.call(missing_key, 'python')
+        self.assertEqual(self.breaker.probing, 0)
+        self.assertTrue(self.breaker.allows())
+        self.search()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_successes_reset_the_failure_count(self):
+        self.backend.failing = True
+        with self.assertRaises(SearchError):
+            self.search()
+        self.backend.failing = False
+        self.search()
+        self.backend.failing = True
+        with self.assertRaises(SearchError):
+            self.search()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_stale_results_are_served_while_refreshing(self):
+        service = SearchService(self.backend, LocalResultCache(), self.breaker,
+                                fresh_ttl=60)
+        self.assertEqual(service.search('python')[0]['title'], 'python 1')
+        self.assertEqual(service.search('python')[0]['title'], 'python 1')
+        self.assertEqual(self.backend.calls, 1)
+
+        # stale, answered at once and refreshed in the background
+        service.fresh_ttl = 0
+        self.assertEqual(service.search('python')[0]['title'], 'python 1')
+        deadline = time.monotonic() + 2
+        while service._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        service.fresh_ttl = 60
+        self.assertEqual(service.search('python')[0]['title'], 'python 2')
+
+        # not refreshed while the breaker is open
+        service.fresh_ttl = 0
+        self.breaker.opened_at = self.clock.now
+        self.assertEqual(service.search('python')[0]['title'], 'python 2')
+        self.assertEqual(self.backend.calls, 2)
+
+        metrics = service.metrics()
+        self.assertEqual(metrics['search_fresh_hits_total'], 2)
+        self.assertEqual(metrics['search_stale_hits_total'], 2)
+        self.assertEqual(metrics['search_breaker_open'], 1)
+
+    def test_failing_upstream_costs_milliseconds(self):
+        with StubWebhoseServer(delay=1) as server, \
+                stub_search_settings(server, TIMEOUT=0.2, CACHE=None,
+                                     BREAKER_THRESHOLD=2):
+            with self.assertLogs('rango.webhose_search', 'WARNING'):
+                run_query('a')
+                run_query('b')
+                start = time.monotonic()
+                self.assertEqual(run_query('c'), [])
+            self.assertLess(time.monotonic() - start, 0.05)
+            self.assertEqual(server.requests, 2)
+
+
+class LocalResultCacheTests(SimpleTestCase):
+    """
+    Tests for the in-process TTL + LRU result cache
+    """
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LocalResultCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_entries_expire(self):
+        cache = LocalResultCache(max_size=2, ttl=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class CategorySearchTests(TestCase):
+    """
+    Tests for loading category search results outside the page request
+    """
+
+    def setUp(self):
+        self.category = add_cat('python', 1, 1)
+        self.user = User.objects.create_user('rango', password='tango-pass')
+        UserProfile.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def test_category_page_does_not_wait_for_search(self):
+        with StubWebhoseServer(delay=1) as server, \
+                stub_search_settings(server, CACHE=None):
+            start = time.monotonic()
+            response = self.client.get(
+                reverse('rango:show_category', args=['python']))
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertEqual(server.requests, 0)
+
+        self.assertContains(response, reverse(
+            'rango:category_search_results', args=['python']))
+
+    def test_results_fragment(self):
+        url = reverse('rango:category_search_results', args=['python'])
+        with StubWebhoseServer() as server, stub_search_settings(server):
+            response = self.client.get(url)
+            self.assertContains(response, 'python 0')
+            self.assertContains(response, 'data-catid="{0}"'.format(
+                self.category.id))
+
+            response = self.client.get(url, {'query': 'django'})
+            self.assertContains(response, 'django 0')
+
+    def test_related_queries_skip_known_pages(self):
+        for i in range(4):
+            Page.objects.create(category=self.category, views=i,
+                                title='page {0}'.format(i),
+                                url='http://example.com/{0}'.format(i))
+        url = reverse('rango:category_search_results', args=['python'])
+        with StubWebhoseServer() as server, \
+                stub_search_settings(server, CACHE=None, RELATED_QUERIES=2):
+            response = self.client.get(url)
+            self.assertEqual(server.requests, 3)
+
+        # the stub answers every query with the same links, only the
+        # first query's are kept, minus the four saved as pages
+        titles = [r['title'] for r in response.context['results_list']]
+        self.assertEqual(titles, ['python {0}'.format(i)
+                                  for i in range(4, 10)])
+
+    def test_known_pages_are_recognised_when_spelled_differently(self):
+        Page.objects.create(category=self.category, title='zero',
+                            url='HTTP://Example.com/0/')
+        Page.objects.create(category=self.category, title='one',
+                            url='http://example.com/1#top')
+        results = [{'link': 'http://example.com/0'},
+                   {'link': 'http://EXAMPLE.com/1/'},
+                   {'link': 'http://example.com/2'}]
+        self.assertEqual(exclude_known(self.category, results),
+                         [{'link': 'http://example.com/2'}])
+
+    def test_results_fragment_deadline(self):
+        """
+        A slow search provider is cut off at DEADLINE
+        """
+        url = reverse('rango:category_search_results', args=['python'])
+        with StubWebhoseServer(delay=1) as server, \
+                stub_search_settings(server, DEADLINE=0.1):
+            start = time.monotonic()
+            response = self.client.get(url)
+            self.assertLess(time.monotonic() - start, 0.5)
+
+        self.assertContains(response, 'taking too long')
+
+
+class CounterStoreLoadTests(SimpleTestCase):
+    """
+    N concurrent clients increment the same counters while another thread
+    keeps draining them. Every increment must be accounted for.
+    """
+    clients = 16
+    increments = 500
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_no_lost_increments(self, store):
+        keys = [('rango.Page', 'views', pk) for pk in range(1, 5)]
+        barrier = threading.Barrier(self.clients)
+        finished = threading.Event()
+        drained = []
+
+        def client(number):
+            barrier.wait()
+            for i in range(self.increments):
+                store.add(keys[(number + i) % len(keys)], 1)
+
+        def drainer():
+            while not finished.is_set():
+                drained.append(store.drain())
+                time.sleep(0.001)
+
+        flusher = threading.Thread(target=drainer)
+        flusher.start()
+        threads = [threading.Thread(target=client, args=(number,))
+                   for number in range(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        finished.set()
+        flusher.join()
+        drained.append(store.drain())
+
+        total = sum(sum(deltas.values()) for deltas in drained)
+        self.assertEqual(total, self.clients * self.increments)
+        for key in keys:
+            self.assertEqual(store.pending(key), 0)
+
+    def test_memory_store(self):
+        self.assert_no_lost_increments(MemoryCounterStore())
+
+    # counting exactly needs an atomic incr, which the file based cache
+    # of the default settings doesn't have
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cache_store(self):
+        self.assert_no_lost_increments(CacheCounterStore())
+
+    def test_evicted_sequence_is_drained_again(self):
+        store = CacheCounterStore()
+        key = ('rango.Page', 'views', 1)
+        for i in range(3):
+            store.add(key, 1)
+            self.assertEqual(store.drain(), {key: 1})
+        cache.delete('rango:counter:seq')
+        store.add(key, 2)
+        self.assertEqual(store.drain(), {key: 2})
+
+    def test_lost_journal_entry_is_journalled_again(self):
+        store = CacheCounterStore(dirty_timeout=1)
+        key = ('rango.Page', 'views', 1)
+        store.add(key, 2)
+        # the writer died before storing its entry: drain waits for it
+        # once, then gives up on it
+        cache.delete('rango:counter:journal:1')
+        self.assertEqual(store.drain(), {})
+        self.assertEqual(store.drain(), {})
+
+        time.sleep(1.1)
+        store.add(key, 3)
+        self.assertEqual(store.drain(), {key: 5})
+        self.assertEqual(store.pending(key), 0)
+
+
+class CounterBufferTests(TestCase):
+    """
+    Tests for flushing buffered counters to the database
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.category = add_cat('python', 0, 3)
+        self.pages = [Page.objects.create(category=self.category,
+                                          title=str(i), url='http://a.com')
+                      for i in range(3)]
+
+    def test_flush_batches_updates(self):
+        buffer = CounterBuffer(MemoryCounterStore(), flush_interval=60)
+        for page in self.pages:
+            buffer.incr(Page, page.pk, 'views')
+        buffer.incr(Category, self.category.pk, 'likes', 2)
+
+        # nothing is written before the flush
+        self.assertEqual(Page.objects.get(pk=self.pages[0].pk).views, 0)
+        self.assertEqual(buffer.pending(Page, self.pages[0].pk, 'views'), 1)
+
+        # one UPDATE per model and amount, inside a transaction, then the
+        # views are added to the category's total (6 queries) and the
+        # trending buckets of the pages, category views and likes (4 each)
+        with self.assertNumQueries(18):
+            self.assertEqual(buffer.flush(), 4)
+
+        self.assertEqual([p.views for p in Page.objects.order_by('pk')],
+                         [1, 1, 1])
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.likes, 5)
+        self.assertEqual(self.category.total_page_views, 3)
+        self.assertEqual(buffer.pending(Page, self.pages[0].pk, 'views'), 0)
+
+    def test_zero_interval_writes_through(self):
+        buffer = CounterBuffer(MemoryCounterStore(), flush_interval=0)
+        buffer.incr(Page, self.pages[0].pk, 'views')
+        self.assertEqual(Page.objects.get(pk=self.pages[0].pk).views, 1)
+
+    @override_settings(RANGO_COUNTERS={'STORE': 'cache',
+                                       'FLUSH_INTERVAL': 60})
+    def test_track_url_and_flush_command(self):
+        for i in range(3):
+            response = self.client.get(reverse('rango:goto'),
+                                       {'page_id': self.pages[0].pk})
+            self.assertRedirects(response, 'http://a.com',
+                                 fetch_redirect_response=False)
+
+        self.assertEqual(Page.objects.get(pk=self.pages[0].pk).views, 0)
+        call_command('flush_counters', stdout=io.StringIO(),
+                     stderr=io.StringIO())
+        self.assertEqual(Page.objects.get(pk=self.pages[0].pk).views, 3)
+
+    @override_settings(RANGO_COUNTERS={'FLUSH_INTERVAL': 60})
+    def test_like_category_counts_pending_likes(self):
+        user = User.objects.create_user('rango', password='tango-pass')
+        self.client.force_login(user)
+
+        for likes in (4, 5):
+            response = self.client.get(reverse('rango:like_category'),
+                                       {'cat_id': self.category.pk})
+            self.assertEqual(response.content.decode(), str(likes))
+
+        get_counter_buffer().flush()
+        self.assertEqual(Category.objects.get(pk=self.category.pk).likes, 5)
+
+    @override_settings(RANGO_COUNTERS={'FLUSH_INTERVAL': 60})
+    def test_like_unknown_category(self):
+        user = User.objects.create_user('rango', password='tango-pass')
+        self.client.force_login(user)
+
+        for cat_id in ('nope', self.category.pk + 100):
+            response = self.client.get(reverse('rango:like_category'),
+                                       {'cat_id': cat_id})
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(get_counter_buffer().store.drain(), {})
+
+
+@override_settings(RANGO_SIDEBAR={'TOP': 3, 'PAGE_SIZE': 2})
+class SidebarTests(TestCase):
+    """
+    Tests for the cached get_category_list sidebar
+    """
+
+    def setUp(self):
+        cache.clear()
+        for likes, name in enumerate(['perl', 'php', 'django', 'python']):
+            add_cat(name, 0, likes)
+
+    def render(self, cat=None):
+        template = Template('{% load rango_template_tags %}'
+                            '{% get_category_list cat %}')
+        return template.render(Context({'cat': cat}))
+
+    def test_sidebar_is_capped_and_cached(self):
+        with self.assertNumQueries(1):
+            html = self.render()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), html)
+
+        self.assertIn('python', html)
+        self.assertNotIn('perl', html)
+        self.assertIn(reverse('rango:category_list'), html)
+
+    def test_active_category_is_highlighted(self):
+        python = Category.objects.get(name='python')
+        self.assertIn('<strong>', self.render(python))
+        self.assertNotIn('<strong>', self.render())
+
+    def test_saving_a_category_invalidates_sidebar(self):
+        self.render()
+        add_cat('haskell', 0, 100)
+        self.assertIn('haskell', self.render())
+
+    def test_flushed_likes_invalidate_sidebar(self):
+        self.render()
+        perl = Category.objects.get(name='perl')
+        buffer = CounterBuffer(MemoryCounterStore(), flush_interval=60)
+        buffer.incr(Category, perl.pk, 'likes', 10)
+        buffer.flush()
+        self.assertIn('perl', self.render())
+
+    def test_full_list_is_paginated(self):
+        response = self.client.get(reverse('rango:category_list'),
+                                   {'page': 2})
+        self.assertEqual(len(response.context['categories']), 2)
+        self.assertContains(response, 'Page 2 of 2')
+        self.assertEqual(response.context['categories'][0].name, 'php')
+
+
+class AutocompleteTests(TestCase):
+    """
+    Tests for the prefix index behind suggest_category
+    """
+
+    def setUp(self):
+        cache.clear()
+        add_cat('Python', 0, 5)
+        add_cat('PyPy', 10, 5)
+        add_cat('Pyramid', 0, 50)
+        add_cat('Perl', 0, 100)
+
+    def suggest(self, query):
+        response = self.client.get(reverse('rango:suggest_category'),
+                                   {'suggestion': query})
+        return [cat['name'] for cat in response.json()['categories']]
+
+    def test_matches_are_case_insensitive_and_ranked(self):
+        self.assertEqual(self.suggest('py'), ['Pyramid', 'PyPy', 'Python'])
+        self.assertEqual(self.suggest('PYT'), ['Python'])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_warm_index_runs_no_queries(self):
+        self.suggest('p')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.suggest('p')), 4)
+
+    def test_index_follows_category_changes(self):
+        self.suggest('p')
+        add_cat('Pylons', 0, 1000)
+        self.assertEqual(self.suggest('py')[0], 'Pylons')
+
+        Category.objects.get(name='Pylons').delete()
+        Category.objects.get(name='Pyramid').delete()
+        self.assertEqual(self.suggest('py'), ['PyPy', 'Python'])
+
+        python = Category.objects.get(name='Python')
+        buffer = CounterBuffer(MemoryCounterStore(), flush_interval=60)
+        buffer.incr(Category, python.pk, 'likes', 1)
+        buffer.flush()
+        self.assertEqual(self.suggest('py'), ['Python', 'PyPy'])
+
+    def test_other_processes_changes_are_noticed(self):
+        self.suggest('p')
+        # a category saved elsewhere only bumps the cached generation
+        Category.objects.filter(name='Perl').update(name='Pascal')
+        cache.incr('rango:autocomplete:generation')
+        self.assertIn('Pascal', self.suggest('pa'))
+
+    def test_other_processes_likes_are_refreshed(self):
+        self.suggest('p')
+        # likes flushed elsewhere don't bump the generation
+        Category.objects.filter(name='Python').update(likes=500)
+        self.assertEqual(self.suggest('py')[0], 'Pyramid')
+
+        # built here, the test's data isn't visible to other connections
+        fresh = autocomplete.load_prefix_index()
+        perl = Category.objects.get(name='Perl')
+
+        def load_while_deleting():
+            # deleted while the new index is built
+            autocomplete.category_deleted(perl)
+            return fresh
+
+        later = time.monotonic() + autocomplete.REFRESH_SECONDS
+        with mock.patch('rango.autocomplete.time.monotonic',
+                        return_value=later), \
+                mock.patch('rango.autocomplete.load_prefix_index',
+                           side_effect=load_while_deleting) as load:
+            # the old index answers while the new one is built
+            self.assertEqual(self.suggest('py')[0], 'Pyramid')
+            # time.monotonic is frozen, count the waits instead
+            for attempt in range(200):
+                if not autocomplete._refreshing:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(self.suggest('py')[0], 'Python')
+            self.assertEqual(self.suggest('pe'), [])
+            self.assertEqual(load.call_count, 1)
+
+
+class PrefixIndexPerformanceTests(SimpleTestCase):
+    """
+    Lookups stay well under a millisecond with 100k categories
+    """
+
+    def test_lookups_at_100k_categories(self):
+        rng = random.Random(42)
+        names = set()
+        while len(names) < 100000:
+            names.add(''.join(rng.choice(string.ascii_lowercase)
+                              for i in range(rng.randint(4, 12))))
+        index = PrefixIndex(
+            Suggestion(i, name, name, rng.randint(0, 1000), 0)
+            for i, name in enumerate(names))
+
+        prefixes = [name[:rng.randint(1, 4)] for name in list(names)[:2000]]
+        start = time.perf_counter()
+        for prefix in prefixes:
+            self.assertTrue(index.search(prefix))
+        average = (time.perf_counter() - start) / len(prefixes)
+        self.assertLess(average, 0.001)
+
+
+class PageCacheTests(TestCase):
+    """
+    Tests for caching and conditional GET of anonymous public pages
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.category = add_cat('python', 0, 1)
+        Page.objects.create(category=self.category, title='Docs',
+                            url='http://docs.python.org')
+        self.url = reverse('rango:show_category', args=['python'])
+
+    def test_anonymous_responses_are_cached(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+
+        stats = page_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_other_processes_invalidate_pages(self):
+        first = self.client.get(self.url)
+        # e.g. the task worker flushing counters
+        subprocess.check_call(
+            [sys.executable, 'manage.py', 'shell', '-c',
+             'from rango.page_cache import content_changed; '
+             'content_changed()'],
+            cwd=settings.BASE_DIR)
+        second = self.client.get(self.url)
+        self.assertEqual(second['X-Cache'], 'MISS')
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(response['Last-Modified'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_invalidate_cached_responses(self):
+        etag = self.client.get(self.url)['ETag']
+        Page.objects.create(category=self.category, title='Tutorial',
+                            url='http://tutorial.python.org')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Tutorial')
+
+    def test_flushed_counters_are_shown_within_their_max_age(self):
+        now = time.time()
+        now -= now % 60
+        with mock.patch('rango.page_cache.time.time', return_value=now):
+            self.client.get(self.url)
+            page = Page.objects.get(title='Docs')
+            buffer = CounterBuffer(MemoryCounterStore(), flush_interval=60)
+            buffer.incr(Page, page.pk, 'views', 7)
+            buffer.flush()
+
+            # flushes don't invalidate every cached page
+            response = self.client.get(self.url)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertNotContains(response, 'views: 7')
+
+        with mock.patch('rango.page_cache.time.time', return_value=now + 60):
+            self.assertContains(self.client.get(self.url), 'views: 7')
+
+    def test_authenticated_users_are_not_cached(self):
+        user = User.objects.create_user('rango', password='tango-pass')
+        UserProfile.objects.create(user=user)
+        self.client.force_login(user)
+
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_varied_pages_are_revalidated_by_etag_only(self):
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = self.client.get(
+            reverse('index'),
+            HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2050 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_varies_on_visits(self):
+        self.client.get(reverse('index'))
+        session = self.client.session
+        session['visits'] = 5
+        session['last_visit'] = str(datetime.datetime.now() -
+                                    datetime.timedelta(days=2))
+        session.save()
+        self.assertEqual(self.client.get(reverse('index'))['X-Cache'], 'MISS')
+
+
+class VisitTrackingTests(TestCase):
+    """
+    The session is written about once per user per day
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def count_session_writes(self, days, requests_per_day):
+        """
+        Returns the number of responses that saved the session, which
+        SessionMiddleware signals by setting the session cookie.
+        """
+        start = datetime.datetime(2017, 9, 22, 8, tzinfo=datetime.timezone.utc)
+        writes = 0
+        visits = []
+
+        for day in range(days):
+            for minute in range(requests_per_day):
+                now = start + datetime.timedelta(days=day, minutes=minute)
+                with mock.patch('django.utils.timezone.now', return_value=now):
+                    response = self.client.get(reverse('rango:about'))
+                if settings.SESSION_COOKIE_NAME in response.cookies:
+                    writes += 1
+            visits.append(self.client.session['visits'])
+        return writes, visits
+
+    def test_one_session_write_per_day(self):
+        writes, visits = self.count_session_writes(days=3,
+                                                   requests_per_day=20)
+        self.assertEqual(writes, 3)
+        self.assertEqual(visits, [1, 2, 3])
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        writes, visits = self.count_session_writes(days=2,
+                                                   requests_per_day=10)
+        self.assertEqual(writes, 2)
+        self.assertEqual(visits, [1, 2])
+
+    def test_first_visit_stores_only_the_count(self):
+        self.client.get(reverse('rango:about'))
+        self.assertEqual(sorted(self.client.session.keys()),
+                         ['last_visit', 'visits'])
+
+    def test_parse_visit_time(self):
+        legacy = parse_visit_time('2017-09-22 10:11:12.123456')
+        self.assertEqual((legacy.year, legacy.second, legacy.microsecond),
+                         (2017, 12, 123456))
+        self.assertIsNotNone(parse_visit_time('2017-09-22T10:11:12+02:00'))
+        self.assertIsNotNone(parse_visit_time('2017-09-22 10:11:12'))
+        self.assertEqual(parse_visit_time(0).year, 1970)
+        self.assertIsNone(parse_visit_time('yesterday'))
+        self.assertIsNone(parse_visit_time('2017-13-45 10:11:12'))
+
+
+class ImportTests(TestCase):
+    """
+    Tests for the bulk import pipeline and the import_rango command
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def rows(self, count, views=0):
+        return ({'category': 'Category {0}'.format(i % 5),
+                 'title': 'Page {0}'.format(i),
+                 'url': 'http://example.com/{0}'.format(i),
+                 'views': views}
+                for i in range(count))
+
+    def test_import_creates_and_updates(self):
+        stats = import_rows(self.rows(50), chunk_size=20)
+        self.assertEqual((stats.rows, stats.categories_created,
+                          stats.pages_created), (50, 5, 50))
+
+        stats = import_rows(self.rows(60, views=3), chunk_size=20)
+        self.assertEqual((stats.categories_created, stats.pages_created,
+                          stats.pages_updated), (0, 10, 50))
+        self.assertEqual(Page.objects.count(), 60)
+        self.assertEqual(Category.objects.count(), 5)
+        self.assertEqual(set(Page.objects.values_list('views', flat=True)),
+                         {3})
+        self.assertEqual(Category.objects.get(slug='category-1').name,
+                         'Category 1')
+
+    def test_queries_per_chunk_do_not_grow_with_rows(self):
+        """
+        A chunk costs a handful of queries whether it has 10 or 500 rows.
+        SQLite's parameter limit splits large inserts into a few batches.
+        """
+        import_rows(self.rows(5))
+        for count in (10, 500):
+            Page.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                import_rows(self.rows(count, views=1), chunk_size=count)
+            self.assertLessEqual(len(queries), 10)
+
+    def test_failed_import_invalidates_committed_chunks(self):
+        stamp = content_stamp()
+        rows = list(self.rows(30))
+        rows[25]['category'] = ''
+        with self.assertRaises(InvalidRowError):
+            import_rows(rows, chunk_size=10)
+        self.assertEqual(Page.objects.count(), 20)
+        self.assertGreater(content_stamp(), stamp)
+
+    def test_long_urls_are_refused(self):
+        url = 'http://example.com/' + 'x' * 200
+        with self.assertRaises(InvalidRowError):
+            import_rows([{'category': 'Python', 'url': url}])
+        self.assertFalse(Page.objects.exists())
+
+    def test_category_counters(self):
+        import_rows([{'category': 'Python', 'category_likes': '64',
+                      'category_views': '128'}])
+        python = Category.objects.get(slug='python')
+        self.assertEqual((python.views, python.likes), (128, 64))
+        self.assertEqual(python.pages.count(), 0)
+
+    def test_csv_and_jsonl(self):
+        csv_rows = list(read_rows(io.StringIO(
+            'category,title,url,views\nPython,Docs,http://docs.python.org,4\n'),
+            'csv'))
+        jsonl_rows = list(read_rows(io.StringIO(
+            '{"category": "Python", "title": "Docs", '
+            '"url": "http://docs.python.org", "views": 4}\n\n'), 'jsonl'))
+        self.assertEqual(len(csv_rows), 1)
+        self.assertEqual(len(jsonl_rows), 1)
+        self.assertEqual(csv_rows[0]['title'], jsonl_rows[0]['title'])
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            for row in self.rows(25):
+                f.write(json.dumps(row) + '\n')
+            f.flush()
+            out = io.StringIO()
+            call_command('import_rango', f.name, chunk_size=10,
+                         progress_every=1, stdout=out)
+
+        self.assertEqual(Page.objects.count(), 25)
+        self.assertIn('rows/s', out.getvalue())
+
+    def test_import_invalidates_caches(self):
+        self.assertEqual(self.client.get(reverse('rango:suggest_category'),
+                                         {'suggestion': 'c'}).json(),
+                         {'categories': []})
+        import_rows(self.rows(5))
+        response = self.client.get(reverse('rango:suggest_category'),
+                                   {'suggestion': 'c'})
+        self.assertEqual(len(response.json()['categories']), 5)
+
+
+class ExportTests(TestCase):
+    """
+    Tests for the streaming export, its command and view
+    """
+
+    def setUp(self):
+        cache.clear()
+        import_rows([{'category': 'Category {0}'.format(i % 3),
+                      'category_likes': i % 3,
+                      'title': 'Page {0}'.format(i),
+                      'url': 'http://example.com/{0}'.format(i),
+                      'views': i}
+                     for i in range(25)])
+
+    def snapshot(self):
+        return (sorted(Category.objects.values_list('name', 'likes')),
+                sorted(Page.objects.values_list('category__name', 'title',
+                                                'url', 'views')))
+
+    def test_round_trip(self):
+        before = self.snapshot()
+        for format in ('jsonl', 'csv'):
+            data = b''.join(encode_rows(export_rows(chunk_size=7), format))
+            Category.objects.all().delete()
+            rows = read_rows(io.StringIO(data.decode('utf-8')), format)
+            import_rows(rows)
+            self.assertEqual(self.snapshot(), before)
+
+    def test_resume_after_cursor(self):
+        rows = list(export_rows(chunk_size=4))
+        self.assertEqual(len(rows), 3 + 25)
+        for position in (0, 2, 3, 10, len(rows) - 1):
+            resumed = list(export_rows(after=rows[position]['cursor'],
+                                       chunk_size=4))
+            self.assertEqual(resumed, rows[position + 1:])
+
+    def test_queries_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(export_rows(chunk_size=10))
+        # one query per chunk of categories and three chunks of pages
+        self.assertEqual(len(queries), 1 + 3)
+
+    def test_gzip_stream(self):
+        chunks = list(encode_rows(export_rows(), 'jsonl', chunk_size=5))
+        compressed = b''.join(gzip_stream(iter(chunks)))
+        self.assertEqual(gzip.decompress(compressed), b''.join(chunks))
+
+    def test_export_command(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv.gz') as f:
+            call_command('export_rango', f.name)
+            data = gzip.decompress(f.read()).decode('utf-8')
+        lines = data.splitlines()
+        self.assertTrue(lines[0].startswith('cursor,category,'))
+        self.assertEqual(len(lines), 1 + 3 + 25)
+
+    def test_export_view(self):
+        url = reverse('rango:export')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        user = User.objects.create_user('rango', password='tango-pass')
+        UserProfile.objects.create(user=user)
+        self.client.login(username='rango', password='tango-pass')
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        lines = body.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3 + 25)
+
+        last = json.loads(lines[10])['cursor']
+        response = self.client.get(url, {'after': last})
+        self.assertNotIn('Content-Encoding', response)
+        rest = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(rest.splitlines(), lines[11:])
+
+        self.assertEqual(self.client.get(url, {'after': 'nope'}).status_code,
+                         400)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite',
+                     'query plans are checked on SQLite')
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every SELECT issued by the busiest views
+    and fails when one reads a whole table or sorts it in a temporary
+    b-tree instead of walking an index.
+    """
+
+    FULL_SCAN = re.compile(r'^SCAN (TABLE )?(?!CONSTANT ROW)\w+$')
+
+    def setUp(self):
+        cache.clear()
+        for i in range(10):
+            category = add_cat('Category {0}'.format(i), i, i)
+            for j in range(5):
+                Page.objects.create(category=category,
+                                    title='Page {0}'.format(j),
+                                    url='http://example.com/{0}/{1}'.format(i, j),
+                                    views=j)
+        self.user = User.objects.create_user('rango', password='tango-pass')
+        UserProfile.objects.create(user=self.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queries):
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            for detail in self.explain(sql):
+                if (self.FULL_SCAN.match(detail)
+                        or detail.startswith('USE TEMP B-TREE')):
+                    self.fail('{0}\n  {1}'.format(sql, detail))
+
+    def get(self, url, data=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def test_index(self):
+        self.assertIndexed(self.get(reverse('rango:index')))
+
+    def test_show_category(self):
+        self.assertIndexed(self.get(reverse('rango:show_category',
+                                            args=['category-3'])))
+
+    def test_category_list(self):
+        self.assertIndexed(self.get(reverse('rango:category_list')))
+
+    @override_settings(RANGO_CATEGORY_PAGES={'PAGE_SIZE': 2})
+    def test_category_page_rows(self):
+        category = Category.objects.get(slug='category-3')
+        cursor = category_pages(category).next_cursor
+        self.assertIndexed(self.get(
+            reverse('rango:category_page_rows', args=['category-3']),
+            {'after': cursor}))
+
+    @override_settings(RANGO_SEARCH={
+        'BACKEND': 'rango.benchmark.StubSearchBackend', 'CACHE': None})
+    def test_category_search_results(self):
+        self.client.login(username='rango', password='tango-pass')
+        self.assertIndexed(self.get(reverse('rango:category_search_results',
+                                            args=['category-3'])))
+
+    def test_add_page(self):
+        self.client.login(username='rango', password='tango-pass')
+        category = Category.objects.get(slug='category-3')
+        self.assertIndexed(self.get(reverse('rango:add_page'), {
+            'cat_id': category.id, 'url': 'http://example.com/new',
+            'name': 'New'}))
+
+    def test_suggest_category(self):
+        """
+        Suggestions come from the in-memory index. Building it reads every
+        category once, after that a suggestion runs no query at all.
+        """
+        url = reverse('rango:suggest_category')
+        self.get(url, {'suggestion': 'cat'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'suggestion': 'category 1'})
+        self.assertEqual(len(response.json()['categories']), 1)
+
+
+class BenchmarkTests(TestCase):
+    """
+    Tests for the benchmark harness behind benchmark_rango
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_route_is_benchmarked(self):
+        from . import urls
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names, {route.name for route in ROUTES})
+
+    def test_run_benchmark(self):
+        dataset = seed_dataset(300, users=5)
+        self.assertEqual(Category.objects.count(), 3)
+        report = run_benchmark(dataset, iterations=2, warmup=1)
+
+        self.assertEqual(report['dataset'], {'pages': 300, 'categories': 3})
+        for name, result in report['routes'].items():
+            self.assertIn(result['status'], (200, 302), name)
+            self.assertGreater(result['p95_ms'], 0)
+        self.assertEqual(report['routes']['suggest_category']['queries'], 0)
+        self.assertEqual(compare_reports(report, report), [])
+
+    def test_compare_reports(self):
+        def report(queries, p95_ms, pages=1000):
+            return {'dataset': {'pages': pages, 'categories': 10},
+                    'cold': False,
+                    'routes': {'index': {'queries': queries,
+                                         'p95_ms': p95_ms}}}
+
+        baseline = report(3, 10.0)
+        self.assertEqual(compare_reports(report(3, 16.0), baseline), [])
+        self.assertEqual([kind for name, kind, message in
+                          compare_reports(report(4, 18.0), baseline)],
+                         ['queries', 'p95'])
+        with self.assertRaises(BenchmarkError):
+            compare_reports(report(3, 10.0, pages=100), baseline)
+
+
+class InstrumentationTests(TestCase):
+    """
+    Tests for the instrumentation middleware and the metrics views
+    """
+
+    def setUp(self):
+        cache.clear()
+        request_metrics.reset()
+        add_cat('Python', 1, 1)
+        self.staff = User.objects.create_user('staff', password='tango-pass',
+                                              is_staff=True)
+        UserProfile.objects.create(user=self.staff)
+
+    def metrics(self):
+        client = self.client_class()
+        client.login(username='staff', password='tango-pass')
+        response = client.get(reverse('rango:metrics'))
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.content.decode('utf-8').splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_disabled_by_default(self):
+        self.client.get(reverse('rango:index'))
+        samples = self.metrics()
+        self.assertFalse([name for name in samples if 'view=' in name and
+                          not name.startswith('rango_ratelimit_')])
+        # the search service and rate limiter count in every process
+        self.assertEqual(samples['rango_search_breaker_open'], 0)
+
+    @override_settings(RANGO_INSTRUMENTATION={'ENABLED': True},
+                       RANGO_SEARCH={
+                           'BACKEND': 'rango.benchmark.StubSearchBackend',
+                           'CACHE': None})
+    def test_requests_are_timed_per_view(self):
+        self.client.get(reverse('rango:index'))
+        self.client.get(reverse('rango:show_category', args=['python']))
+        self.client.post(reverse('rango:search'), {'query': 'python'})
+        self.client.get(reverse('rango:search_results'), {'query': 'python'})
+
+        samples = self.metrics()
+        index = 'view="rango:index"}'
+        self.assertEqual(samples['rango_requests_total{' + index], 1)
+        self.assertGreater(samples['rango_request_seconds_total{' + index], 0)
+        self.assertGreater(samples['rango_db_queries_total{' + index], 0)
+        self.assertGreater(samples['rango_db_seconds_total{' + index], 0)
+        self.assertGreater(samples['rango_template_seconds_total{' + index], 0)
+        self.assertGreater(samples['rango_session_seconds_total{' + index], 0)
+        self.assertEqual(samples['rango_search_calls_total{' + index], 0)
+        self.assertEqual(
+            samples['rango_requests_total{view="rango:show_category"}'], 1)
+        self.assertEqual(
+            samples['rango_search_calls_total{view="rango:search"}'], 0)
+        self.assertEqual(
+            samples['rango_search_calls_total{view="rango:search_results"}'],
+            1)
+
+    @override_settings(RANGO_INSTRUMENTATION={
+        'ENABLED': True, 'PROFILE_SLOWEST': 2, 'PROFILE_RATE': 1})
+    def test_slowest_requests_are_profiled(self):
+        for i in range(3):
+            self.client.get(reverse('rango:about'))
+        profiles = request_metrics.profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertGreaterEqual(profiles[0]['seconds'], profiles[1]['seconds'])
+        self.assertIn('cumulative', profiles[0]['report'])
+
+    def test_metrics_are_staff_only(self):
+        user = User.objects.create_user('rango', password='tango-pass')
+        UserProfile.objects.create(user=user)
+        self.client.login(username='rango', password='tango-pass')
+        for name in ('rango:metrics', 'rango:metrics_profiles'):
+            self.assertEqual(self.client.get(reverse(name)).status_code, 302)
+
+
+@override_settings(RANGO_USERS={'PAGE_SIZE': 10})
+class UserDirectoryTests(TestCase):
+    """
+    Tests for the paginated ListUsers directory and ProfileView
+    """
+
+    def setUp(self):
+        cache.clear()
+        User.objects.bulk_create(User(username='user{0:02d}'.format(i))
+                                 for i in range(35))
+        UserProfile.objects.bulk_create(UserProfile(user=user)
+                                        for user in User.objects.all())
+        self.user = User.objects.create_user('rango', password='tango-pass')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.client.login(username='rango', password='tango-pass')
+
+    def usernames(self, response):
+        return [profile.user.username
+                for profile in response.context['object_list']]
+
+    def test_edit_profile_without_a_profile(self):
+        User.objects.create_superuser('admin', 'admin@example.com',
+                                      'tango-pass')
+        self.client.login(username='admin', password='tango-pass')
+        response = self.client.get(reverse('rango:edit_profile'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(UserProfile.objects.filter(
+            user__username='admin').exists())
+
+    def test_walk_forwards_and_back(self):
+        url = reverse('rango:list_users')
+        self.client.get(url)
+
+        pages = []
+        response = self.client.get(url)
+        while True:
+            pages.append(self.usernames(response))
+            page = response.context['page']
+            if not page.has_next:
+                break
+            # every page costs the same, however deep
+            with self.assertNumQueries(3):
+                response = self.client.get(url, {'after': page.next_cursor})
+
+        expected = sorted(User.objects.values_list('username', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(p) for p in pages], [10, 10, 10, 6])
+
+        for previous in reversed(pages[:-1]):
+            page = response.context['page']
+            response = self.client.get(url, {'before': page.previous_cursor})
+            self.assertEqual(self.usernames(response), previous)
+        self.assertFalse(response.context['page'].has_previous)
+
+    def test_count_is_cached(self):
+        url = reverse('rango:list_users')
+        response = self.client.get(url)
+        self.assertEqual(response.context['user_count'], 36)
+        self.assertContains(response, '36 registered users')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries))
+
+        UserProfile.objects.create(
+            user=User.objects.create_user('new', password='tango-pass'))
+        self.assertEqual(self.client.get(url).context['user_count'], 37)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('rango:list_users'),
+                                   {'after': 'not a cursor'})
+        self.assertEqual(response.status_code, 404)
+        # decodes, but usernames aren't null
+        response = self.client.get(reverse('rango:list_users'),
+                                   {'after': keyset.encode_cursor([None])})
+        self.assertEqual(response.status_code, 404)
+
+    def test_profile_reads_user_in_same_query(self):
+        other = UserProfile.objects.get(user__username='user07')
+        url = reverse('rango:profile', args=[other.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'user07')
+
+        by_pk = [q['sql'] for q in queries
+                 if '"rango_userprofile"."id" = {0}'.format(other.pk)
+                 in q['sql']]
+        self.assertEqual(len(by_pk), 1)
+        self.assertIn('INNER JOIN "auth_user"', by_pk[0])
+        self.assertFalse([q for q in queries if
+                          '"auth_user"."id" = {0}'.format(other.user_id)
+                          in q['sql']])
+
+
+@override_settings(RANGO_CATEGORY_PAGES={'PAGE_SIZE': 4})
+class CategoryPagesTests(TestCase):
+    """
+    Tests for the keyset paginated page list of show_category
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.category = add_cat('Python', 1, 1)
+        for i in range(11):
+            # views repeat, so ties are broken by id
+            Page.objects.create(category=self.category,
+                                title='Page {0}'.format(i),
+                                url='http://example.com/{0}'.format(i),
+                                views=i % 3)
+
+    def titles(self, response):
+        return re.findall(r'(Page \d+)</a>', response.content.decode('utf-8'))
+
+    def next_url(self, response):
+        match = re.search(r'data-url="([^"]+)"', response.content.decode('utf-8'))
+        return match.group(1).replace('&amp;', '&') if match else None
+
+    def test_scroll_through_every_page(self):
+        response = self.client.get(reverse('rango:show_category',
+                                           args=['python']))
+        titles = self.titles(response)
+        self.assertEqual(len(titles), 4)
+
+        url = self.next_url(response)
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            titles += self.titles(response)
+            url = self.next_url(response)
+
+        expected = list(Page.objects.order_by('-views', '-id')
+                        .values_list('title', flat=True))
+        self.assertEqual(titles, expected)
+
+    def test_no_javascript_fallback(self):
+        response = self.client.get(reverse('rango:show_category',
+                                           args=['python']))
+        cursor = response.context['pages'].next_cursor
+        response = self.client.get(reverse('rango:show_category',
+                                           args=['python']), {'after': cursor})
+        self.assertEqual(len(self.titles(response)), 4)
+        self.assertContains(response, 'More pages')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('rango:category_page_rows',
+                                           args=['python']), {'after': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_mistyped_cursor(self):
+        # decodes, but views and ids are numbers
+        response = self.client.get(reverse('rango:show_category',
+                                           args=['python']),
+                                   {'after': keyset.encode_cursor(['x', 'y'])})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get(reverse('rango:category_page_rows',
+                                           args=['python']),
+                                   {'after': keyset.encode_cursor([1, 'y'])})
+        self.assertEqual(response.status_code, 404)
+
+    def test_add_page_returns_only_the_new_row(self):
+        user = User.objects.create_user('rango', password='tango-pass')
+        UserProfile.objects.create(user=user)
+        self.client.login(username='rango', password='tango-pass')
+
+        response = self.client.get(reverse('rango:add_page'), {
+            'cat_id': self.category.id, 'url': 'http://example.com/new',
+            'name': 'Page 99'})
+        self.assertEqual(self.titles(response), ['Page 99'])
+        page = Page.objects.get(title='Page 99')
+        self.assertContains(response, 'id="page-{0}"'.format(page.id))
+
+
+
+def make_image(mode='RGB', size=(400, 300), format='JPEG'):
+    data = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128)[:len(mode)]).save(data, format)
+    return data.getvalue()
+
+
+class ThumbnailTests(TestCase):
+    """
+    Tests for the thumbnails of profile pictures
+    """
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media.name,
+                                      RANGO_TASKS={'EAGER': True})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user('rango', password='tango-pass')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.client.login(username='rango', password='tango-pass')
+
+    def upload(self, data, name='me.jpg'):
+        response = self.client.post(reverse('rango:edit_profile'), {
+            'website': '', 'picture': SimpleUploadedFile(name, data)})
+        self.assertEqual(response.status_code, 302)
+        self.profile.refresh_from_db()
+        return self.profile
+
+    def test_upload_creates_thumbnails(self):
+        profile = self.upload(make_image())
+        self.assertEqual(UserProfile.objects.count(), 1)
+        self.assertEqual(profile.thumbnail_source, profile.picture.name)
+        self.assertTrue(profile.thumbnail.name.endswith('-128.jpg'))
+
+        with Image.open(profile.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (128, 128))
+        with Image.open(profile.thumbnail_webp.path) as webp:
+            self.assertEqual((webp.format, webp.size), ('WEBP', (128, 128)))
+
+        response = self.client.get(reverse('rango:list_users'))
+        self.assertContains(response, 'srcset="{0}"'.format(
+            profile.thumbnail_webp.url))
+        self.assertContains(response, 'src="{0}"'.format(profile.thumbnail.url))
+
+    def test_transparency_is_kept(self):
+        profile = self.upload(make_image('RGBA', format='PNG'), 'me.png')
+        self.assertTrue(profile.thumbnail.name.endswith('.png'))
+        with Image.open(profile.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.mode, 'RGBA')
+
+    def test_names_follow_content(self):
+        first = self.upload(make_image()).thumbnail.name
+        # the same picture again is stored under a new name by the upload,
+        # but shares its thumbnails
+        self.assertEqual(self.upload(make_image()).thumbnail.name, first)
+        second = self.upload(make_image(size=(300, 300))).thumbnail.name
+        self.assertNotEqual(second, first)
+
+    def test_unchanged_picture_is_not_resized_again(self):
+        self.upload(make_image())
+        with mock.patch('rango.thumbnails.render_thumbnails') as render:
+            self.client.post(reverse('rango:edit_profile'),
+                             {'website': 'http://example.com/'})
+        self.assertFalse(render.called)
+
+    def test_backfill(self):
+        self.upload(make_image())
+        UserProfile.objects.update(thumbnail='', thumbnail_webp='',
+                                   thumbnail_source='')
+        out = io.StringIO()
+        call_command('backfill_thumbnails', workers=1, stdout=out)
+        self.assertIn('Created thumbnails for 1 of 1 profiles, 0 failed',
+                      out.getvalue())
+        self.profile.refresh_from_db()
+        self.assertTrue(self.profile.thumbnail)
+
+        out = io.StringIO()
+        call_command('backfill_thumbnails', workers=1, stdout=out)
+        self.assertIn('for 0 of 0 profiles', out.getvalue())
+
+
+@task(max_attempts=2)
+def failing_task(message):
+    raise ValueError(message)
+
+
+@task()
+def adding_task(a, b):
+    return a + b
+
+
+def crashing_execute(path):
+    # stands in for rango.tasks.execute in the worker's processes
+    if path is None:
+        os._exit(1)
+    with open(path, 'w') as f:
+        f.write('ran')
+
+
+@override_settings(RANGO_TASKS={'BACKOFF': 10, 'LEASE': 60})
+class TaskTests(TestCase):
+    """
+    Tests for the database task queue
+    """
+
+    def test_delay_queues_until_run(self):
+        queued = adding_task.delay(2, 3)
+        self.assertEqual(queued.status, Task.QUEUED)
+        self.assertEqual(queued.name, 'rango.tests.adding_task')
+
+        self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.DONE, 1))
+        self.assertEqual(json.loads(queued.result), 5)
+        self.assertEqual(run_pending(), 0)
+
+    def test_retries_with_backoff_then_fails(self):
+        queued = failing_task.delay('broken')
+        with self.assertLogs('rango.tasks', 'ERROR'):
+            run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.QUEUED, 1))
+        self.assertIn('ValueError: broken', queued.error)
+        self.assertGreater(queued.run_at,
+                           timezone.now() + datetime.timedelta(seconds=5))
+
+        # not due until the backoff has passed
+        self.assertEqual(run_pending(), 0)
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('rango.tasks', 'ERROR'):
+            run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 2))
+
+    def test_expired_lease_is_claimed_again(self):
+        queued = adding_task.delay(1, 1)
+        self.assertEqual(claim(10), [queued.pk])
+        self.assertEqual(claim(10), [])
+
+        # the worker running it died
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(claim(10), [queued.pk])
+        execute(queued.pk)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.DONE, 2))
+
+    def test_periodic_tasks_and_purge(self):
+        last_runs = {}
+        with self.settings(RANGO_TASKS={'PERIODIC': {
+                'rango.tests.adding_task': 60}}):
+            enqueue_periodic(last_runs)
+            # not due again, and one is already waiting
+            enqueue_periodic(last_runs)
+            enqueue_periodic({})
+        self.assertEqual(Task.objects.count(), 1)
+
+        Task.objects.update(arguments='[1, 2]')
+        run_pending()
+        self.assertEqual(purge_done(), 0)
+        later = timezone.now() + datetime.timedelta(days=2)
+        self.assertEqual(purge_done(now=later), 1)
+
+    def test_worker_command(self):
+        adding_task.delay(1, 2)
+        failing_task.delay('broken')
+        with self.assertLogs('rango.tasks', 'ERROR'):
+            call_command('run_tasks', workers=0, burst=True)
+        self.assertEqual(
+            sorted(Task.objects.values_list('status', flat=True)),
+            [Task.DONE, Task.QUEUED])
+
+    def test_worker_survives_a_dead_process(self):
+        ran = os.path.join(tempfile.mkdtemp(), 'ran')
+        self.addCleanup(shutil.rmtree, os.path.dirname(ran))
+        # the first task kills its process, the next still runs
+        claims = iter([[None], [ran]])
+        command = 'rango.management.commands.run_tasks.'
+        stderr = io.StringIO()
+        with mock.patch(command + 'execute', crashing_execute), \
+                mock.patch(command + 'claim',
+                           lambda limit: next(claims, []) if limit else []), \
+                mock.patch(command + 'enqueue_periodic'), \
+                mock.patch(command + 'purge_done'), \
+                self.assertLogs(command.rstrip('.'), 'ERROR'):
+            call_command('run_tasks', workers=1, burst=True, poll=0.01,
+                         stderr=stderr)
+        self.assertIn('Task pool broken', stderr.getvalue())
+        self.assertTrue(os.path.exists(ran))
+
+    def test_status_views_are_staff_only(self):
+        queued = adding_task.delay(1, 2)
+        url = reverse('rango:task_status', args=[queued.pk])
+        User.objects.create_user('rango', password='tango-pass')
+        self.client.login(username='rango', password='tango-pass')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        User.objects.create_user('staff', password='tango-pass',
+                                 is_staff=True)
+        self.client.login(username='staff', password='tango-pass')
+        self.assertEqual(self.client.get(url).json()['status'], Task.QUEUED)
+        stats = self.client.get(reverse('rango:task_queue')).json()
+        self.assertEqual(stats['counts'][Task.QUEUED], 1)
+
+
+class LocalSearchTests(TestCase):
+    """
+    Tests for the full-text index of pages and categories
+    """
+
+    def setUp(self):
+        self.python = add_cat('Python', 1, 1)
+        self.django = add_cat('Django', 1, 1)
+        self.tutorial = Page.objects.create(
+            category=self.python, title='Official Python Tutorial',
+            url='http://docs.python.org/3/tutorial/')
+        self.book = Page.objects.create(
+            category=self.django, title='Two Scoops',
+            url='http://twoscoops.example.com/python-book')
+
+    def found(self, query):
+        return [(hit.kind, hit.title) for hit in local_search.search(query)]
+
+    def test_titles_rank_above_urls(self):
+        self.assertEqual(self.found('python'), [
+            ('category', 'Python'),
+            ('page', 'Official Python Tutorial'),
+            ('page', 'Two Scoops'),
+        ])
+        self.assertEqual(self.found('scoops book'), [('page', 'Two Scoops')])
+
+    def test_titles_arent_crowded_out_by_newer_urls(self):
+        candidates = local_search.get_local_search_settings()['CANDIDATES']
+        Page.objects.bulk_create([
+            Page(category=self.django, title='Page {0}'.format(i),
+                 url='http://python.org/{0}'.format(i))
+            for i in range(candidates + 10)])
+        self.assertEqual(self.found('python')[:2], [
+            ('category', 'Python'),
+            ('page', 'Official Python Tutorial'),
+        ])
+        self.assertEqual(len(self.found('python')), 10)
+
+    def test_words_are_stemmed(self):
+        self.assertEqual(self.found('tutorials'),
+                         [('page', 'Official Python Tutorial')])
+        self.assertEqual(self.found('tut'), [])
+
+    def test_operators_are_searched_as_words(self):
+        self.assertEqual(self.found('"python" AND (NEAR'), [])
+        self.assertEqual(self.found('   '), [])
+
+    def test_every_write_is_indexed(self):
+        self.tutorial.title = 'Beginner guide'
+        self.tutorial.save()
+        self.assertEqual(self.found('beginner'),
+                         [('page', 'Beginner guide')])
+        self.assertEqual(self.found('official'), [])
+
+        Page.objects.filter(pk=self.book.pk).update(title='Scoops of Django')
+        Page.objects.bulk_create([Page(category=self.django, title='Bulk')])
+        self.assertEqual(self.found('scoops django'),
+                         [('page', 'Scoops of Django')])
+        self.assertEqual(self.found('bulk'), [('page', 'Bulk')])
+
+        # deleting a category deletes its pages
+        self.django.delete()
+        self.assertEqual(self.found('scoops'), [])
+        self.assertEqual(self.found('django'), [])
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM rango_search_index')
+        self.assertEqual(self.found('python'), [])
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 4 pages and categories', out.getvalue())
+        self.assertEqual(len(self.found('python')), 3)
+
+    def test_search_view_lists_local_hits_first(self):
+        with StubWebhoseServer() as server, stub_search_settings(server):
+            response = self.client.post(reverse('rango:search'),
+                                        {'query': 'tutorial'})
+            self.assertEqual(server.requests, 0)
+            self.assertContains(response, 'Official Python Tutorial')
+            self.assertContains(response,
+                                '?page_id={0}'.format(self.tutorial.pk))
+            # the web results are loaded afterwards
+            self.assertContains(response, 'id="web_results"')
+            self.assertContains(response, 'data-query="tutorial"')
+
+            response = self.client.get(reverse('rango:search_results'),
+                                       {'query': 'tutorial'})
+        self.assertContains(response, 'tutorial 0')
+        self.assertNotContains(response, 'Official Python Tutorial')
+
+
+class DatabaseTests(TestCase):
+    """
+    Tests for the SQLite tuning in rango/database.py and the write
+    benchmark
+    """
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA {0}'.format(name))
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        # NORMAL
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('temp_store'), 2)
+
+    def test_journal_mode_of_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = sqlite3.connect(directory + '/rango.sqlite3')
+            try:
+                options = get_sqlite_settings()
+                for statement in pragma_statements(options):
+                    database.execute(statement)
+                # connections leave the file as it is
+                mode = database.execute('PRAGMA journal_mode').fetchone()[0]
+                self.assertEqual(mode, 'delete')
+
+                mode = database.execute(journal_mode_statement(
+                    options['JOURNAL_MODE'])).fetchone()[0]
+                self.assertEqual(mode, 'wal')
+            finally:
+                database.close()
+        self.assertEqual(pragma_statements({'BUSY_TIMEOUT': None}), [])
+
+    def test_set_journal_mode_command(self):
+        out = io.StringIO()
+        call_command('set_journal_mode', stdout=out)
+        # the test database is in memory, which has no other mode
+        self.assertEqual(out.getvalue(), 'Journal mode: memory\n')
+
+    def test_begin_statement(self):
+        self.assertEqual(begin_statement(), 'BEGIN IMMEDIATE')
+        with override_settings(RANGO_SQLITE={'TRANSACTION_MODE': None}):
+            self.assertEqual(begin_statement(), 'BEGIN')
+
+    def test_write_loop(self):
+        python = add_cat('Python', 0, 0)
+        page = Page.objects.create(category=python, title='Tutorial',
+                                   url='http://docs.python.org/')
+        times, errors = write_loop(Targets(), 0.05, reconnect=False)
+
+        self.assertEqual(errors, 0)
+        self.assertTrue(times)
+        page.refresh_from_db()
+        python.refresh_from_db()
+        written = (page.views + python.likes +
+                   Page.objects.filter(title__startswith='Written').count())
+        self.assertEqual(written, len(times))
+
+
+@override_settings(RANGO_REPLICAS={'DATABASES': ['replica']},
+                   RANGO_PAGE_CACHE={'ENABLED': False})
+class ReplicaTests(TransactionTestCase):
+    """
+    Tests for rango.replicas, with a second SQLite database as the
+    replica. Nothing replicates to it, so rows only read from it exist
+    if a test copied them there.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases['replica'] = dict(
+            connections.databases['default'],
+            NAME=cls.directory.name + '/replica.sqlite3')
+        call_command('migrate', database='replica', verbosity=0)
+        super(ReplicaTests, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(ReplicaTests, cls).tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='secret')
+        profile = UserProfile.objects.create(user=self.user)
+        self.python = Category.objects.create(name='Python')
+        self.replicate(self.user, profile, self.python)
+        start_request()
+
+    def tearDown(self):
+        for model in (Category, UserProfile, User):
+            model.objects.using('replica').delete()
+
+    def replicate(self, *objects):
+        for instance in objects:
+            instance.save(using='replica', force_insert=True)
+
+    def shown_category(self, client, slug):
+        response = client.get(reverse('rango:show_category', args=[slug]))
+        return response.context['category']
+
+    def test_reads_go_to_the_replica(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Category), 'replica')
+        self.assertEqual(router.db_for_read(Task), 'default')
+
+        Category.objects.using('default').filter(pk=self.python.pk).update(
+            likes=5)
+        start_request()
+        self.assertEqual(Category.objects.get(pk=self.python.pk).likes, 0)
+
+        # after a write, the primary
+        self.assertEqual(router.db_for_write(Category), 'default')
+        self.assertEqual(Category.objects.get(pk=self.python.pk).likes, 5)
+
+    def test_reads_are_pinned_after_a_write(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.shown_category(self.client, 'python'),
+                         self.python)
+
+        self.client.post(reverse('rango:add_category'), {'name': 'Django', 'views': 0, 'likes': 0})
+        self.assertTrue(Category.objects.using('default').filter(
+            name='Django').exists())
+        self.assertEqual(self.shown_category(self.client, 'django').name,
+                         'Django')
+
+        # only for the writer, other users read the replica
+        self.assertIsNone(self.shown_category(Client(), 'django'))
+
+        # and until the pin expires
+        with override_settings(RANGO_REPLICAS={'DATABASES': ['replica'],
+                                               'PIN_SECONDS': 0}):
+            client = Client()
+            client.force_login(self.user)
+            client.post(reverse('rango:add_category'),
+                        {'name': 'Flask', 'views': 0, 'likes': 0})
+            self.assertIsNone(self.shown_category(client, 'flask'))
+
+    @override_settings(RANGO_COUNTERS={'FLUSH_INTERVAL': 0})
+    def test_counter_flushes_dont_pin_reads(self):
+        page = Page.objects.create(category=self.python, title='Docs',
+                                   url='http://docs.python.org/')
+        self.replicate(page)
+        goto = reverse('rango:goto')
+
+        response = self.client.get(goto, {'page_id': page.pk})
+        self.assertEqual(Page.objects.using('default').get(pk=page.pk).views,
+                         1)
+        # anonymous visitors aren't given a session to pin
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        # and the flush wasn't the user's own write
+        self.client.force_login(self.user)
+        self.client.get(goto, {'page_id': page.pk})
+        self.assertEqual(Page.objects.using('default').get(pk=page.pk).views,
+                         2)
+        self.assertNotIn(PIN_KEY, self.client.session)
+
+    @override_settings(RANGO_PAGE_CACHE={'ENABLED': True})
+    def test_pages_cached_after_a_change_read_the_primary(self):
+        Category.objects.using('default').filter(pk=self.python.pk).update(
+            likes=5)
+        content_changed()
+        # the replica doesn't have the like yet
+        self.assertEqual(self.shown_category(Client(), 'python').likes, 5)
+
+        with override_settings(RANGO_REPLICAS={'DATABASES': ['replica'],
+                                               'PIN_SECONDS': 0}):
+            content_changed()
+            self.assertEqual(self.shown_category(Client(), 'python').likes,
+                             0)
+
+
+class CategoryAggregateTests(TestCase):
+    """
+    Tests for the page counts and views kept on categories by
+    rango.aggregates
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.python = add_cat('Python', 0, 0)
+        self.django = add_cat('Django', 0, 0)
+
+    def aggregates(self, category):
+        category.refresh_from_db()
+        return category.page_count, category.total_page_views
+
+    def test_pages_are_counted(self):
+        tutorial = Page.objects.create(category=self.python, title='Tutorial',
+                                       url='http://docs.python.org/',
+                                       views=10)
+        Page.objects.create(category=self.python, title='PEP 8',
+                            url='https://www.python.org/dev/peps/pep-0008/',
+                            views=5)
+        self.assertEqual(self.aggregates(self.python), (2, 15))
+
+        tutorial.delete()
+        self.assertEqual(self.aggregates(self.python), (1, 5))
+        self.assertEqual(self.aggregates(self.django), (0, 0))
+
+    def test_saving_a_category_keeps_its_aggregates(self):
+        stale = Category.objects.get(pk=self.python.pk)
+        Page.objects.create(category=self.python, title='Tutorial',
+                            url='http://docs.python.org/', views=10)
+        stale.likes = 3
+        stale.save()
+        self.assertEqual(self.aggregates(self.python), (1, 10))
+        self.assertEqual(self.python.likes, 3)
+
+    def test_flushed_views_and_imports_are_added(self):
+        import_rows([
+            {'category': 'Python', 'url': 'http://a.com', 'views': 4},
+            {'category': 'Python', 'url': 'http://b.com', 'views': 6},
+            {'category': 'Flask', 'url': 'http://flask.pocoo.org/'},
+        ])
+        self.assertEqual(self.aggregates(self.python), (2, 10))
+        self.assertEqual(self.aggregates(Category.objects.get(name='Flask')),
+                         (1, 0))
+
+        # importing again replaces the views
+        import_rows([{'category': 'Python', 'url': 'http://a.com',
+                      'views': 1}])
+        self.assertEqual(self.aggregates(self.python), (2, 7))
+
+        buffer = CounterBuffer(MemoryCounterStore(), flush_interval=60)
+        for page in Page.objects.filter(category=self.python):
+            buffer.incr(Page, page.pk, 'views', 2)
+        buffer.flush()
+        self.assertEqual(self.aggregates(self.python), (2, 11))
+        self.assertEqual(reconcile(fix=False), 0)
+
+    def test_reconcile_fixes_drift(self):
+        Page.objects.create(category=self.python, title='Tutorial',
+                            url='http://docs.python.org/', views=10)
+        Page.objects.filter(category=self.python).update(views=20)
+        Category.objects.filter(pk=self.django.pk).update(page_count=4)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_categories', check=True)
+        out = io.StringIO()
+        call_command('reconcile_categories', stdout=out)
+        self.assertIn('Fixed 2 categories', out.getvalue())
+        self.assertEqual(self.aggregates(self.python), (1, 20))
+        self.assertEqual(self.aggregates(self.django), (0, 0))
+        self.assertEqual(reconcile(), 0)
+
+    def test_reconcile_keeps_concurrent_flushes(self):
+        """
+        Views flushed between reading the categories and fixing them
+        aren't overwritten
+        """
+        page = Page.objects.create(category=self.python, title='Tutorial',
+                                   url='http://docs.python.org/', views=10)
+        Category.objects.filter(pk=self.python.pk).update(page_count=3)
+        values_list = Category.objects.values_list
+
+        def read_then_flush(*fields):
+            rows = list(values_list(*fields))
+            buffer = CounterBuffer(MemoryCounterStore(), flush_interval=60)
+            buffer.incr(Page, page.pk, 'views', 5)
+            buffer.flush()
+            return mock.Mock(iterator=lambda: iter(rows))
+
+        with mock.patch.object(Category.objects, 'values_list',
+                               side_effect=read_then_flush):
+            self.assertEqual(reconcile(), 1)
+        self.assertEqual(self.aggregates(self.python), (1, 15))
+        self.assertEqual(reconcile(fix=False), 0)
+
+    @override_settings(RANGO_SIDEBAR={'ORDER': 'views'})
+    def test_index_and_sidebar_rank_by_views(self):
+        Page.objects.create(category=self.django, title='Tutorial',
+                            url='https://docs.djangoproject.com/', views=10)
+        response = self.client.get(reverse('rango:index'))
+        self.assertEqual([c.name for c in response.context['categories']],
+                         ['Django', 'Python'])
+        self.assertContains(response, 'Most Viewed Categories')
+
+        template = Template('{% load rango_template_tags %}'
+                            '{% get_category_list %}')
+        html = template.render(Context({}))
+        self.assertLess(html.index('Django'), html.index('Python'))
+
+        # a page's views change the ranking
+        Page.objects.create(category=self.python, title='Tutorial',
+                            url='http://docs.python.org/', views=20)
+        html = template.render(Context({}))
+        self.assertLess(html.index('Python'), html.index('Django'))
+
+
+@override_settings(RANGO_TRENDING={'BUCKET': 600, 'TOP': 2,
+                                   'WINDOWS': {'1h': 3600, '24h': 86400}})
+class TrendingTests(TestCase):
+    """
+    Tests for the trending rankings of rango.trending
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.python = add_cat('Python', 0, 0)
+        self.django = add_cat('Django', 0, 0)
+        self.tutorial = Page.objects.create(
+            category=self.python, title='Tutorial',
+            url='http://docs.python.org/')
+        self.docs = Page.objects.create(
+            category=self.django, title='Docs',
+            url='https://docs.djangoproject.com/')
+        self.now = time.time()
+
+    def bucket(self, kind, pk, seconds_ago):
+        return ActivityBucket.objects.create(
+            kind=kind, object_id=pk,
+            bucket=current_bucket(self.now - seconds_ago), views=10)
+
+    def test_flushes_are_recorded_in_buckets(self):
+        buffer = CounterBuffer(MemoryCounterStore(), flush_interval=60)
+        buffer.incr(Page, self.tutorial.pk, 'views', 3)
+        buffer.incr(Category, self.django.pk, 'likes')
+        buffer.flush()
+        buffer.incr(Page, self.tutorial.pk, 'views')
+        buffer.flush()
+
+        buckets = {(b.kind, b.object_id): (b.views, b.likes)
+                   for b in ActivityBucket.objects.all()}
+        self.assertEqual(buckets, {
+            ('page', self.tutorial.pk): (4, 0),
+            ('category', self.python.pk): (4, 0),
+            ('category', self.django.pk): (0, 1),
+        })
+
+    def test_recent_activity_ranks_first(self):
+        # the same views, the tutorial's an hour earlier
+        self.bucket('page', self.tutorial.pk, 3000)
+        self.bucket('page', self.docs.pk, 0)
+        self.bucket('category', self.python.pk, 7200)
+        self.assertEqual(compute_trending(now=self.now), 5)
+
+        hour = ranking('1h')
+        self.assertEqual([p.title for p in hour['page']],
+                         ['Docs', 'Tutorial'])
+        self.assertEqual(hour['page'][0].url, self.docs.url)
+        self.assertEqual(hour['category'], [])
+
+        day = ranking('24h')
+        self.assertEqual([c.slug for c in day['category']], ['python'])
+        self.assertGreater(day['page'][1].score, hour['page'][1].score)
+
+    def test_old_buckets_and_deleted_pages_are_dropped(self):
+        self.bucket('page', self.tutorial.pk, 0)
+        self.bucket('page', self.docs.pk, 0)
+        self.bucket('page', self.docs.pk, 2 * 86400)
+        self.docs.delete()
+        compute_trending(now=self.now)
+
+        self.assertEqual([p.title for p in ranking('1h')['page']],
+                         ['Tutorial'])
+        self.assertEqual(ActivityBucket.objects.count(), 2)
+
+        # rankings are replaced
+        compute_trending(now=self.now)
+        self.assertEqual(Trending.objects.filter(window='1h').count(), 1)
+
+    def test_index_shows_trending(self):
+        response = self.client.get(reverse('rango:index'))
+        self.assertContains(response, 'Most Viewed Pages')
+
+        self.bucket('page', self.docs.pk, 0)
+        self.bucket('category', self.django.pk, 0)
+        compute_trending(now=self.now)
+        with self.settings(RANGO_TRENDING={'INDEX_WINDOW': '1h',
+                                           'WINDOWS': {'1h': 3600}}):
+            response = self.client.get(reverse('rango:index'))
+        self.assertContains(response, 'Trending Pages')
+        self.assertContains(response, 'Trending Categories')
+        self.assertEqual([p.title for p in response.context['pages']],
+                         ['Docs'])
+        self.assertContains(response, reverse('rango:show_category',
+                                              args=['django']))
+
+
+class StaticAssetTests(TestCase):
+    """
+    Tests for hashed, precompressed static files and the WSGI middleware
+    serving them
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        static_root = override_settings(STATIC_ROOT=self.root)
+        static_root.enable()
+        self.addCleanup(static_root.disable)
+
+    def collect(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        return StaticFilesMiddleware(self.not_found)
+
+    def not_found(self, environ, start_response):
+        start_response('404 Not Found', [])
+        return [b'not found']
+
+    def get(self, app, path, **environ):
+        environ.update({'PATH_INFO': path, 'REQUEST_METHOD': 'GET'})
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        response['body'] = b''.join(app(environ, start_response))
+        return response
+
+    def test_uncollected_files_keep_their_names(self):
+        self.assertEqual(static('js/rango-ajax.js'), '/static/js/rango-ajax.js')
+        response = self.client.get(reverse('rango:about'))
+        self.assertContains(response, '/static/images/rango.jpg')
+
+    def test_collected_files_are_hashed_and_compressed(self):
+        app = self.collect()
+        url = static('js/rango-ajax.js')
+        self.assertRegex(url, r'^/static/js/rango-ajax\.[0-9a-f]{12}\.js$')
+        with open(os.path.join(self.root, 'js', 'rango-ajax.js'), 'rb') as f:
+            original = f.read()
+        with open(os.path.join(self.root, url[len('/static/'):] + '.gz'),
+                  'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), original)
+        # images aren't compressed
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, 'images', 'rango.jpg.gz')))
+
+        response = self.get(app, url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['status'], '200 OK')
+        headers = response['headers']
+        self.assertEqual(headers['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response['body']), original)
+
+        plain = self.get(app, url)
+        self.assertEqual(plain['body'], original)
+        self.assertNotIn('Content-Encoding', plain['headers'])
+        self.assertNotEqual(plain['headers']['ETag'], headers['ETag'])
+
+        # unhashed names aren't cached for long
+        response = self.get(app, '/static/js/rango-ajax.js')
+        self.assertEqual(response['headers']['Cache-Control'],
+                         'public, max-age=60')
+
+    def test_files_missing_from_the_manifest_fail(self):
+        self.collect()
+        with self.assertRaises(ValueError):
+            static('js/missing.js')
+        with override_settings(DEBUG=True):
+            self.assertEqual(static('js/missing.js'), '/static/js/missing.js')
+
+    def test_middleware_revalidates_and_passes_through(self):
+        app = self.collect()
+        url = static('images/rango.jpg')
+        etag = self.get(app, url)['headers']['ETag']
+        response = self.get(app, url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response['status'], '304 Not Modified')
+        self.assertEqual(response['body'], b'')
+
+        self.assertEqual(self.get(app, '/static/missing.js')['body'],
+                         b'not found')
+        self.assertEqual(self.get(app, '/rango/')['body'], b'not found')
+        response = app({'PATH_INFO': url, 'REQUEST_METHOD': 'POST'},
+                       lambda status, headers: None)
+        self.assertEqual(list(response), [])
+
+    def test_page_weight(self):
+        app = self.collect()
+        html = ('<link href="https://cdn.example.com/a.css" rel="stylesheet">'
+                '<a href="http://example.com/">a link</a>'
+                '<script src="{0}"></script>'
+                '<img src="{1}">').format(static('js/bootstrap.js'),
+                                          static('images/rango.jpg'))
+        weight = page_weight(html, app)
+        self.assertEqual(weight['assets'], 2)
+        self.assertEqual(weight['external'], 1)
+        self.assertLess(weight['after_bytes'], weight['before_bytes'])
+        self.assertEqual(weight['before_repeat_requests'], 2)
+        self.assertEqual(weight['after_repeat_requests'], 0)
+
+        # files served under their own names are asked for again
+        html = '<script src="/static/js/bootstrap.js"></script>'
+        weight = page_weight(html, app)
+        self.assertEqual(weight['before_repeat_requests'], 1)
+        self.assertEqual(weight['after_repeat_requests'], 1)
+
+
+@override_settings(RANGO_RATELIMIT={'LIMITS': {'suggest_category': (3, 30),
+                                               'like_category': (2, 60)},
+                                    'IP_MULTIPLIER': 2})
+class RateLimitTests(TestCase):
+    """
+    Tests for the token buckets of rango.ratelimit
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def suggest(self, client=None, **extra):
+        return (client or self.client).get(reverse('rango:suggest_category'),
+                                           {'suggestion': 'py'}, **extra)
+
+    def test_stores_refill_tokens(self):
+        for store in (MemoryBucketStore(), CacheBucketStore()):
+            # a burst of 3, then one token every 10 seconds
+            self.assertEqual([store.take('k', 10, 3, 100) for i in range(4)],
+                             [0, 0, 0, 10])
+            self.assertEqual(store.take('k', 10, 3, 105), 5)
+            self.assertEqual(store.take('k', 10, 3, 110), 0)
+            self.assertEqual(store.take('k', 10, 3, 110), 10)
+            # full again after a while, but no fuller
+            self.assertEqual([store.take('k', 10, 3, 1000) for i in range(4)],
+                             [0, 0, 0, 10])
+            self.assertEqual(store.take('other', 10, 3, 1000), 0)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_stores_limit_sustained_traffic(self):
+        # 10 requests a minute, tried once a second for 5 minutes: the
+        # burst of 10 and then one every 6 seconds, 59 in all
+        cache.clear()
+        for store in (MemoryBucketStore(), CacheBucketStore()):
+            allowed = 0
+            for now in range(1000, 1300):
+                # the cache expires keys on the same clock
+                with mock.patch('time.time', return_value=now):
+                    allowed += not store.take('k', 6, 10, now)
+            self.assertEqual(allowed, 59)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cache_store_limits_concurrent_requests(self):
+        cache.clear()
+        store = CacheBucketStore()
+        cache_calls = store.cache
+
+        class SlowCache(object):
+            # a millisecond a call, like a memcached or redis round trip
+            def __getattr__(self, name):
+                method = getattr(cache_calls, name)
+
+                def call(*args, **kwargs):
+                    time.sleep(0.001)
+                    return method(*args, **kwargs)
+                return call
+
+        store.cache = SlowCache()
+        barrier = threading.Barrier(20)
+        allowed = []
+
+        def client():
+            barrier.wait()
+            for i in range(10):
+                allowed.append(not store.take('k', 6, 10, 1000))
+
+        threads = [threading.Thread(target=client) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(allowed), 10)
+
+    def test_over_limit_requests_are_refused_without_queries(self):
+        for i in range(3):
+            self.assertEqual(self.suggest().status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.suggest()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+
+        # other addresses and endpoints have their own buckets
+        self.assertEqual(self.suggest(REMOTE_ADDR='10.0.0.2').status_code,
+                         200)
+        self.assertEqual(self.client.get(reverse('rango:about')).status_code,
+                         200)
+
+        snapshot = get_rate_limiter().snapshot()
+        self.assertEqual(snapshot['suggest_category'], {
+            'ratelimit_allowed_total': 4, 'ratelimit_limited_total': 1})
+
+    def test_sessions_share_their_address(self):
+        clients = [Client() for i in range(3)]
+        for i, client in enumerate(clients):
+            client.cookies[settings.SESSION_COOKIE_NAME] = 'session{0}'.format(i)
+
+        # each session gets 3 requests, their address 6 in all
+        statuses = [self.suggest(client).status_code
+                    for client in clients for i in range(3)]
+        self.assertEqual(statuses.count(200), 6)
+        self.assertEqual(statuses.count(429), 3)
+
+    def test_likes_are_limited_per_user(self):
+        user = User.objects.create_user('rango', password='tango-pass')
+        UserProfile.objects.create(user=user)
+        category = add_cat('Python', 0, 0)
+        self.client.login(username='rango', password='tango-pass')
+        statuses = [self.client.get(reverse('rango:like_category'),
+                                    {'cat_id': category.pk}).status_code
+                    for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    @override_settings(RANGO_RATELIMIT={'ENABLED': False})
+    def test_disabled(self):
+        for i in range(25):
+            self.assertEqual(self.suggest().status_code, 200)
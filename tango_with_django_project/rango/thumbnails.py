@@ -0,0 +1,133 @@
+"""
+Thumbnails of UserProfile pictures.
+
+Pictures are stored as uploaded, often several megabytes, so listing users
+with the originals costs a lot of bandwidth and decoding. Whenever a
+profile is saved with a new picture, a task (see rango.tasks) crops and
+resizes it to a fixed size, and stores two variants:
+
+    thumbnail = JPEG (PNG if the picture has transparency)
+    thumbnail_webp = WebP, a fraction of the size, for browsers taking it
+
+Files are named after a hash of the picture's content and the size, so
+the same picture uploaded twice is only stored once and a URL never
+serves stale content, which lets them be cached forever.
+
+    RANGO_THUMBNAILS = {
+        'SIZE': 128,       # width and height in pixels
+        'QUALITY': 85,     # JPEG and WebP quality
+    }
+
+The backfill_thumbnails management command processes existing pictures.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from PIL import Image, ImageOps
+
+from .models import UserProfile
+from .tasks import task
+
+
+THUMBNAIL_DEFAULTS = {
+    'SIZE': 128,
+    'QUALITY': 85,
+}
+
+
+def get_thumbnail_settings():
+    """
+    Returns THUMBNAIL_DEFAULTS updated with the RANGO_THUMBNAILS setting
+    """
+    options = dict(THUMBNAIL_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_THUMBNAILS', {}))
+    return options
+
+
+def render_thumbnails(data, size, quality=85):
+    """
+    Returns (extension, bytes) of the fallback thumbnail and the WebP
+    bytes of the picture [data], cropped to a [size] pixels square.
+    """
+    image = Image.open(io.BytesIO(data))
+    # phones store the rotation in EXIF instead of rotating the pixels
+    image = _apply_orientation(image)
+
+    transparent = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    image = image.convert('RGBA' if transparent else 'RGB')
+    image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+
+    fallback = io.BytesIO()
+    if transparent:
+        extension = 'png'
+        image.save(fallback, 'PNG', optimize=True)
+    else:
+        extension = 'jpg'
+        image.save(fallback, 'JPEG', quality=quality, optimize=True,
+                   progressive=True)
+
+    webp = io.BytesIO()
+    image.save(webp, 'WEBP', quality=quality, method=6)
+    return (extension, fallback.getvalue()), webp.getvalue()
+
+
+def _apply_orientation(image):
+    try:
+        orientation = image._getexif().get(0x0112)
+    except (AttributeError, KeyError, IndexError, TypeError):
+        return image
+    rotations = {3: Image.ROTATE_180, 6: Image.ROTATE_270, 8: Image.ROTATE_90}
+    if orientation in rotations:
+        return image.transpose(rotations[orientation])
+    return image
+
+
+def _store(name, content):
+    # content hashed names only ever hold the same bytes
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+    return name
+
+
+@task()
+def generate_thumbnails(profile_id, force=False):
+    """
+    Creates the thumbnails of a profile's picture if they are missing or
+    were made from another picture. Returns True if it wrote thumbnails.
+    """
+    profile = UserProfile.objects.filter(pk=profile_id).first()
+    if profile is None or not profile.picture:
+        return False
+    source = profile.picture.name
+    if not force and profile.thumbnail and profile.thumbnail_source == source:
+        return False
+
+    options = get_thumbnail_settings()
+    with profile.picture.storage.open(source, 'rb') as picture:
+        data = picture.read()
+
+    digest = hashlib.sha256(data).hexdigest()
+    base = 'thumbnails/{0}/{1}-{2}'.format(digest[:2], digest, options['SIZE'])
+    (extension, fallback), webp = render_thumbnails(data, options['SIZE'],
+                                                    options['QUALITY'])
+    thumbnail = _store('{0}.{1}'.format(base, extension), fallback)
+    thumbnail_webp = _store(base + '.webp', webp)
+
+    # only if the picture wasn't replaced while we were resizing it;
+    # update() doesn't send post_save, which would schedule us again
+    return bool(UserProfile.objects.filter(pk=profile_id, picture=source)
+                .update(thumbnail=thumbnail, thumbnail_webp=thumbnail_webp,
+                        thumbnail_source=source))
+
+
+def schedule_thumbnails(profile):
+    """
+    Queues the generation of [profile]'s thumbnails, if its picture has
+    none yet
+    """
+    if profile.picture and profile.thumbnail_source != profile.picture.name:
+        generate_thumbnails.delay(profile.pk)
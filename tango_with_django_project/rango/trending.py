@@ -0,0 +1,184 @@
+"""
+Trending pages and categories.
+
+Every counter flush adds the views and likes it wrote to ActivityBucket
+rows, one per page or category and BUCKET seconds. The compute_trending
+task, run periodically by the task worker, scores each page and category
+over every window in WINDOWS:
+
+    score = sum of (views + LIKE_WEIGHT * likes) / (1 + age / half life)
+
+over the buckets of the window, where age is how long ago the bucket
+started and the half life a fraction HALF_LIFE of the window, so recent
+activity counts most. The TOP of each window and kind are written to
+the Trending table with their titles and links. The index page shows
+the INDEX_WINDOW ranking with one query, however many pages and
+categories exist.
+
+    RANGO_TRENDING = {
+        'BUCKET': 600,        # seconds of activity per bucket
+        'WINDOWS': {'1h': 60 * 60, '24h': 60 * 60 * 24,
+                    '7d': 60 * 60 * 24 * 7},
+        'HALF_LIFE': 0.25,    # of the window
+        'LIKE_WEIGHT': 5,     # views a like is worth
+        'TOP': 10,            # ranked per window and kind
+        'INDEX_WINDOW': '24h',   # None shows all-time favourites
+    }
+
+Buckets older than the longest window are deleted by compute_trending.
+"""
+import collections
+import math
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Sum, Value
+
+from .models import ActivityBucket, Category, Page, Trending
+from .page_cache import content_changed
+from .tasks import task
+
+
+TRENDING_DEFAULTS = {
+    'BUCKET': 600,
+    'WINDOWS': {
+        '1h': 60 * 60,
+        '24h': 60 * 60 * 24,
+        '7d': 60 * 60 * 24 * 7,
+    },
+    'HALF_LIFE': 0.25,
+    'LIKE_WEIGHT': 5,
+    'TOP': 10,
+    'INDEX_WINDOW': '24h',
+}
+
+
+def get_trending_settings():
+    """
+    Returns TRENDING_DEFAULTS updated with the RANGO_TRENDING setting
+    """
+    options = dict(TRENDING_DEFAULTS)
+    options.update(getattr(settings, 'RANGO_TRENDING', {}))
+    return options
+
+
+def current_bucket(now=None, options=None):
+    """
+    The bucket of time [now], seconds since the epoch
+    """
+    options = options or get_trending_settings()
+    if now is None:
+        now = time.time()
+    return int(now // options['BUCKET'])
+
+
+def record(kind, field, deltas, now=None):
+    """
+    Adds {object id: amount} [deltas] to the [field] ('views' or 'likes')
+    of the current buckets of [kind]
+    """
+    deltas = {pk: amount for pk, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    bucket = current_bucket(now)
+    for attempt in range(3):
+        try:
+            with transaction.atomic():
+                _record(kind, field, deltas, bucket)
+            return
+        except IntegrityError:
+            # another process created one of the buckets first
+            if attempt == 2:
+                raise
+
+
+def _record(kind, field, deltas, bucket):
+    current = ActivityBucket.objects.filter(kind=kind, bucket=bucket)
+    existing = set(current.filter(object_id__in=list(deltas))
+                   .values_list('object_id', flat=True))
+
+    by_amount = collections.defaultdict(list)
+    for pk in existing:
+        by_amount[deltas[pk]].append(pk)
+    for amount, pks in by_amount.items():
+        current.filter(object_id__in=pks).update(**{field: F(field) + amount})
+
+    ActivityBucket.objects.bulk_create(
+        ActivityBucket(kind=kind, object_id=pk, bucket=bucket,
+                       **{field: amount})
+        for pk, amount in deltas.items() if pk not in existing)
+
+
+def scores(kind, seconds, now=None, options=None):
+    """
+    Returns (object id, score) of the best [kind] over the last
+    [seconds], best first, TOP * 2 at most
+    """
+    options = options or get_trending_settings()
+    bucket = current_bucket(now, options)
+    buckets = int(math.ceil(seconds / options['BUCKET']))
+    # buckets of age / half life, the half life as a fraction of a window
+    ages_per_bucket = 1.0 / (buckets * options['HALF_LIFE'])
+
+    weighted = ExpressionWrapper(
+        (F('views') + F('likes') * options['LIKE_WEIGHT']) /
+        (Value(1.0) + (Value(bucket) - F('bucket')) * Value(ages_per_bucket)),
+        output_field=FloatField())
+    return list(ActivityBucket.objects
+                .filter(kind=kind, bucket__gt=bucket - buckets)
+                .values('object_id').annotate(score=Sum(weighted))
+                .order_by('-score', 'object_id')
+                .values_list('object_id', 'score')[:options['TOP'] * 2])
+
+
+def _details(kind, pks):
+    # {pk: (title, url, slug)} of the pages or categories still there
+    if kind == ActivityBucket.PAGE:
+        return {pk: (title, url, '') for pk, title, url in
+                Page.objects.filter(pk__in=pks)
+                .values_list('pk', 'title', 'url')}
+    return {pk: (name, '', slug) for pk, name, slug in
+            Category.objects.filter(pk__in=pks)
+            .values_list('pk', 'name', 'slug')}
+
+
+@task()
+def compute_trending(now=None):
+    """
+    Replaces the Trending rankings of every window and deletes buckets
+    older than the longest one. Returns the number of rows ranked.
+    """
+    options = get_trending_settings()
+    rows = []
+    for window, seconds in sorted(options['WINDOWS'].items()):
+        for kind, label in ActivityBucket.KINDS:
+            scored = scores(kind, seconds, now, options)
+            details = _details(kind, [pk for pk, score in scored])
+            scored = [(pk, score) for pk, score in scored if pk in details]
+            for rank, (pk, score) in enumerate(scored[:options['TOP']], 1):
+                title, url, slug = details[pk]
+                rows.append(Trending(window=window, kind=kind, rank=rank,
+                                     object_id=pk, title=title, url=url,
+                                     slug=slug, score=score))
+
+    longest = max(options['WINDOWS'].values() or [0])
+    oldest = (current_bucket(now, options) -
+              int(math.ceil(longest / options['BUCKET'])))
+    with transaction.atomic():
+        Trending.objects.all().delete()
+        Trending.objects.bulk_create(rows)
+        ActivityBucket.objects.filter(bucket__lte=oldest).delete()
+    content_changed()
+    return len(rows)
+
+
+def ranking(window):
+    """
+    Returns {'page': [...], 'category': [...]}, the Trending rows of
+    [window] in order, with one query
+    """
+    ranked = {kind: [] for kind, label in ActivityBucket.KINDS}
+    for row in Trending.objects.filter(window=window).order_by('kind', 'rank'):
+        ranked[row.kind].append(row)
+    return ranked
@@ -20,18 +20,50 @@ urlpatterns = [
         views.add_page,
         name='add_page'),
 
+    url(r'^categories/$',
+        views.category_list,
+        name='category_list'),
+
     url(r'^category/(?P<category_name_slug>[\w\-]+)/$',
         views.show_category,
         name='show_category'),
 
+    url(r'^category/(?P<category_name_slug>[\w\-]+)/pages/$',
+        views.category_page_rows,
+        name='category_page_rows'),
+
+    url(r'^category/(?P<category_name_slug>[\w\-]+)/results/$',
+        views.category_search_results,
+        name='category_search_results'),
+
     url(r'^category/(?P<category_name_slug>[\w\-]+)/add_page/$',
         views.add_page,
         name='add_page'),
 
+    url(r'^export/$',
+        views.export,
+        name='export'),
+
     url(r'^logout/$',
         views.user_logout,
         name='logout'),
 
+    url(r'^metrics/$',
+        views.metrics,
+        name='metrics'),
+
+    url(r'^metrics/profiles/$',
+        views.metrics_profiles,
+        name='metrics_profiles'),
+
+    url(r'^tasks/$',
+        views.task_queue,
+        name='task_queue'),
+
+    url(r'^tasks/(?P<task_id>[0-9]+)/$',
+        views.task_status,
+        name='task_status'),
+
     url(r'^restricted/$',
         views.restricted,
         name='restricted'),
@@ -40,6 +72,10 @@ urlpatterns = [
         views.search,
         name='search'),
 
+    url(r'^search/results/$',
+        views.search_results,
+        name='search_results'),
+
     url(r'^goto/',
         views.track_url,
         name='goto'),
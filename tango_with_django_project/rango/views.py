@@ -1,75 +1,98 @@
-from datetime import datetime
+import functools
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.messages.views import SuccessMessageMixin
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.core.urlresolvers import reverse
-from django.shortcuts import render, redirect
-from django.http import HttpResponse, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
 from django.utils.decorators import method_decorator
 from django.views import generic
 
-from .models import Category, Page, UserProfile
+from . import (autocomplete, counters, directory, keyset, local_search, tasks,
+               thumbnails, trending)
+from .exporter import (FORMATS, InvalidCursorError, encode_rows,
+                       export_rows, gzip_stream, parse_cursor)
+from .aggregates import RANKING_TITLES, ranked_categories
+from .category_pages import category_pages
+from .category_search import category_search
+from .models import Category, Page, Task, UserProfile
 from .forms import CategoryForm, PageForm, RegistrationCrispyForm, SearchForm
 from .forms import UserProfileForm
-from .webhose_search import run_query
-
-
-def get_server_side_cookie(request, cookie, default_val=None):
-    val = request.session.get(cookie)
-    if not val:
-        val = default_val
-    return val
+from .instrumentation import (metrics as request_metrics, render_metrics,
+                              render_samples)
+from .page_cache import cache_public_page
+from .ratelimit import (RATELIMIT_METRICS, RATELIMIT_STORE_METRICS,
+                        get_rate_limiter)
+from .search_backends import SEARCH_METRICS, search_metrics
+from .sidebar import get_sidebar_settings
+from .trending import get_trending_settings
+from .visits import track_visit
+from .webhose_search import run_query_with_deadline
 
 
 def visitor_cookie_handler(request):
     """
     Get the number of visits to the site.
-    We use Cookies.get() to obtain the visits cookie.
-    If the cookie exists, the value returned is cast to an integer.
-    If the cookie doesn't exit, then the value is set to 1.
+    Visits are counted once per day in the session, see rango.visits.
+    The session is only written when the count changes.
     """
-    visits = int(get_server_side_cookie(request, 'visits', '1'))
-
-    last_visit_cookie = get_server_side_cookie(request, 
-                                               'last_visit', 
-                                               str(datetime.now()))
+    return track_visit(request)
 
-    last_visit_time = datetime.strptime(last_visit_cookie[:-7], 
-                                        '%Y-%m-%d %H:%M:%S')
 
-    # If it's been more than a day since the last visit
-    if (datetime.now() - last_visit_time).days > 0:
-        visits += 1
-        # Update last visit cookie
-        request.session['last_visit'] = str(datetime.now())
-    else:
-        visits = 1
-        # Set the last visit cookie
-        request.session['last_visit'] = last_visit_cookie
-
-    # Update/set visits cookie after creating or incrementing
-    request.session['visits'] = visits
+def track_visits(view_func):
+    """
+    Decorator running visitor_cookie_handler before the view, so the
+    visit count is in the session before a cached page is looked up.
+    """
+    @functools.wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        # Handle cookies and session data
+        visitor_cookie_handler(request)
+        return view_func(request, *args, **kwargs)
+    return _wrapped_view
 
 
+@track_visits
+@cache_public_page(vary_on_session=['visits'])
 def index(request):
     """
     View for index page.
-    Passes template a list of the top five rated categories, and
-    the top five most viewed pages.
+    Passes template a list of the top five trending categories and pages,
+    read from the rankings of rango.trending. Until those are computed,
+    or if INDEX_WINDOW is None, the top five categories are ranked as in
+    the sidebar and the pages by all-time views.
     """
 
-    request.session.set_test_cookie()
-    category_list = Category.objects.order_by('-likes')[:5]
-    pages_list = Page.objects.order_by('-views')[:5]
+    window = get_trending_settings()['INDEX_WINDOW']
+    ranked = trending.ranking(window) if window else {}
+
+    if ranked.get('category'):
+        category_list = ranked['category'][:5]
+        categories_title = 'Trending Categories'
+    else:
+        ranking = get_sidebar_settings()['ORDER']
+        category_list = ranked_categories(ranking)[:5]
+        categories_title = RANKING_TITLES[ranking]
 
-    # Handle cookies and session data
-    visitor_cookie_handler(request)
+    if ranked.get('page'):
+        pages_list = ranked['page'][:5]
+        pages_title = 'Trending Pages'
+    else:
+        pages_list = Page.objects.order_by('-views')[:5]
+        pages_title = 'Most Viewed Pages'
 
     context_dict = {
         'categories': category_list,
+        'categories_title': categories_title,
+        'trending_categories': bool(ranked.get('category')),
         'pages': pages_list,
+        'pages_title': pages_title,
         'visits': request.session['visits'],
     }
 
@@ -80,19 +103,14 @@ def index(request):
     return response
 
 
+@track_visits
+@cache_public_page(vary_on_session=['visits'])
 def about(request):
     """
     View for about page.
     Renders template with 'name' for demonstration purposes
     """
 
-    if request.session.test_cookie_worked():
-        print("TEST COOKIE WORKED!")
-        request.session.delete_test_cookie()
-
-    # Handle cookies and session data
-    visitor_cookie_handler(request)
-
     context_dict = {
         'name': "Jay Welborn",
         'visits': request.session['visits'],
@@ -100,17 +118,20 @@ def about(request):
     return render (request, 'rango/about.html', context=context_dict)
 
 
+@cache_public_page()
 def show_category(request, category_name_slug):
     """
     Detail view for category.
-    Loads category data and related page data into
-    context dictionary.
+    Loads category data and the first chunk of its pages, most viewed
+    first, into context dictionary. ?after= continues the list from
+    a cursor, see rango.category_pages.
     If specified category doesn't exist, returns
     empty list.
+    Search results for the category are not fetched here, the page loads
+    them from category_search_results once it's rendered.
     """
 
     context_dict = {}
-    result_list = []
 
     try:
         """
@@ -119,8 +140,8 @@ def show_category(request, category_name_slug):
 
         # retrieve category with the given slug
         category = Category.objects.get(slug=category_name_slug)
-        # retrieve pages matching the given category
-        pages = Page.objects.filter(category=category)
+        # retrieve a chunk of the pages matching the given category
+        pages = _category_pages_or_404(category, request.GET.get('after'))
         # load context dictionary
         context_dict['pages'] = pages
         context_dict['category'] = category
@@ -130,20 +151,76 @@ def show_category(request, category_name_slug):
         context_dict['category'] = None
         context_dict['pages'] = None
 
-    # get search results if method is POST
-    if request.method == 'POST':
+    # search form submitted without javascript
+    if request.method == 'POST' and context_dict['category']:
         query = request.POST['query'].strip()
         if query:
-            result_list = run_query(query)
-    else:
-        result_list = run_query(category.name)
-    
-    # add search results to context
-    context_dict['results_list'] = result_list
+            context_dict['results_list'] = run_query_with_deadline(query)
+            context_dict['searched'] = True
 
     return render(request, 'rango/category.html', context_dict)
 
 
+@cache_public_page()
+def category_page_rows(request, category_name_slug):
+    """
+    The next chunk of a category's pages after ?after=, as list items
+    appended to the category page by rango-ajax.js as the user scrolls.
+    """
+    category = get_object_or_404(Category, slug=category_name_slug)
+    return render(request, 'rango/page_rows.html', {
+        'category': category,
+        'pages': _category_pages_or_404(category, request.GET.get('after')),
+    })
+
+
+def _category_pages_or_404(category, after):
+    try:
+        return category_pages(category, after)
+    except keyset.InvalidCursorError:
+        raise Http404('Invalid cursor')
+
+
+@login_required
+def category_search_results(request, category_name_slug):
+    """
+    AJAX view returning the search results fragment for a category page.
+    Searches for ?query= if given, otherwise for the category's name and
+    top page titles at once, see rango.category_search.
+    Waits at most RANGO_SEARCH['DEADLINE'] seconds for the search provider.
+    """
+
+    category = get_object_or_404(Category, slug=category_name_slug)
+    query = request.GET.get('query', '').strip()
+
+    context_dict = {
+        'category': category,
+        'results_list': category_search(category, query),
+    }
+
+    return render(request, 'rango/search_results.html', context_dict)
+
+
+def category_list(request):
+    """
+    Paginated list of every category, most liked first.
+    The sidebar only shows the top categories and links here.
+    """
+
+    paginator = Paginator(
+        Category.objects.order_by('-likes', 'name').only('name', 'slug', 'likes'),
+        get_sidebar_settings()['PAGE_SIZE'])
+    try:
+        categories = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        categories = paginator.page(1)
+    except EmptyPage:
+        categories = paginator.page(paginator.num_pages)
+
+    return render(request, 'rango/category_list.html',
+                  {'categories': categories})
+
+
 @login_required
 def add_category(request):
     """
@@ -195,7 +272,7 @@ class MyRegistrationView(generic.FormView):
         """
         saves form, logs new user in, and returns HttpResponse
         """
-        form = form.save()
+        form.save()
         username = form.cleaned_data['username']
         password = form.cleaned_data['password']
         new_user = authenticate(username=username, password=password)
@@ -204,55 +281,96 @@ class MyRegistrationView(generic.FormView):
 
 
 def search(request):
-    result_list = []
-    form = SearchForm
-    context = {}
+    """
+    Searches Rango's own pages and categories (see rango.local_search),
+    whose hits are rendered right away. Web results are loaded by the
+    page afterwards from search_results, so it never waits on the
+    search provider.
+    """
+    query = ''
+    local_hits = []
 
     if request.method == 'POST':
         query = request.POST['query'].strip()
         if query:
-            result_list = run_query(query)
-
-    context['results_list'] = result_list
-    context['form'] = form
+            local_hits = local_search.search(query)
 
+    context = {
+        'query': query,
+        'local_hits': local_hits,
+        'form': SearchForm,
+    }
     return render(request, 'rango/search.html', context)
 
 
+def search_results(request):
+    """
+    AJAX view returning the web results fragment of the search page for
+    ?query=. Waits at most RANGO_SEARCH['DEADLINE'] seconds for the
+    search provider.
+    """
+    query = request.GET.get('query', '').strip()
+    context = {
+        'results_list': run_query_with_deadline(query) if query else [],
+    }
+    return render(request, 'rango/web_results.html', context)
+
+
 def track_url(request):
-    page_id = None
-    if request.method == 'GET':
-        if request.GET['page_id']:
-
-            # increments page's views
-            page = Page.objects.get(id=request.GET['page_id'])
-            page.views += 1
-            page.save()
-            # direct user to page clicked
-            return redirect(str(page.url))
-        else:
-            return reverse(index)
+    """
+    Counts a click on a page and redirects to it.
+    The view is buffered by rango.counters instead of saving the page.
+    """
+    page_id = request.GET.get('page_id')
+    if page_id:
+        try:
+            url = Page.objects.values_list('url', flat=True).get(id=page_id)
+        except Page.DoesNotExist:
+            return redirect('index')
+
+        # increments page's views
+        counters.incr(Page, page_id, 'views')
+        # direct user to page clicked
+        return redirect(str(url))
+
+    return redirect('index')
 
 @method_decorator(login_required, name='dispatch')
 class ProfileView(generic.DetailView):
-    """docstring for ProfileView"""
-    model = UserProfile
+    """
+    A user's profile, read with its user in one query
+    """
     template_name = 'rango/profile.html'
 
+    def get_queryset(self):
+        return directory.profiles()
+
 
 @method_decorator(login_required, name='dispatch')
 class ProfileUpdateView(SuccessMessageMixin, generic.FormView):
     """
     Allow users to edit their profiles after creation.
     Does not allow users to edit username or password.
+    A new picture gets its thumbnails in the background, see
+    rango.thumbnails.
     """
     template_name = 'rango/edit_profile.html'
     form_class = UserProfileForm
     success_url = '/rango/profile/edit'
     success_message = 'User Profile Updated Successfuly!'
 
+    def get_form_kwargs(self):
+        kwargs = super(ProfileUpdateView, self).get_form_kwargs()
+        try:
+            kwargs['instance'] = self.request.user.user_profile
+        except UserProfile.DoesNotExist:
+            # users made with createsuperuser have no profile yet
+            kwargs['instance'] = UserProfile.objects.create(
+                user=self.request.user)
+        return kwargs
+
     def form_valid(self, form):
-        form = form.save()
+        form.save()
         return super(ProfileUpdateView, self).form_valid(form)
     
 
@@ -260,10 +378,27 @@ class ProfileUpdateView(SuccessMessageMixin, generic.FormView):
 @method_decorator(login_required, name='dispatch')
 class ListUsers(generic.ListView):
     """
-    View for showing all users
+    View for showing all users, by username, one page at a time.
+    Pages are addressed with ?after= and ?before= cursors, see
+    rango.directory.
     """
     template_name = 'rango/list_users.html'
-    model = UserProfile
+
+    def get_queryset(self):
+        try:
+            self.page = directory.directory_page(
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before'))
+        except keyset.InvalidCursorError:
+            raise Http404('Invalid cursor')
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super(ListUsers, self).get_context_data(**kwargs)
+        context['page'] = self.page
+        context['user_count'] = directory.profile_count()
+        context['thumbnail_size'] = thumbnails.get_thumbnail_settings()['SIZE']
+        return context
 
 
 @login_required
@@ -276,15 +411,20 @@ def like_category(request):
     """
     cat_id = None
     if request.method == 'GET':
-        cat_id = request.GET['cat_id']
+        cat_id = request.GET.get('cat_id')
 
     likes = 0
     if cat_id:
-        cat = Category.objects.get(id=int(cat_id))
-        if cat:
-            cat.likes += 1
-            likes = cat.likes
-            cat.save()
+        # only existing categories are counted, flushes write every id
+        try:
+            likes = Category.objects.values_list('likes', flat=True).get(
+                pk=int(cat_id))
+        except (ValueError, Category.DoesNotExist):
+            raise Http404('No such category')
+
+        likes += counters.get_counter_buffer().pending(
+            Category, cat_id, 'likes') + 1
+        counters.incr(Category, cat_id, 'likes')
 
     return HttpResponse(likes)
 
@@ -293,7 +433,9 @@ def like_category(request):
 def add_page(request):
     """
     Adds page to pages in category. Only accessible via AJAX call from
-    category page
+    category page.
+    Returns only the list item of the added page, which rango-ajax.js
+    puts at the top of the page list.
     """
     cat_id = None
     url = None
@@ -307,32 +449,111 @@ def add_page(request):
 
     if cat_id:
         cat = Category.objects.get(id=int(cat_id))
-        page = Page.objects.get_or_create(category=cat, title=name, url=url)
-        pages = Page.objects.filter(category=cat).order_by('-views')
-        context['pages'] = pages
+        page = Page.objects.get_or_create(category=cat, title=name, url=url)[0]
+        context['pages'] = [page]
 
-    return render(request, 'rango/page_list.html', context)
+    return render(request, 'rango/page_rows.html', context)
 
 
 def get_category_list(max_results=0, starts_with=''):
-    cat_list = []
-    if starts_with:
-        cat_list = Category.objects.filter(name__startswith=starts_with)
+    """
+    Returns up to [max_results] categories whose name starts with
+    [starts_with], ignoring case, most liked first.
+    Served from the in-memory index in rango.autocomplete.
+    """
+    return autocomplete.suggest(starts_with, max_results or None)
 
-    if max_results > 0:
-        if len(cat_list) > max_results:
-            cat_list = cat_list[:max_results]
 
-    return cat_list
+def suggest_category(request):
+    """
+    AJAX view for the sidebar search box.
+    Returns matching categories as JSON.
+    """
+    starts_with = request.GET.get('suggestion', '')
 
+    cat_list = get_category_list(max_results=8, starts_with=starts_with)
 
-def suggest_category(request):
-    cat_list = []
-    starts_with = ''
+    return JsonResponse({'categories': [
+        {
+            'name': cat.name,
+            'url': reverse('rango:show_category', args=[cat.slug]),
+            'likes': cat.likes,
+        }
+        for cat in cat_list
+    ]})
 
-    if request.method == 'GET':
-        starts_with = request.GET['suggestion']
 
-    cat_list = get_category_list(max_results=8, starts_with=starts_with)
+@login_required
+def export(request):
+    """
+    Streams every category and page as JSON lines (or CSV with
+    ?format=csv), gzip compressed when the client accepts it.
+    ?after=<cursor> resumes after the last row a client received.
+    """
+    format = request.GET.get('format', 'jsonl')
+    if format not in FORMATS:
+        return HttpResponseBadRequest('Unknown format')
+
+    after = request.GET.get('after')
+    try:
+        parse_cursor(after)
+    except InvalidCursorError:
+        return HttpResponseBadRequest('Invalid cursor')
+
+    chunks = encode_rows(export_rows(after), format)
+    compress = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if compress:
+        chunks = gzip_stream(chunks)
+
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[format])
+    response['Content-Disposition'] = (
+        'attachment; filename="rango.{0}"'.format(format))
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+@staff_member_required
+def metrics(request):
+    """
+    Per view request totals from rango.instrumentation, in the Prometheus
+    text format, empty unless RANGO_INSTRUMENTATION is enabled, followed
+    by the search cache and circuit breaker counters and the rate
+    limiter's.
+    """
+    limiter = get_rate_limiter()
+    text = (render_metrics() +
+            render_samples(SEARCH_METRICS, search_metrics()) +
+            render_metrics(limiter.snapshot(), RATELIMIT_METRICS) +
+            render_samples(RATELIMIT_STORE_METRICS, limiter.store_metrics()))
+    return HttpResponse(text, content_type='text/plain; version=0.0.4')
+
 
-    return render(request, 'rango/cats.html', {'cats': cat_list})
+@staff_member_required
+def metrics_profiles(request):
+    """
+    Profiler reports of the slowest sampled requests, slowest first
+    """
+    sections = []
+    for profile in request_metrics.profiles():
+        sections.append('{view} {path} {seconds:.3f}s\n\n{report}'.format(
+            **profile))
+    return HttpResponse('\n\n'.join(sections), content_type='text/plain')
+
+
+
+@staff_member_required
+def task_status(request, task_id):
+    """
+    JSON status of one queued task, see rango.tasks
+    """
+    return JsonResponse(tasks.describe(get_object_or_404(Task, pk=task_id)))
+
+
+@staff_member_required
+def task_queue(request):
+    """
+    JSON number of tasks per status and how late the oldest due task is
+    """
+    return JsonResponse(tasks.queue_stats())
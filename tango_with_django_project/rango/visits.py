@@ -0,0 +1,66 @@
+"""
+Visit tracking for the index and about pages.
+
+The session holds two values:
+    visits = number of days on which the user visited Rango
+    last_visit = ISO 8601 timestamp of the first visit on the latest day
+
+Both are only written on a user's first visit and when the local date
+changed since last_visit, so a session backend is written about once per
+user per day instead of on every page view. The values are plain strings
+and integers, so they work with every session backend, including
+signed_cookies and cached_db.
+"""
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+def parse_visit_time(value):
+    """
+    Returns [value] as an aware datetime, or None if it can't be parsed.
+    Accepts ISO 8601 strings, str(datetime) output and POSIX timestamps.
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, timezone.utc)
+
+    # parse_datetime also reads the str(datetime) values stored by
+    # older versions of visitor_cookie_handler
+    try:
+        parsed = parse_datetime(str(value).strip())
+    except ValueError:
+        return None
+
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def track_visit(request, now=None):
+    """
+    Records a visit in request.session and returns the number of visits.
+    The session is only modified when a new day's visit is counted.
+    """
+    session = request.session
+    now = now or timezone.now()
+    last_visit = parse_visit_time(session.get('last_visit'))
+
+    try:
+        visits = int(session.get('visits', 0))
+    except (TypeError, ValueError):
+        visits = 0
+
+    if last_visit is None or visits < 1:
+        visits = 1
+    elif timezone.localtime(now).date() > timezone.localtime(last_visit).date():
+        visits += 1
+    else:
+        return visits
+
+    session['visits'] = visits
+    session['last_visit'] = now.isoformat()
+    return visits
@@ -1,16 +1,31 @@
-import json
+import collections
+import concurrent.futures
+import functools
+import itertools
+import logging
 import os
 import urllib.parse
-import urllib.request
 from sys import argv
 
 from django.conf import settings
 
+from .instrumentation import timed
+from .search_backends import (SearchError, get_search_executor,
+                              get_search_service, get_search_settings,
+                              normalize_query)
+from .tasks import task
+
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
 def read_webhose_key():
     """
     Reads the Webhose API key from a file called 'search.key'
     Returns either None (no key), or a string representing the key
     Search.key is in .gitignore so it won't be commited to version control
+    The key is only read from disk once per process.
     """
 
     webhose_api_key = None
@@ -38,47 +53,107 @@ def run_query(search_terms, size=10):
     run_query searches webhose for [search_terms]
     and returns [size] results. Each result consists
     of a title, link, and summary
+
+    Results come from the configured search backend (see
+    rango.search_backends), so repeated queries are served from cache.
+    A failed search, or one refused because the search provider keeps
+    failing, returns no results.
     """
 
-    webhose_api_key = read_webhose_key()
+    results = []
 
-    if not webhose_api_key:
-        raise KeyError('Webhose API key not found')
+    try:
+        with timed('search'):
+            results = get_search_service().search(search_terms, size)
+    except SearchError as e:
+        logger.warning('Search for %r failed: %s', search_terms, e)
 
-    # base URL for webhose API
-    root_url = 'http://webhose.io/search'
+    # return results
+    return results
 
-    # format query string for URLs
-    query_string = urllib.parse.quote(search_terms)
+def run_query_with_deadline(search_terms, size=10, timeout=None):
+    """
+    Runs run_query on the search executor and waits at most [timeout]
+    seconds (RANGO_SEARCH['DEADLINE'] by default) for the results.
+    Returns None if the deadline passed. The search keeps running in the
+    background, so its results still end up in the cache.
+    """
+    if timeout is None:
+        timeout = get_search_settings()['DEADLINE']
 
-    # use str.format() method to construct a complete
-    # URL for the webhose API.
-    search_url = ('{root_url}?token={key}&format=json&q={query}'
-                  '&sort=relevancy&size={size}').format(
-                    root_url=root_url,
-                    key=webhose_api_key,
-                    query=query_string,
-                    size=size)
+    future = get_search_executor().submit(run_query, search_terms, size)
+    try:
+        # run_query isn't timed on the executor's thread, time the wait
+        with timed('search'):
+            return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        return None
 
-    results = []
 
-    try:
-        # Connect to webhose API and convert response
-        # into a Python Dictionary.
-        response = urllib.request.urlopen(search_url).read().decode('utf-8')
-        json_response = json.loads(response)
-
-        # loop through json_response converting each json object into a 
-        # dictionary and add it to the list of results
-        for post in json_response['posts']:
-            results.append({'title': post['title'],
-                            'link': post['url'],
-                            'summary': post['text'][:200]})
-    except:
-        print("Error when querying Webhose API")
+def run_queries(queries, size=10, timeout=None):
+    """
+    Runs every one of [queries] at once on the search executor, [size]
+    results each, and returns their results merged by merge_results().
+    The wait is bounded by the slowest query, not the sum of them, and
+    by [timeout] seconds (RANGO_SEARCH['DEADLINE'] by default); queries
+    still running then are left out, and their results still end up in
+    the cache. Returns None if none finished in time.
+    """
+    if timeout is None:
+        timeout = get_search_settings()['DEADLINE']
+
+    unique = collections.OrderedDict()
+    for query in queries:
+        if normalize_query(query):
+            unique.setdefault(normalize_query(query), query)
+
+    executor = get_search_executor()
+    futures = [executor.submit(run_query, query, size)
+               for query in unique.values()]
+    with timed('search'):
+        done, pending = concurrent.futures.wait(futures, timeout)
+    if not done:
+        return None
+    return merge_results([f.result() for f in futures if f in done])
+
+
+def normalize_link(link):
+    """
+    [link] with a lower case scheme and host, and no fragment or
+    trailing slash, so the same page is recognised under small variations
+    """
+    parts = urllib.parse.urlsplit(link.strip())
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                                    parts.path.rstrip('/'), parts.query, ''))
+
+
+def merge_results(result_lists):
+    """
+    Interleaves [result_lists], taking each list's best result in turn,
+    and drops results whose link was already taken
+    """
+    seen = set()
+    merged = []
+    for results in itertools.zip_longest(*result_lists):
+        for result in results:
+            if result is None:
+                continue
+            link = normalize_link(result['link'])
+            if link not in seen:
+                seen.add(link)
+                merged.append(result)
+    return merged
+
+
+@task()
+def warm_search(search_terms, size=10):
+    """
+    Searches for [search_terms] in the task worker, so the results are in
+    the cache before a visitor asks. Only useful when the search cache is
+    shared ('django'). Search errors are raised, so the task is retried.
+    """
+    return len(get_search_service().search(search_terms, size))
 
-    # return results
-    return results
 
 def main():
     """
@@ -0,0 +1,198 @@
+"""
+Concurrent write throughput benchmark, run by the benchmark_writes
+management command.
+
+Threads, each with its own database connection, repeat the writes of
+Rango's busiest views for a number of seconds:
+
+    track_url = UPDATE of a page's views, as flushed by rango.counters
+    like_category = UPDATE of a category's likes
+    add_page = INSERT of a page, which also updates the search index
+
+picked at random in the proportions of WRITE_MIX. Connections are closed
+and reopened between writes as they are between requests, so
+CONN_MAX_AGE counts. Every CONFIGURATIONS entry for the database vendor
+is run in turn, and the report gives per configuration and number of
+threads:
+
+    writes = writes committed
+    per_second = writes committed per second, over all threads
+    p50_ms, p95_ms = time per write, waiting for locks included
+    errors = writes that failed, e.g. with 'database is locked'
+"""
+import contextlib
+import random
+import threading
+import time
+
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import F
+from django.test import override_settings
+
+from .benchmark import percentile
+from .database import get_sqlite_settings, journal_mode_statement
+from .models import Category, Page
+
+
+WRITE_MIX = {
+    'track_url': 8,
+    'like_category': 1,
+    'add_page': 1,
+}
+
+
+class WriteConfiguration(object):
+    """
+    Database settings a run is measured with. [sqlite] overrides
+    RANGO_SQLITE, [conn_max_age] the database's CONN_MAX_AGE.
+    """
+
+    def __init__(self, name, sqlite=None, conn_max_age=0):
+        self.name = name
+        self.sqlite = sqlite or {}
+        self.conn_max_age = conn_max_age
+
+    @contextlib.contextmanager
+    def apply(self):
+        """
+        Context manager connecting with this configuration
+        """
+        # new connections read the settings dictionary shared by every
+        # thread
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        connection.settings_dict['CONN_MAX_AGE'] = self.conn_max_age
+        try:
+            with override_settings(RANGO_SQLITE=self.sqlite):
+                yield
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+
+
+# SQLite's defaults as Django opens it, then rango.database's tuning
+SQLITE_UNTUNED = {'JOURNAL_MODE': 'delete', 'SYNCHRONOUS': 'full',
+                  'BUSY_TIMEOUT': None, 'CACHE_SIZE': None,
+                  'TEMP_STORE': None, 'MMAP_SIZE': None,
+                  'TRANSACTION_MODE': None}
+
+CONFIGURATIONS = {
+    'sqlite': [
+        WriteConfiguration('rollback journal', sqlite=SQLITE_UNTUNED),
+        WriteConfiguration('wal'),
+        WriteConfiguration('wal, persistent', conn_max_age=60),
+    ],
+    'postgresql': [
+        WriteConfiguration('reconnecting'),
+        WriteConfiguration('persistent', conn_max_age=60),
+    ],
+}
+
+
+class Targets(object):
+    """
+    Rows the writes point at
+    """
+
+    def __init__(self):
+        self.page_ids = list(Page.objects.values_list('pk', flat=True)[:1000])
+        self.category_ids = list(
+            Category.objects.values_list('pk', flat=True)[:100])
+
+
+def write(name, targets, rng):
+    """
+    Runs one write named after the view doing it
+    """
+    if name == 'track_url':
+        Page.objects.filter(pk=rng.choice(targets.page_ids)).update(
+            views=F('views') + 1)
+    elif name == 'like_category':
+        Category.objects.filter(pk=rng.choice(targets.category_ids)).update(
+            likes=F('likes') + 1)
+    elif name == 'add_page':
+        number = rng.getrandbits(48)
+        Page.objects.create(category_id=rng.choice(targets.category_ids),
+                            title='Written {0}'.format(number),
+                            url='http://example.com/written/{0}'.format(
+                                number))
+    else:
+        raise ValueError('Unknown write {0!r}'.format(name))
+
+
+def write_loop(targets, seconds, mix=WRITE_MIX, seed=0, reconnect=True):
+    """
+    Writes for [seconds] and returns (times in milliseconds, errors).
+    With [reconnect] the connection is handled as between requests.
+    """
+    rng = random.Random(seed)
+    names = [name for name, weight in sorted(mix.items())
+             for i in range(weight)]
+    times = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if reconnect:
+            close_old_connections()
+        started = time.perf_counter()
+        try:
+            write(rng.choice(names), targets, rng)
+        except DatabaseError:
+            errors += 1
+        else:
+            times.append((time.perf_counter() - started) * 1000)
+    return times, errors
+
+
+def run_writers(targets, threads, seconds, mix=WRITE_MIX):
+    """
+    Runs write_loop() on [threads] threads and returns their totals
+    """
+    results = []
+
+    def writer(seed):
+        try:
+            results.append(write_loop(targets, seconds, mix, seed))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=writer, args=(seed,))
+               for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    times = [t for thread_times, errors in results for t in thread_times]
+    return {
+        'threads': threads,
+        'writes': len(times),
+        'per_second': round(len(times) / seconds, 1),
+        'p50_ms': round(percentile(times, 0.5), 3) if times else None,
+        'p95_ms': round(percentile(times, 0.95), 3) if times else None,
+        'errors': sum(errors for thread_times, errors in results),
+    }
+
+
+def run_write_benchmark(threads=(1, 4, 8), seconds=5.0, configurations=None):
+    """
+    Measures every configuration for the database in use with each
+    number of [threads]. Returns the report as a dictionary.
+    """
+    if configurations is None:
+        configurations = CONFIGURATIONS.get(
+            connection.vendor, [WriteConfiguration('default')])
+    targets = Targets()
+    report = {'vendor': connection.vendor, 'seconds': seconds,
+              'configurations': {}}
+    for configuration in configurations:
+        with configuration.apply():
+            # the journal mode can only change while nothing else is
+            # connected, so it's set before the writers connect
+            connection.close()
+            mode = get_sqlite_settings()['JOURNAL_MODE']
+            if connection.vendor == 'sqlite' and mode:
+                with connection.cursor() as cursor:
+                    cursor.execute(journal_mode_statement(mode))
+            report['configurations'][configuration.name] = [
+                run_writers(targets, count, seconds) for count in threads]
+    connection.close()
+    return report
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -51,8 +52,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it times everything below; off unless RANGO_INSTRUMENTATION
+    # is enabled
+    'rango.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # refuses AJAX requests over their limit before the session is loaded
+    'rango.ratelimit.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # keeps reads on the primary after a user's writes, off without replicas
+    'rango.replicas.ReplicaPinMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -84,14 +92,121 @@ WSGI_APPLICATION = 'tango_with_django_project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
+# SQLite in db.sqlite3 unless the environment says otherwise, e.g.
+#
+#   RANGO_DB_ENGINE=postgresql RANGO_DB_NAME=rango RANGO_DB_USER=rango
+#   RANGO_DB_PASSWORD=... RANGO_DB_HOST=db.example.com
+#
+# which needs psycopg2 installed. Connections are kept open for
+# RANGO_DB_CONN_MAX_AGE seconds (60 for PostgreSQL, 0 for SQLite).
+# Behind a transaction pooler such as PgBouncer set RANGO_DB_POOLER=1 and
+# point RANGO_DB_HOST/PORT at the pooler: queries of one cursor may then
+# reach different server connections, so server side cursors are off.
+
+DB_ENGINE = os.environ.get('RANGO_DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'sqlite3':
+    DATABASES = {
+        'default': {
+            # Django's, with configurable transaction modes
+            'ENGINE': 'rango.backends.sqlite3',
+            'NAME': os.environ.get('RANGO_DB_NAME',
+                                   os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.environ.get('RANGO_DB_CONN_MAX_AGE', 0)),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.' + DB_ENGINE,
+            'NAME': os.environ.get('RANGO_DB_NAME', 'rango'),
+            'USER': os.environ.get('RANGO_DB_USER', ''),
+            'PASSWORD': os.environ.get('RANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('RANGO_DB_HOST', ''),
+            'PORT': os.environ.get('RANGO_DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('RANGO_DB_CONN_MAX_AGE', 60)),
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get(
+                'RANGO_DB_POOLER', '').lower() in ('1', 'true', 'yes', 'on'),
+        }
+    }
+
+# Read replicas, a comma separated RANGO_DB_REPLICAS of host names, or of
+# file names for SQLite, each copied from the primary by replication.
+# The test runner points them at the primary's test database.
+
+for number, replica in enumerate(
+        filter(None, os.environ.get('RANGO_DB_REPLICAS', '').split(',')), 1):
+    DATABASES['replica{0}'.format(number)] = dict(
+        DATABASES['default'], TEST={'MIRROR': 'default'},
+        **{'NAME' if DB_ENGINE == 'sqlite3' else 'HOST': replica})
+
+DATABASE_ROUTERS = ['rango.replicas.ReplicaRouter']
+
+# Rango Replica Settings
+# Reads go to the replicas, except for a while after a user's writes, see
+# rango/replicas.py
+
+RANGO_REPLICAS = {
+    'DATABASES': sorted(alias for alias in DATABASES if alias != 'default'),
+    'PIN_SECONDS': 10,
+}
+
+# Rango SQLite Settings
+# Pragmas set on every SQLite connection, see rango/database.py. The
+# journal mode is stored in the database file, set it with
+# manage.py set_journal_mode.
+
+RANGO_SQLITE = {
+    'JOURNAL_MODE': 'wal',
+    'SYNCHRONOUS': 'normal',
+    'BUSY_TIMEOUT': 5000,
+    # writing transactions wait for each other instead of failing
+    'TRANSACTION_MODE': 'immediate',
+}
+
 
-DATABASES = {
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# Must be shared by every web process and the task worker: the page
+# cache's content stamp (rango/page_cache.py), the autocomplete index
+# generation (rango/autocomplete.py), rate limit buckets and 'cache'
+# counters only reach other processes through it. A per-process cache
+# such as locmem would keep serving pages cached before another process's
+# writes.
+#
+# Files under the system's temporary directory by default, which only
+# suit development: their incr is a read then a write, so concurrent rate
+# limit checks, counters and versions lose updates, and past MAX_ENTRIES
+# random keys are culled, control keys included. Production needs a
+# cache with an atomic incr, e.g.
+#
+#   RANGO_CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+#   RANGO_CACHE_LOCATION=127.0.0.1:11211
+#
+# Tests get a cache of their own, see rango/test_runner.py.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'BACKEND': os.environ.get(
+            'RANGO_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get(
+            'RANGO_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'rango-cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
+TEST_RUNNER = 'rango.test_runner.RangoTestRunner'
+
+# Sessions
+# https://docs.djangoproject.com/en/1.11/topics/http/sessions/
+# Rango only writes the session when it changes (see rango/visits.py), and
+# cached_db serves reads from the cache. signed_cookies works as well and
+# keeps sessions out of the database entirely.
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -147,6 +262,10 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# collectstatic writes hashed names and compressed copies to STATIC_ROOT,
+# served by the WSGI application, see rango/static_assets.py
+STATICFILES_STORAGE = 'rango.static_assets.CompressedManifestStorage'
+
 # Media files (user-updloaded photos, audio, etc.)
 
 MEDIA_URL = '/media/'
@@ -171,3 +290,185 @@ LOGIN_URL = '/accounts/login/'
 # http://django-crispy-forms.readthedocs.io/en/latest/
 
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
+
+# Rango Search Settings
+# See rango/search_backends.py for every available option
+
+RANGO_SEARCH = {
+    'BACKEND': 'rango.search_backends.WebhoseBackend',
+    'TIMEOUT': 3.0,
+    'POOL_SIZE': 4,
+    # 'local' caches results in each process, 'django' uses CACHES
+    'CACHE': 'local',
+    'CACHE_TTL': 60 * 15,
+    # stale results are served for this long while they're refreshed
+    'STALE_TTL': 60 * 60,
+    'CACHE_SIZE': 256,
+    # stop calling Webhose for BREAKER_RESET seconds after
+    # BREAKER_THRESHOLD failures in a row
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RESET': 30,
+    'BREAKER_PROBES': 1,
+    # category pages wait at most DEADLINE seconds for search results
+    'WORKERS': 8,
+    'DEADLINE': 2.0,
+    # category pages also search for the titles of their top pages
+    'RELATED_QUERIES': 3,
+}
+
+# Rango Local Search Settings
+# The search page first lists Rango's own pages and categories, found in
+# a full-text index, see rango/local_search.py
+
+RANGO_LOCAL_SEARCH = {
+    'LIMIT': 10,
+    'TITLE_WEIGHT': 10.0,
+    # only the newest matches are ranked, so common words stay fast
+    'CANDIDATES': 1000,
+}
+
+# Rango Counter Settings
+# Page views and category likes are buffered and written in batches,
+# see rango/counters.py
+
+RANGO_COUNTERS = {
+    # 'memory' buffers in each process, 'cache' shares the buffer via CACHES
+    'STORE': 'memory',
+    # seconds between writes, 0 writes every increment straight through
+    'FLUSH_INTERVAL': 5,
+}
+
+# Rango Sidebar Settings
+# The sidebar is cached and only shows the top categories,
+# see rango/sidebar.py
+
+RANGO_SIDEBAR = {
+    'TOP': 20,
+    # 'likes', 'views' (of the category's pages) or 'pages', also ranks the
+    # categories of the index page
+    'ORDER': 'likes',
+    'PAGE_SIZE': 50,
+    'TIMEOUT': 60 * 60,
+}
+
+# Rango Page Cache Settings
+# Anonymous responses of index, about and show_category are cached and
+# revalidated with ETag/Last-Modified, see rango/page_cache.py
+
+RANGO_PAGE_CACHE = {
+    'ENABLED': True,
+    'TIMEOUT': 60 * 5,
+    # seconds the views and likes of cached pages may lag behind
+    'COUNTERS_MAX_AGE': 60,
+}
+
+# Rango Instrumentation Settings
+# Per view timings of requests, queries, templates, searches and sessions,
+# served to staff at /rango/metrics/, see rango/instrumentation.py
+
+RANGO_INSTRUMENTATION = {
+    'ENABLED': False,
+    # profile a sample of requests and keep the slowest ones
+    'PROFILE_SLOWEST': 0,
+    'PROFILE_RATE': 0.01,
+    'PROFILER': 'cprofile',
+}
+
+# Rango User Directory Settings
+# The user list is paginated by username with cursors and shows a cached
+# total, see rango/directory.py
+
+RANGO_USERS = {
+    'PAGE_SIZE': 50,
+    'COUNT_TIMEOUT': 60 * 60,
+}
+
+# Rango Category Pages Settings
+# Category pages show their pages in chunks, more are loaded on scroll,
+# see rango/category_pages.py
+
+RANGO_CATEGORY_PAGES = {
+    'PAGE_SIZE': 25,
+}
+
+# Rango Thumbnail Settings
+# Profile pictures are resized by a task to square JPEG/PNG and WebP
+# thumbnails for the user list, see rango/thumbnails.py
+
+RANGO_THUMBNAILS = {
+    'SIZE': 128,
+    'QUALITY': 85,
+}
+
+# Rango Task Settings
+# Slow work is queued in the database and run by
+# `python manage.py run_tasks`, see rango/tasks.py
+
+RANGO_TASKS = {
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF': 10,
+    'LEASE': 60 * 5,
+    # dotted task path: seconds between runs, e.g. with the 'cache' counter
+    # store and FLUSH_INTERVAL None:
+    # 'rango.counters.flush_counters': 5,
+    'PERIODIC': {
+        'rango.trending.compute_trending': 60 * 5,
+    },
+}
+
+# Rango Trending Settings
+# Views and likes are counted per bucket of time, and the worker ranks
+# the hottest pages and categories of each window for the index page,
+# see rango/trending.py
+
+RANGO_TRENDING = {
+    'BUCKET': 60 * 10,
+    'WINDOWS': {
+        '1h': 60 * 60,
+        '24h': 60 * 60 * 24,
+        '7d': 60 * 60 * 24 * 7,
+    },
+    # recent activity counts most: a bucket's weight halves after this
+    # fraction of the window
+    'HALF_LIFE': 0.25,
+    'LIKE_WEIGHT': 5,
+    'TOP': 10,
+    'INDEX_WINDOW': '24h',
+}
+
+# Rango Static Settings
+# Collected static files are served by wsgi.py with far-future caching and
+# precompressed copies, see rango/static_assets.py
+
+RANGO_STATIC = {
+    'SERVE': True,
+    # seconds browsers keep files with hashed names, and others
+    'MAX_AGE': 60 * 60 * 24 * 365,
+    'UNHASHED_MAX_AGE': 60,
+    # extensions written compressed by collectstatic
+    'COMPRESS': ['css', 'js', 'svg', 'ico', 'txt', 'json', 'map'],
+    'MIN_SIZE': 256,
+}
+
+# Rango Rate Limit Settings
+# The AJAX endpoints answer clients over their limit with 429,
+# see rango/ratelimit.py
+
+RANGO_RATELIMIT = {
+    'ENABLED': True,
+    # 'cache' shares buckets through CACHES, 'memory' keeps them per process
+    'STORE': 'cache',
+    # URL name: (requests, seconds), a client may burst all the requests
+    # at once, then gets them back one by one over the seconds
+    'LIMITS': {
+        'like_category': (10, 60),
+        'add_page': (20, 60),
+        'suggest_category': (20, 10),
+        'goto': (30, 60),
+    },
+    # clients with a session also share a bucket this many times larger
+    # with their IP address
+    'IP_MULTIPLIER': 5,
+    'IP_HEADER': 'REMOTE_ADDR',
+}
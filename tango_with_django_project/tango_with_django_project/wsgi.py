@@ -2,6 +2,8 @@
 WSGI config for tango_with_django_project project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+Collected static files are served in front of Django, see
+rango/static_assets.py.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/1.11/howto/deployment/wsgi/
@@ -14,3 +16,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tango_with_django_project.settings")
 
 application = get_wsgi_application()
+
+from rango.static_assets import StaticFilesMiddleware  # noqa: E402
+
+application = StaticFilesMiddleware(application)